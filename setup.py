@@ -153,8 +153,9 @@ if __name__ == "__main__":
     setup(
         name = "testrig",
         version = version,
-        packages = ['testrig'],
-        entry_points = {'console_scripts': ['testrig = testrig:main']},
+        packages = ['testrig', 'testrig.history'],
+        entry_points = {'console_scripts': ['testrig = testrig:main',
+                                            'testrig-history = testrig.history.__main__:main']},
         install_requires = [
             'joblib',
         ],
@@ -1,3 +1,5 @@
 from __future__ import absolute_import, division, print_function
 from testrig.cli import main
-main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Benchmark timings and their comparison.
+
+Benchmark suites write their timings as JSON, in the format of
+pytest-benchmark (``--benchmark-json=FILE``) or asv (its results
+files).  The benchmark command is run several times in each
+environment, and the samples of all runs are pooled.  A benchmark is
+significantly slower in 'new' if the confidence intervals of the
+medians do not overlap and the ratio of the medians exceeds a factor.
+
+The confidence intervals of the medians are distribution-free, from the
+order statistics of the samples.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import io
+import glob
+import json
+import itertools
+import functools
+
+
+# Confidence level of the intervals of the medians
+CONFIDENCE = 0.95
+
+
+def parse_pytest_benchmark(text, cwd, param):
+    """
+    Parse a pytest-benchmark JSON file (default: benchmark.json).
+
+    Returns
+    -------
+    timings : dict
+        Samples in seconds, {benchmark: [seconds, ...]}.
+    err_msg : str or None
+        Error message, if the file could not be parsed.
+
+    """
+    filename = param if param is not None else 'benchmark.json'
+    data, err_msg = _load_json(cwd, filename)
+    if err_msg is not None:
+        return {}, err_msg
+
+    timings = {}
+    try:
+        for bench in data['benchmarks']:
+            name = bench.get('fullname', bench['name'])
+            stats = bench['stats']
+            samples = stats.get('data') or bench.get('data')
+            if not samples:
+                samples = [stats['median']]
+            timings[name] = [float(x) for x in samples]
+    except (KeyError, TypeError, ValueError) as exc:
+        return {}, "ERROR: invalid pytest-benchmark file '{0}': {1!r}".format(filename, exc)
+
+    return timings, None
+
+
+def parse_asv(text, cwd, param):
+    """
+    Parse an asv results JSON file.  `param` may be a glob pattern, of
+    which the newest file is used (default: .asv/results/*/*.json,
+    excluding machine.json).  Benchmarks of parameters get a name for
+    each combination of parameters.  ``track_*`` benchmarks are ignored,
+    as it is not known which way is worse.
+
+    Returns
+    -------
+    timings : dict
+        Samples, {benchmark: [value, ...]}.
+    err_msg : str or None
+        Error message, if the file could not be parsed.
+
+    """
+    pattern, filenames = _get_asv_files(cwd, param)
+    if not filenames:
+        return {}, "ERROR: asv results file '{0}' not found".format(pattern)
+    filename = max(filenames, key=os.path.getmtime)
+
+    data, err_msg = _load_json(cwd, filename)
+    if err_msg is not None:
+        return {}, err_msg
+
+    timings = {}
+    try:
+        columns = data.get('result_columns')
+        for name, value in data['results'].items():
+            if name.rsplit('.', 1)[-1].startswith('track_'):
+                continue
+            if columns is not None and isinstance(value, list):
+                value = dict(zip(columns, value))
+            elif not isinstance(value, dict):
+                value = {'result': value}
+
+            params = value.get('params') or []
+            results = value.get('result')
+            samples = value.get('samples')
+            if params:
+                names = ["{0}({1})".format(name, ", ".join(combination))
+                         for combination in itertools.product(*params)]
+            else:
+                names = [name]
+                if not isinstance(results, list):
+                    results = [results]
+                    samples = [samples]
+            if samples is None:
+                samples = [None] * len(results)
+
+            for bench_name, result, bench_samples in zip(names, results, samples):
+                if bench_samples:
+                    timings[bench_name] = [float(x) for x in bench_samples]
+                elif result is not None:
+                    timings[bench_name] = [float(result)]
+    except (KeyError, TypeError, ValueError) as exc:
+        return {}, "ERROR: invalid asv results file '{0}': {1!r}".format(filename, exc)
+
+    return timings, None
+
+
+def _get_asv_files(cwd, param):
+    pattern = param if param is not None else os.path.join('.asv', 'results', '*', '*.json')
+    filenames = [fn for fn in glob.glob(os.path.join(cwd, pattern))
+                 if os.path.basename(fn) != 'machine.json']
+    return pattern, filenames
+
+
+def get_bench_result_files(parser, cwd):
+    """
+    Existing result files in `cwd` read by a parser from
+    get_bench_parser, to be removed before running the benchmarks, so
+    that the results of an earlier run are not read again.
+    """
+    param = parser.keywords.get('param')
+    if parser.func is parse_asv:
+        return _get_asv_files(cwd, param)[1]
+
+    path = os.path.join(cwd, param if param is not None else 'benchmark.json')
+    if os.path.isfile(path):
+        return [path]
+    return []
+
+
+def _load_json(cwd, filename):
+    path = os.path.join(cwd, filename)
+    if not os.path.isfile(path):
+        return None, "ERROR: benchmark file '{0}' not found".format(filename)
+    try:
+        with io.open(path, 'r', encoding='utf-8') as f:
+            return json.load(f), None
+    except ValueError as exc:
+        return None, "ERROR: invalid JSON in '{0}': {1}".format(filename, exc)
+
+
+def get_bench_parser(name):
+    parsers = {'pytest-benchmark': parse_pytest_benchmark,
+               'asv': parse_asv}
+
+    if ':' in name:
+        name, param = name.split(':', 1)
+    else:
+        param = None
+
+    try:
+        func = parsers[name]
+    except KeyError:
+        raise ValueError("Unknown benchmark parser name: {0}; not one of {1}".format(
+            name, sorted(parsers.keys())))
+
+    # partial (instead of lambda) keeps the parser picklable
+    return functools.partial(func, param=param)
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n//2]
+    return (values[n//2 - 1] + values[n//2]) / 2
+
+
+def median_ci(values, confidence=CONFIDENCE):
+    """
+    Median and its distribution-free confidence interval.
+
+    The interval is between the order statistics k and n-k+1, with the
+    largest k for which the coverage is at least `confidence`, or the
+    whole range of the samples if there are too few of them.
+
+    Returns
+    -------
+    median, low, high : float
+
+    """
+    values = sorted(values)
+    n = len(values)
+
+    # Binomial(n, 1/2) cumulative probabilities
+    total = 2.0**n
+    cdf = []
+    c = 0.0
+    coeff = 1.0
+    for j in range(n + 1):
+        c += coeff / total
+        cdf.append(c)
+        coeff = coeff * (n - j) / (j + 1)
+
+    k = 1
+    while k < n - k + 1 and cdf[k] <= (1 - confidence) / 2:
+        k += 1
+    return median(values), values[k - 1], values[n - k]
+
+
+def compare_timings(old, new, factor=1.1, confidence=CONFIDENCE):
+    """
+    Compare benchmark timings.
+
+    Parameters
+    ----------
+    old, new : dict
+        Samples, {benchmark: [value, ...]}.
+    factor : float, optional
+        Ratio of the medians needed for a significant change.
+    confidence : float, optional
+        Confidence level of the intervals of the medians.
+
+    Returns
+    -------
+    changes : list of (name, ratio, old_stats, new_stats, change)
+        Benchmarks present in both, with the ratio new/old of the
+        medians, the (median, low, high) of each, and 'slower',
+        'faster' or None if the change is not significant.
+
+    """
+    changes = []
+    for name in sorted(set(old) & set(new)):
+        if not old[name] or not new[name]:
+            continue
+        old_stats = median_ci(old[name], confidence)
+        new_stats = median_ci(new[name], confidence)
+        if old_stats[0] > 0:
+            ratio = new_stats[0] / old_stats[0]
+        else:
+            ratio = float('inf') if new_stats[0] > 0 else 1.0
+
+        change = None
+        if new_stats[1] > old_stats[2] and ratio >= factor:
+            change = 'slower'
+        elif new_stats[2] < old_stats[1] and ratio <= 1 / factor:
+            change = 'faster'
+        changes.append((name, ratio, old_stats, new_stats, change))
+    return changes
+
+
+def format_time(seconds):
+    """
+    Format a benchmark time, e.g. '1.23 ms'.
+    """
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if abs(seconds) >= scale:
+            return "{0:.3g} {1}".format(seconds / scale, unit)
+    return "{0:.3g} ns".format(seconds / 1e-9)
+
+
+def format_bench_stats(stats):
+    """
+    Format (median, low, high), e.g. '1.23 ms [1.2 ms, 1.3 ms]'.
+    """
+    return "{0} [{1}, {2}]".format(*[format_time(x) for x in stats])
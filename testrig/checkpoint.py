@@ -0,0 +1,84 @@
+"""
+Stage checkpoints, for resuming interrupted runs.
+
+Each completed stage of a job (a built environment, the parsed results
+of one side, the final result) is saved in the cache together with a
+fingerprint of its inputs.  With ``--resume``, a stage whose checkpoint
+has the same fingerprint is not run again.  The checkpoints of a job are
+cleared when a run of it starts without ``--resume``, so that only the
+latest, interrupted run can be resumed.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import json
+import pickle
+import hashlib
+
+
+def get_fingerprint(*items):
+    """
+    Fingerprint of JSON-serializable inputs.
+    """
+    data = json.dumps(items, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class Checkpoints(object):
+    """
+    Checkpoints of the stages of one job.
+
+    Parameters
+    ----------
+    directory : str
+        Directory where the checkpoints are stored.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+    def _get_filename(self, stage):
+        return os.path.join(self.directory, stage + '.pickle')
+
+    def get(self, stage, fingerprint):
+        """
+        Saved data of a stage, or None if the stage has no checkpoint
+        with the given fingerprint.
+        """
+        try:
+            with open(self._get_filename(stage), 'rb') as f:
+                saved_fingerprint, data = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError,
+                AttributeError, ImportError, pickle.UnpicklingError):
+            return None
+
+        if saved_fingerprint != fingerprint:
+            return None
+        return data
+
+    def put(self, stage, fingerprint, data):
+        """
+        Save the data of a completed stage.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        # Write atomically, so that an interruption does not leave a
+        # partial checkpoint behind
+        filename = self._get_filename(stage)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump((fingerprint, data), f, protocol=2)
+        os.rename(tmp_filename, filename)
+
+    def clear(self):
+        """
+        Remove all checkpoints.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for fn in os.listdir(self.directory):
+            if fn.endswith('.pickle') or fn.endswith('.tmp'):
+                os.unlink(os.path.join(self.directory, fn))
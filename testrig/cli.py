@@ -8,11 +8,13 @@ Run tests in the test rig.
 from __future__ import absolute_import, division, print_function
 
 import os
-import re
 import sys
+import glob
+import json
 import time
 import fnmatch
-import datetime
+import hashlib
+import atexit
 import argparse
 import subprocess
 import threading
@@ -28,9 +30,34 @@ try:
 except ImportError:
     joblib = None
 
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
 from .fixture import get_fixture_cls
 from .lockfile import LockFile
+from .logpipe import (LogPipeline, KEEP_LOGS, text_open, rotate_logs, get_log_path, open_log,
+                      read_log)
 from .parser import get_parser
+from .bench import (get_bench_parser, get_bench_result_files, median, compare_timings,
+                    format_bench_stats, format_time)
+from .profdiff import load_profiles, format_diff
+from .cluster import cluster_failures, format_clusters
+from .importtime import (RUN_MARKER as IMPORT_RUN_MARKER, get_import_cmd, parse_import_runs,
+                         compare_import_times)
+from .pipeline import Prefetcher
+from .sitehook import create_hook_dir
+from .compcache import detect_compiler_caches, format_stats
+from .monitor import ProgressMonitor
+from .plan import make_plan
+from .rerun import format_rerun_cmd, get_outcome, classify
+from .gitbisect import Bisection, get_bisect_ranges
+from .checkpoint import Checkpoints, get_fingerprint
+from .config import Config
+from .process import Limits, ProcessTimeout, parse_duration, parse_size
+from .shard import SHARD_BY, parse_collected, make_shards, format_shard_cmd, merge_results
+from .history import History, format_duration
 from . import __version__
 
 EXTRA_PATH = [
@@ -42,12 +69,22 @@ EXTRA_PATH = [
     '/usr/local/lib64/f90cache'
 ]
 
+# Classifications of new failures not counted as new, see rerun.py
+EXCUSED_TITLES = {
+    'environment': 'environment-dependent tests (failing also in old on rerun)',
+    'flaky': 'flaky tests',
+    'known-flaky': 'known flaky tests (not rerun)',
+}
+
 LOG_STREAM = None
+LOG_PIPELINE = None
 LOG_LOCK = multiprocessing.Lock()
+LOG_QUEUE = None
+MONITOR = None
 
 
 def main():
-    global LOG_STREAM
+    global LOG_STREAM, LOG_PIPELINE, MONITOR
 
     # Parse arguments
     p = argparse.ArgumentParser(usage=__doc__.lstrip())
@@ -57,6 +94,68 @@ def main():
     p.add_argument('--no-cleanup', '-n', action="store_false",
                    dest="cleanup", default=True,
                    help="don't clean up afterward")
+    p.add_argument('--no-prefetch', action="store_false",
+                   dest="prefetch", default=True,
+                   help="don't fetch git repositories and packages ahead of the builds")
+    p.add_argument('--prefetch-jobs', action="store", type=int,
+                   metavar='NUM_JOBS', dest="prefetch_jobs", default=4,
+                   help="number of concurrent git fetches and downloads (default: 4)")
+    p.add_argument('--offline', action="store_true",
+                   dest="offline", default=False,
+                   help=("install pip packages only from the local wheelhouse, and git "
+                         "packages from the git cache without fetching"))
+    p.add_argument('--no-cython-cache', action="store_false",
+                   dest="cython_cache", default=True,
+                   help="don't cache Cython-generated sources")
+    p.add_argument('--compiler-cache', action="store",
+                   choices=['default', 'shared', 'isolated'],
+                   dest="compiler_cache", default='default',
+                   help=("ccache/f90cache directory: the user's default one, one shared "
+                         "under the cache directory, or a separate one for each job"))
+    p.add_argument('--compiler-cache-size', action="store", metavar='SIZE',
+                   dest="compiler_cache_size", default=None,
+                   help="size limit for shared/isolated compiler caches, e.g. '5G'")
+    p.add_argument('--conda-pkgs-dir', action="store", metavar='DIR',
+                   dest="conda_pkgs_dir", default=None,
+                   help="conda package cache directory shared by all conda environments")
+    p.add_argument('--refresh-conda-lock', action="store_true",
+                   dest="refresh_conda_lock", default=False,
+                   help="solve conda environments again instead of using cached solutions")
+    p.add_argument('--conda-lock-max-age', action="store", type=float, metavar='DAYS',
+                   dest="conda_lock_max_age", default=7,
+                   help=("solve conda environments again when their cached solution is "
+                         "older than this (default: 7)"))
+    p.add_argument('--rerun', action="store", type=int, metavar='N',
+                   dest="rerun", default=0,
+                   help=("rerun new failures N times in both environments, to tell "
+                         "regressions from flaky tests (needs 'rerun' in the config)"))
+    p.add_argument('--bisect', action="store_true",
+                   dest="bisect", default=False,
+                   help=("find the commits of git+ packages in 'new' that caused the new "
+                         "failures of the latest recorded run, instead of a normal run"))
+    p.add_argument('--profile', action="append", metavar='TEST_ID',
+                   dest="profile", default=[],
+                   help=("rerun the given test under cProfile in the 'old' and 'new' "
+                         "environments and show which functions got slower, instead of "
+                         "a normal run (needs 'rerun' in the config; can be repeated)"))
+    p.add_argument('--resume', action="store_true",
+                   dest="resume", default=False,
+                   help=("resume an interrupted run, skipping the builds and test runs "
+                         "that it completed with the same inputs"))
+    p.add_argument('--compress-logs', action="store_true",
+                   dest="compress_logs", default=False,
+                   help="compress the build and test logs with gzip as they are written")
+    p.add_argument('--keep-logs', action="store", type=int, metavar='N',
+                   dest="keep_logs", default=KEEP_LOGS,
+                   help="number of main logs of previous runs kept (default: {0})".format(KEEP_LOGS))
+    p.add_argument('--no-history', action="store_false",
+                   dest="history", default=True,
+                   help=("don't use the history database: no ordering by previous durations, "
+                         "no known flaky tests, and the run is not recorded"))
+    p.add_argument('--plan', action="store_true",
+                   dest="plan", default=False,
+                   help=("print the predicted schedule, cache reuse and wall-clock time "
+                         "from previous runs, without running anything"))
     p.add_argument('--cache', action="store",
                    dest="cache_dir", default=None,
                    help="cache directory")
@@ -64,6 +163,10 @@ def main():
                    metavar='NUM_PROC',
                    dest="parallel", default=0, const=-1,
                    help="build and run tests in parallel")
+    p.add_argument('--backend', action="store", choices=['thread', 'process'],
+                   dest="backend", default='thread',
+                   help=("run parallel jobs in threads, or in separate worker processes "
+                         "each with its own environment (default: thread)"))
     p.add_argument('--verbose', '-v', action="store_true",
                    dest="verbose", help="be more verbose")
     p.add_argument('--version', action="version", version="%(prog)s " + __version__,
@@ -89,9 +192,16 @@ def main():
 
     log_dir = cache_dir
     log_fn = os.path.join(log_dir, 'testrig.log')
-    with text_open(log_fn, 'w'):
-        pass
-    LOG_STREAM = text_open(log_fn, 'a')
+    if args.plan:
+        # Dry run: keep the logs of the real runs
+        LOG_PIPELINE = LogPipeline([sys.stdout])
+    else:
+        if not args.resume:
+            rotate_logs(log_fn, args.keep_logs)
+        LOG_STREAM = text_open(log_fn, 'a')
+        LOG_PIPELINE = LogPipeline([sys.stdout, LOG_STREAM])
+    LOG_PIPELINE.start()
+    atexit.register(LOG_PIPELINE.stop)
 
     # Grab selected tests
     tests = get_tests(args.config)
@@ -102,7 +212,7 @@ def main():
         selected_tests = []
         for t in tests:
             for sel in args.tests:
-                if fnmatch.fnmatch(t.name, sel):
+                if fnmatch.fnmatch(t.name, sel) or fnmatch.fnmatch(t.section, sel):
                     selected_tests.append(t)
                     break
 
@@ -114,38 +224,190 @@ def main():
 
     set_extra_env()
 
-    if not EXTRA_PATH[0]:
+    compiler_caches = detect_compiler_caches()
+    if not any(c.name == 'ccache' for c in compiler_caches):
         print_logged("WARNING: ccache is not available -- this is going to be slow\n")
+    for c in compiler_caches:
+        print_logged("Using {0}: {1}".format(c.name, c.executable))
 
     for t in selected_tests:
         t.print_info()
 
-    print_logged("Logging to: {0}\n".format(os.path.relpath(log_fn)))
-
-    results = {}
+    if not args.plan:
+        print_logged("Logging to: {0}\n".format(os.path.relpath(log_fn)))
 
     if args.parallel < 0:
         args.parallel = multiprocessing.cpu_count() + 1 + args.parallel
 
+    if args.backend == 'process' and ProcessPoolExecutor is None:
+        p.error('process backend requires Python 3')
+
+    if args.offline and not args.git_cache:
+        p.error('--offline installs git packages from the git cache; cannot use --no-git-cache')
+
+    if args.bisect and not args.history:
+        p.error('--bisect needs the history database; cannot use --no-history')
+
+    parallel = (args.parallel > 0 and (joblib is not None or args.backend == 'process'))
+
+    # Order the jobs longest first, from the durations of previous runs
+    history = None
+    if args.history:
+        history = History(os.path.join(cache_dir, 'history.sqlite'))
+    names = [name for t in selected_tests for name in t.result_names]
+    expected = {}
+    part_durations = {}
+    cached_part_durations = {}
+    if history is not None:
+        expected = history.get_expected_durations(names)
+        part_durations = history.get_part_durations(names)
+        cached_part_durations = history.get_cached_part_durations()
+    for t in selected_tests:
+        # Jobs with several candidates take about as long as one of them
+        for name in t.result_names:
+            if name in expected:
+                expected.setdefault(t.name, expected[name])
+    plan = make_plan(selected_tests, expected,
+                     part_durations=part_durations,
+                     cached_part_durations=cached_part_durations,
+                     num_slots=(args.parallel if parallel else 1),
+                     shared_cache=(args.compiler_cache != 'isolated'),
+                     order=parallel)
+    if args.plan:
+        print_logged(plan.format())
+        sys.exit(0)
+    if expected and not (args.bisect or args.profile):
+        print_logged("Expected wall-clock time: {0}\n".format(format_duration(plan.makespan)))
+    selected_tests = plan.tests
+
+    # Matrix cells with environments in common run in the same job
+    jobs = group_tests(selected_tests)
+
+    job_cache_dirs = {}
+    for job_tests in jobs:
+        for t in job_tests:
+            if parallel:
+                job_cache_dirs[t.name] = os.path.join(cache_dir, 'parallel', job_tests[0].name)
+            else:
+                job_cache_dirs[t.name] = cache_dir
+
+    # Start fetching git repositories and distributions for all tests,
+    # in the background while the builds run
+    wheelhouse_dir = os.path.join(cache_dir, 'wheelhouse')
+    prefetcher = None
+    prefetch_log = None
+    if args.prefetch and not (args.bisect or args.profile):
+        prefetch_log_fn = os.path.join(log_dir, 'prefetch.log')
+        prefetch_log = text_open(prefetch_log_fn, 'w')
+        prefetcher = Prefetcher(wheelhouse_dir, prefetch_log, num_workers=args.prefetch_jobs,
+                                print_logged=print_logged)
+        prefetcher.start()
+        # Worker processes cannot wait on the prefetcher, so they do
+        # their own git fetches
+        count = prefetcher.submit_tests(
+            selected_tests,
+            dict((name, os.path.join(os.path.abspath(d), 'git-cache'))
+                 for name, d in job_cache_dirs.items()),
+            git_cache=(args.git_cache and not args.offline and
+                       not (parallel and args.backend == 'process')),
+            download=not args.offline)
+        print_logged("Prefetching {0} items (logging to {1})...\n".format(
+            count, os.path.relpath(prefetch_log_fn)))
+
+    fixture_options = dict(wheelhouse=wheelhouse_dir,
+                           offline=args.offline,
+                           prefetcher=prefetcher,
+                           site_hook_dir=create_hook_dir(os.path.join(cache_dir, 'sitehook')))
+
+    if args.cython_cache:
+        fixture_options['cython_cache'] = os.path.join(cache_dir, 'cython-cache')
+
+    fixture_options['conda_lock_dir'] = os.path.join(cache_dir, 'conda-lock')
+    fixture_options['refresh_conda_lock'] = args.refresh_conda_lock
+    fixture_options['conda_lock_max_age'] = args.conda_lock_max_age * 86400
+    if args.conda_pkgs_dir is not None:
+        fixture_options['conda_pkgs_dir'] = os.path.abspath(args.conda_pkgs_dir)
+
+    fixture_options['compiler_caches'] = compiler_caches
+    fixture_options['compiler_cache_size'] = args.compiler_cache_size
+    if args.compiler_cache == 'shared':
+        fixture_options['compiler_cache_dir'] = os.path.join(cache_dir, 'compiler-cache')
+    elif args.compiler_cache == 'isolated':
+        # relative to each job's cache directory
+        fixture_options['compiler_cache_dir'] = 'compiler-cache'
+
+    for t in selected_tests:
+        t.compress_logs = args.compress_logs
+
+    if args.bisect:
+        for t in selected_tests:
+            run_locked(cache_dir, t.bisect, log_dir, history, git_cache=args.git_cache,
+                       verbose=args.verbose, fixture_options=fixture_options)
+        history.close()
+        sys.exit(0)
+
+    if args.profile:
+        for t in selected_tests:
+            run_locked(cache_dir, t.profile, log_dir, args.profile, git_cache=args.git_cache,
+                       verbose=args.verbose, fixture_options=fixture_options)
+        if history is not None:
+            history.close()
+        sys.exit(0)
+
+    results = {}
+
+    run_kwargs = dict(cleanup=args.cleanup, git_cache=args.git_cache, verbose=args.verbose,
+                      rerun=args.rerun, resume=args.resume)
+
+    # Known flaky tests are reported separately and not rerun
+    flaky = history.get_flaky_tests(names) if history is not None else {}
+    for t in selected_tests:
+        t.known_flaky = set()
+        for name in t.result_names:
+            t.known_flaky.update(flaky.get(name, set()))
+        if t.shards > 1 and t.shard_by == 'duration' and history is not None:
+            t.test_durations = history.get_test_durations(t.name)
+
+    # Follow the logs of all jobs, with ETAs from the history
+    start_time = time.time()
+    MONITOR = ProgressMonitor(expected=expected)
+    MONITOR.start()
+
     try:
-        if args.parallel > 0 and joblib is not None:
-            jobs = []
-            os.environ['NPY_NUM_BUILD_JOBS'] = str(max(1, multiprocessing.cpu_count()//min(len(selected_tests), args.parallel)))
-            for t in selected_tests:
-                job_cache_dir = os.path.join(cache_dir, 'parallel', t.name)
-                jobs.append(joblib.delayed(do_run)(t, job_cache_dir, log_dir, cleanup=args.cleanup, git_cache=args.git_cache, verbose=args.verbose))
-            job_results = joblib.Parallel(n_jobs=args.parallel, backend="threading")(jobs)
-            results = dict(zip([t.name for t in selected_tests], job_results))
+        if parallel and args.backend == 'process':
+            job_env = dict(os.environ)
+            job_env['NPY_NUM_BUILD_JOBS'] = str(max(1, multiprocessing.cpu_count()//min(len(jobs), args.parallel)))
+            run_kwargs['fixture_options'] = dict(fixture_options, prefetcher=None)
+            results = run_processes(jobs, job_cache_dirs, log_dir, args.parallel,
+                                    job_env, config_dir, run_kwargs)
+        elif parallel:
+            delayed = []
+            os.environ['NPY_NUM_BUILD_JOBS'] = str(max(1, multiprocessing.cpu_count()//min(len(jobs), args.parallel)))
+            for job_tests in jobs:
+                delayed.append(joblib.delayed(do_run)(job_tests, job_cache_dirs[job_tests[0].name],
+                                                      log_dir, fixture_options=fixture_options,
+                                                      **run_kwargs))
+            job_results = joblib.Parallel(n_jobs=args.parallel, backend="threading")(delayed)
+            results = dict(zip([job_tests[0].name for job_tests in jobs], job_results))
         else:
             if args.parallel:
                 print_logged("WARNING: joblib not installed -- parallel run not possible\n")
             os.environ['NPY_NUM_BUILD_JOBS'] = str(multiprocessing.cpu_count())
-            for t in selected_tests:
-                r = do_run(t, cache_dir, log_dir, cleanup=args.cleanup, git_cache=args.git_cache, verbose=args.verbose)
-                results[t.name] = r
+            for job_tests in jobs:
+                results[job_tests[0].name] = do_run(job_tests, job_cache_dirs[job_tests[0].name],
+                                                    log_dir, fixture_options=fixture_options,
+                                                    **run_kwargs)
     except KeyboardInterrupt:
         print_logged("Interrupted")
         sys.exit(1)
+    finally:
+        MONITOR.stop()
+        if prefetcher is not None:
+            prefetcher.stop()
+            prefetch_log.close()
+
+    # One result for each candidate 'new' of each test
+    results = dict((r.name, r) for job_results in results.values() for r in job_results)
 
     # Output summary
     msg = "\n\n"
@@ -153,21 +415,40 @@ def main():
     msg += "Summary\n"
     msg += ("="*79) + "\n\n"
     ok = True
-    for name, entry in sorted(results.items()):
-        test_count, fail_new_count, fail_same_count, warn_new_count, warn_same_count = entry
-
-        if fail_new_count < 0 or test_count < 0:
+    for name, r in sorted(results.items()):
+        if r.error:
             msg += "- {0}: ERROR\n".format(name)
             ok = False
-        elif fail_new_count == 0 and test_count > 0:
-            msg += "- {0}: OK (ran {1} tests, {2} pre-existing failures, {3} warnings, {4} pre-existing warnings)\n".format(
-                name, test_count, fail_same_count, warn_new_count, warn_same_count)
+        elif r.slowdowns is not None:
+            if r.slowdowns:
+                ok = False
+                msg += "- {0}: FAIL (ran {1} benchmarks, {2} significant slowdowns)\n".format(
+                    name, r.test_count, len(r.slowdowns))
+            else:
+                msg += "- {0}: OK (ran {1} benchmarks, no significant slowdowns)\n".format(
+                    name, r.test_count)
+            for bench_name, ratio, old_stats, new_stats in r.slowdowns:
+                msg += "    {0}: {1:.2f}x slower ({2} -> {3})\n".format(
+                    bench_name, ratio, format_bench_stats(old_stats), format_bench_stats(new_stats))
+        elif r.fail_new_count == 0 and r.test_count > 0:
+            msg += "- {0}: OK (ran {1} tests, {2}{3} pre-existing failures, {4} warnings, {5} pre-existing warnings)\n".format(
+                name, r.test_count, r.format_excused(), r.fail_same_count, r.warn_new_count, r.warn_same_count)
         else:
             ok = False
-            msg += "- {0}: FAIL (ran {1} tests, {2} new failures, {3} pre-existing failures, {4} warnings, {5} pre-existing warnings)\n".format(
-                name, test_count, fail_new_count, fail_same_count, warn_new_count, warn_same_count)
+            msg += "- {0}: FAIL (ran {1} tests, {2} new failures, {3}{4} pre-existing failures, {5} warnings, {6} pre-existing warnings)\n".format(
+                name, r.test_count, r.fail_new_count, r.format_excused(), r.fail_same_count,
+                r.warn_new_count, r.warn_same_count)
+        for module, ratio, old_stats, new_stats, offenders in r.import_regressions:
+            msg += "    import {0}: {1:.2f}x slower ({2} -> {3})\n".format(
+                module, ratio, format_bench_stats(old_stats), format_bench_stats(new_stats))
     msg += "\n"
 
+    if history is not None:
+        run_id = history.add_run([results[name] for name in sorted(results.keys())],
+                                 start_time, config=os.path.abspath(args.config))
+        msg += "Recorded as run {0} in {1}\n".format(run_id, os.path.relpath(history.filename))
+        history.close()
+
     print_logged(msg)
 
     # Done
@@ -177,14 +458,69 @@ def main():
         sys.exit(1)
 
 
-def text_open(filename, mode):
-    if sys.version_info[0] >= 3:
-        return open(filename, mode, encoding='utf-8', errors='replace')
-    else:
-        return open(filename, mode)
+def do_run(tests, cache_dir, log_dir, cleanup, git_cache, verbose, fixture_options=None, rerun=0,
+           resume=False):
+    return run_locked(cache_dir, run_job, tests, log_dir, cleanup, git_cache, verbose,
+                      fixture_options=fixture_options, rerun=rerun, resume=resume)
+
+
+def run_job(cache_dir, tests, log_dir, cleanup, git_cache, verbose, fixture_options=None,
+            rerun=0, resume=False):
+    """
+    Run the tests of a job one after another, building and running the
+    sides they have in common once.
+
+    Returns
+    -------
+    results : list of TestResult
+        Results of all tests of the job.
+
+    """
+    shared = SharedSides() if len(tests) > 1 else None
+    results = []
+    try:
+        for t in tests:
+            results.extend(t.run(cache_dir, log_dir, cleanup, git_cache, verbose,
+                                 fixture_options=fixture_options, rerun=rerun, resume=resume,
+                                 shared=shared))
+    finally:
+        if shared is not None:
+            shared.teardown()
+    return results
+
+
+def group_tests(tests):
+    """
+    Group the matrix cells of a section that have an environment in
+    common into one job, so that it is built once.
 
+    Returns
+    -------
+    jobs : list of list of Test
+        Jobs in the order of their first test.
 
-def do_run(test, cache_dir, log_dir, cleanup, git_cache, verbose):
+    """
+    jobs = []
+    for t in tests:
+        job_tests = [t]
+        fingerprints = set(t.get_fingerprint(side) for side, install in t.get_sides())
+        position = len(jobs)
+        for j in reversed(range(len(jobs))):
+            other_tests, other_fingerprints = jobs[j]
+            if other_tests[0].section == t.section and other_fingerprints & fingerprints:
+                job_tests = other_tests + job_tests
+                fingerprints |= other_fingerprints
+                del jobs[j]
+                position = j
+        jobs.insert(position, (job_tests, fingerprints))
+    return [job_tests for job_tests, fingerprints in jobs]
+
+
+def run_locked(cache_dir, func, *args, **kwargs):
+    """
+    Run func(cache_dir, *args, **kwargs) holding the lock of the cache
+    directory.
+    """
     cache_dir = os.path.abspath(cache_dir)
     try:
         os.makedirs(cache_dir)
@@ -198,12 +534,74 @@ def do_run(test, cache_dir, log_dir, cleanup, git_cache, verbose):
         print_logged("ERROR: another process is already using the cache directory '{0}'".format(os.path.relpath(cache_dir)))
         sys.exit(1)
     try:
-        return test.run(cache_dir, log_dir, cleanup, git_cache, verbose)
+        return func(cache_dir, *args, **kwargs)
     finally:
         lock.release()
 
 
+def run_processes(jobs, job_cache_dirs, log_dir, num_proc, job_env, job_cwd, run_kwargs):
+    """
+    Run jobs in a pool of worker processes.
+
+    Each job (a list of tests) runs in a worker process with the given
+    environment and working directory.  Log messages are sent back to the parent via a
+    queue, and printed and logged there.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    log_queue = ctx.Queue()
+
+    consumer = threading.Thread(target=_consume_log_queue, args=(log_queue,))
+    consumer.daemon = True
+    consumer.start()
+
+    try:
+        with ProcessPoolExecutor(max_workers=num_proc, mp_context=ctx,
+                                 initializer=_init_worker, initargs=(log_queue,)) as executor:
+            futures = []
+            for job_tests in jobs:
+                name = job_tests[0].name
+                futures.append((name, executor.submit(_run_in_worker, job_tests, job_cache_dirs[name],
+                                                      log_dir, job_env, job_cwd, run_kwargs)))
+            return dict((name, future.result()) for name, future in futures)
+    finally:
+        log_queue.put(None)
+        consumer.join()
+
+
+def _init_worker(log_queue):
+    global LOG_QUEUE
+    LOG_QUEUE = log_queue
+
+
+def _run_in_worker(tests, cache_dir, log_dir, env, cwd, run_kwargs):
+    os.environ.clear()
+    os.environ.update(env)
+    os.chdir(cwd)
+    return do_run(tests, cache_dir, log_dir, **run_kwargs)
+
+
+def _consume_log_queue(log_queue):
+    while True:
+        item = log_queue.get()
+        if item is None:
+            break
+        kind, payload = item
+        if kind == 'log':
+            print_logged(*payload)
+        elif kind == 'progress':
+            report_progress(*payload)
+
+
 def print_logged(*a):
+    if LOG_QUEUE is not None:
+        # In a worker process
+        LOG_QUEUE.put(('log', a))
+        return
+
+    if LOG_PIPELINE is not None:
+        LOG_PIPELINE.put(" ".join("{0}".format(x) for x in a) + "\n")
+        return
+
     assert LOG_STREAM is not None
     with LOG_LOCK:
         print(*a)
@@ -212,6 +610,17 @@ def print_logged(*a):
         LOG_STREAM.flush()
 
 
+def report_progress(name, phase, log_fn):
+    """
+    Report the current phase and log file of a job to the progress monitor.
+    """
+    if LOG_QUEUE is not None:
+        # In a worker process
+        LOG_QUEUE.put(('progress', (name, phase, log_fn)))
+    elif MONITOR is not None:
+        MONITOR.set_phase(name, phase, log_fn)
+
+
 def set_extra_env():
     os.environ['PATH'] = os.pathsep.join(EXTRA_PATH + os.environ.get('PATH', '').split(os.pathsep))
 
@@ -225,69 +634,120 @@ def get_tests(config):
         print_logged("ERROR: configuration file {0} not found".format(config))
         sys.exit(1)
 
+    config_values = Config(p)
     tests = []
 
-    def get(section, name, default=None, _interpolate_stack=()):
-        if name in _interpolate_stack:
-            raise ValueError("string interpolation cycle for value {}".format(name))
-
-        if p.has_option('DEFAULT', name):
-            default = p.get('DEFAULT', name)
+    for section in config_values.sections():
+        try:
+            cells = config_values.get_matrix(section)
+        except ValueError as err:
+            print_logged("testrig.ini: section {}: {}".format(section, err))
+            sys.exit(1)
 
-        if not p.has_option(section, name):
-            value = default
-        else:
-            value = p.get(section, name)
-
-        if value is not None:
-            # String interpolation
-            stack = _interpolate_stack + (name,)
-            for key in re.findall(r'{([^}]*)}', value):
-                if key == name:
-                    v = default or ''
-                else:
-                    v = get(section, key, None, stack) or ''
-                value = value.replace('{' + key + '}', v)
+        for label, cell in cells:
+            name = "{0}-{1}".format(section, label) if label else section
 
-        return value
+            def get(key, default=None):
+                return config_values.get(section, key, default, cell=cell)
 
-    for section in p.sections():
-        if section == 'DEFAULT':
-            continue
+            def get_limits(stage):
+                return Limits(timeout=parse_duration(get(stage + '_timeout')),
+                              stall_timeout=parse_duration(get('stall_timeout')),
+                              process_memory=parse_size(get('process_memory_limit')),
+                              process_cpu_time=parse_duration(get('process_cpu_limit')))
 
-        try:
-            t = Test(section,
-                     get(section, 'old'),
-                     get(section, 'new'),
-                     get(section, 'run'),
-                     get(section, 'parser'),
-                     get(section, 'env'),
-                     get(section, 'envvars', ''),
-                     os.path.abspath(os.path.dirname(config)),
-                     get(section, 'python', None))
-            tests.append(t)
-        except (ValueError, configparser.Error) as err:
-            print_logged("testrig.ini: section {}: {}".format(section, err))
-            sys.exit(1)
+            try:
+                kind = get('type', 'test')
+                if kind == 'test':
+                    test_cls = Test
+                    extra = {}
+                elif kind == 'benchmark':
+                    test_cls = BenchmarkTest
+                    extra = dict(repeat=int(get('repeat', '5')))
+                else:
+                    raise ValueError("Unknown type '{0}'; not one of ['benchmark', 'test']".format(kind))
+
+                t = test_cls(name,
+                             get('old'),
+                             get('new'),
+                             get('run'),
+                             get('parser'),
+                             get('env'),
+                             get('envvars', ''),
+                             os.path.abspath(os.path.dirname(config)),
+                             get('python', None),
+                             get('build_deps', ''),
+                             get('rerun', None),
+                             build_limits=get_limits('build'),
+                             test_limits=get_limits('test'),
+                             shards=int(get('shards', '1')),
+                             shard_by=get('shard_by', 'module'),
+                             collect_cmd=get('collect', None),
+                             candidates=[(option[len('new.'):], get(option))
+                                         for option in config_values.options(section)
+                                         if option.startswith('new.')],
+                             section=section,
+                             import_modules=get('import_time', '').split(),
+                             import_repeat=int(get('import_repeat', '10')),
+                             slowdown_factor=float(get('slowdown_factor', '1.1')),
+                             **extra)
+                tests.append(t)
+            except (ValueError, configparser.Error) as err:
+                print_logged("testrig.ini: section {}: {}".format(name, err))
+                sys.exit(1)
 
     return tests
 
 
 class Test(object):
     def __init__(self, name, old_install, new_install, run_cmd, parser, environment,
-                 envvars, config_dir, python):
+                 envvars, config_dir, python, build_deps='', rerun_cmd=None,
+                 build_limits=None, test_limits=None, shards=1, shard_by='module',
+                 collect_cmd=None, candidates=None, section=None, import_modules=None,
+                 import_repeat=10, slowdown_factor=1.1):
         self.name = name
+        # Cells of the matrix of a section share its name here
+        self.section = section if section is not None else name
         self.old_install = old_install.split()
-        self.new_install = new_install.split()
+
+        # Candidate 'new' environments, compared with the same 'old'
+        self.candidates = []
+        if new_install is not None:
+            self.candidates.append(('new', new_install.split()))
+        for candidate, install in (candidates or []):
+            self.candidates.append(('new-' + candidate, install.split()))
+        if not self.candidates:
+            raise ValueError("no 'new' environment")
+        self.new_install = self.candidates[0][1]
+
         self.run_cmd = run_cmd
         self.parser_name = parser
-        self.parser = get_parser(parser)
+        # Unsharded runs and reruns use the output files of shard 0
+        self.parser = self.get_parser(parser.replace('$SHARD', '0'))
         self.fixture_cls = get_fixture_cls(environment)
         self.env_name = environment
         if not python:
             python = {'conda': '{0[0]}.{0[1]}'.format(sys.version_info),
-                      'virtualenv': sys.executable}[environment]
+                      'virtualenv': sys.executable,
+                      'venv': sys.executable}[environment]
         self.python = python
+        self.build_deps = build_deps.split()
+        self.rerun_cmd = rerun_cmd
+        self.build_limits = build_limits
+        self.test_limits = test_limits
+        self.shards = shards
+        self.shard_by = shard_by
+        self.collect_cmd = collect_cmd
+        if shards > 1 and not collect_cmd:
+            raise ValueError("'shards' needs a 'collect' command")
+        if shard_by not in SHARD_BY:
+            raise ValueError("Unknown shard_by '{0}'; not one of {1}".format(shard_by, list(SHARD_BY)))
+        self.import_modules = import_modules or []
+        self.import_repeat = import_repeat
+        self.slowdown_factor = slowdown_factor
+        self.known_flaky = set()
+        self.test_durations = {}
+        self.compress_logs = False
         self.environ = {}
         for line in envvars.splitlines():
             if not line.strip():
@@ -301,101 +761,833 @@ class Test(object):
     def print_info(self):
         print_logged(("[{0}]\n"
                       "    old={1}\n"
-                      "    new={2}\n"
+                      "{2}"
                       "    run={3}\n"
                       "    parser={4}\n"
                       "    env={5}\n"
                       "    python={6}\n"
-                      "    envvars={7}\n"
+                      "    build_deps={7}\n"
+                      "    rerun={8}\n"
+                      "    shards={9}\n"
+                      "    envvars={10}\n"
+                      "{11}"
                       ).format(self.name,
-                               " ".join(self.old_install), " ".join(self.new_install),
+                               " ".join(self.old_install),
+                               "".join("    {0}={1}\n".format(side.replace('-', '.', 1), " ".join(install))
+                                       for side, install in self.candidates),
                                self.run_cmd, self.parser_name, self.env_name, self.python,
-                               "\n    ".join("{0}={1}".format(x, y) for x, y in sorted(self.environ.items()))))
-
-    def run(self, cache_dir, log_dir, cleanup=True, git_cache=True, verbose=False):
-        log_old_fn = os.path.join(log_dir, '%s-build-old.log' % self.name)
-        log_new_fn = os.path.join(log_dir, '%s-build-new.log' % self.name)
+                               " ".join(self.build_deps), self.rerun_cmd or "",
+                               ("{0} by {1}".format(self.shards, self.shard_by)
+                                if self.shards > 1 else ""),
+                               "\n    ".join("{0}={1}".format(x, y) for x, y in sorted(self.environ.items())),
+                               self.format_extra_info()))
+
+    def format_extra_info(self):
+        if not self.import_modules:
+            return ""
+        return "    import_time={0} (x{1})\n".format(" ".join(self.import_modules),
+                                                   self.import_repeat)
+
+    def get_parser(self, name):
+        return get_parser(name)
+
+    def log_path(self, filename):
+        """
+        File name of a stage log, with the suffix of compressed logs.
+        """
+        return get_log_path(filename, self.compress_logs)
+
+    def open_log(self, filename, mode):
+        return open_log(filename, mode, compress=self.compress_logs)
+
+    def get_sides(self):
+        """
+        The sides as (side, install): 'old', and the candidates 'new'
+        and/or 'new-NAME'.
+        """
+        return [('old', self.old_install)] + self.candidates
+
+    def get_result_name(self, side):
+        if side == 'new':
+            return self.name
+        return "{0}:{1}".format(self.name, side[len('new-'):])
+
+    @property
+    def result_names(self):
+        return [self.get_result_name(side) for side, install in self.candidates]
+
+    def get_fingerprint(self, side):
+        """
+        Fingerprint of the environment specification of one side.
+        """
+        spec = self.get_spec(side)
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get_spec(self, side):
+        install = dict(self.get_sides())[side]
+        return dict(env=self.env_name, python=self.python, install=install,
+                    build_deps=self.build_deps, environ=self.environ)
+
+    def run(self, cache_dir, log_dir, cleanup=True, git_cache=True, verbose=False,
+            fixture_options=None, rerun=0, resume=False, shared=None):
+        """
+        Build the environments and run the tests.  With `rerun` > 0, new
+        failures are rerun that many times in both environments.  With
+        `resume`, the stages completed by an interrupted run with the
+        same inputs are not run again.  `shared` is the SharedSides of
+        the tests run in the same job, if any.
+
+        Returns
+        -------
+        results : list of TestResult
+            Results of each candidate 'new' environment compared with
+            'old'.
+
+        """
+        if fixture_options is None:
+            fixture_options = {}
+
+        checkpoints = Checkpoints(os.path.join(cache_dir, 'checkpoints', self.name))
+        if not resume:
+            checkpoints.clear()
+
+        result_fingerprint = get_fingerprint([self.get_fingerprint(side) for side, install in self.get_sides()],
+                                             self.run_cmd, self.parser_name, self.rerun_cmd,
+                                             rerun, sorted(self.known_flaky))
+        if resume:
+            results = checkpoints.get('result', result_fingerprint)
+            if results is not None:
+                print_logged("{0}: completed in the interrupted run, not running again".format(self.name))
+                return results
+
+        results = [TestResult(self.get_result_name(side)) for side, install in self.candidates]
+        if len(results) == 1:
+            baseline = results[0]
+        else:
+            baseline = TestResult(self.name)
 
-        test_log_old_fn = os.path.join(log_dir, '%s-test-old.log' % self.name)
-        test_log_new_fn = os.path.join(log_dir, '%s-test-new.log' % self.name)
+        try:
+            self._run(baseline, results, cache_dir, log_dir, cleanup, git_cache, verbose,
+                      fixture_options, rerun, checkpoints, resume, shared)
+        finally:
+            for result in [baseline] + results:
+                result.set_phase(None)
+
+        checkpoints.clear()
+        checkpoints.put('result', result_fingerprint, results)
+        return results
+
+    def _run(self, baseline, results, cache_dir, log_dir, cleanup, git_cache, verbose,
+             fixture_options, rerun, checkpoints, resume, shared):
+        # Environments are kept for reruns until the end
+        keep = rerun > 0 and self.rerun_cmd is not None
+        if rerun > 0 and not keep:
+            print_logged("{0}: no 'rerun' command configured, not rerunning failures".format(self.name))
+
+        fixtures = {}
+        try:
+            self._run_sides(baseline, results, cache_dir, log_dir, cleanup, git_cache, verbose,
+                            fixture_options, rerun, keep, fixtures, checkpoints, resume, shared)
+        finally:
+            for fixture, log in fixtures.values():
+                if shared is not None and shared.is_kept(fixture):
+                    continue
+                fixture.teardown()
+                log.close()
 
-        # Launch a thread that prints some output as long as something is
-        # running, as long as that something produces output.
-        wait_printer = WaitPrinter()
-        wait_printer.start()
+    def _run_sides(self, baseline, results, cache_dir, log_dir, cleanup, git_cache, verbose,
+                   fixture_options, rerun, keep, fixtures, checkpoints, resume, shared):
+        options = dict(cache_dir=cache_dir, log_dir=log_dir, cleanup=cleanup, git_cache=git_cache,
+                       verbose=verbose, fixture_options=fixture_options, keep=keep,
+                       fixtures=fixtures, checkpoints=checkpoints, resume=resume,
+                       shared=shared)
+        outputs = {}
+
+        if len(results) == 1:
+            # Old and new are built one after the other, in the same directory
+            for side, install in self.get_sides():
+                env_name = 'env-old' if keep and side == 'old' else 'env'
+                output = self._run_side(results[0], side, install, env_name, **options)
+                if output is None:
+                    return
+                outputs[side] = output
+        else:
+            # The baseline and the candidates are built and run
+            # concurrently, each in its own directory
+            errors = []
 
-        test_count = []
-        failures = []
-        warns = []
+            def run_side(result, side, install):
+                try:
+                    outputs[side] = self._run_side(result, side, install, 'env-' + side, **options)
+                except BaseException as exc:
+                    errors.append(exc)
+
+            threads = [threading.Thread(target=run_side, args=(result, side, install))
+                       for result, (side, install) in zip([baseline] + results, self.get_sides())]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+
+            baseline.set_phase(None)
+            for result in results:
+                result.sides['old'] = baseline.sides['old']
+                result.timings.update(baseline.timings)
+
+        for (side, install), result in zip(self.candidates, results):
+            if outputs.get(side) is not None:
+                candidate_fixtures = dict((kind, fixtures[s]) for kind, s in (('old', 'old'), ('new', side))
+                                          if s in fixtures)
+                self.compare(result, outputs['old'], outputs[side], candidate_fixtures,
+                             keep, rerun, verbose, log_dir)
+                if self.import_modules:
+                    self.compare_import_times(result)
+
+        if len(results) > 1:
+            self.print_candidates(results)
+
+    def _run_side(self, result, side, install, env_name, cache_dir, log_dir, cleanup, git_cache,
+                  verbose, fixture_options, keep, fixtures, checkpoints, resume, shared):
+        """
+        Build the environment of one side and run the tests in it.
+
+        Returns
+        -------
+        output : (test_count, failures, warns) or None
+            Parsed results, or None if the side failed and there is
+            nothing to compare.
+
+        """
+        kind = 'old' if side == 'old' else 'new'
+        build_fingerprint = self.get_fingerprint(side)
+        results_fingerprint = get_fingerprint(build_fingerprint, self.run_cmd, self.parser_name,
+                                              self.import_modules, self.import_repeat)
+        side_result = dict(fingerprint=build_fingerprint,
+                           spec=json.dumps(self.get_spec(side), sort_keys=True),
+                           status='build-error', info=None, test_count=-1)
+        result.sides[kind] = side_result
+
+        if shared is not None:
+            # Environments kept for the other tests of the job must not
+            # clash with each other
+            env_name = 'env-{0}-{1}'.format(side, build_fingerprint[:8])
+            saved = shared.get_output(results_fingerprint)
+            if saved is not None:
+                print_logged("{0}: using the {1} test results of {2}, from the same environment".format(
+                    result.name, side, saved['name']))
+                side_result.update(saved['side_result'])
+                if build_fingerprint in shared.fixtures:
+                    fixtures[side] = shared.fixtures[build_fingerprint]
+                return saved['output']
+
+        log_fn = os.path.join(log_dir, '%s-build-%s.log' % (self.name, side))
+        test_log_fn = os.path.join(log_dir, '%s-test-%s.log' % (self.name, side))
+
+        log = self.open_log(log_fn, 'a' if resume else 'w')
+        fixture = self.fixture_cls(cache_dir, log, print_logged=print_logged,
+                                   cleanup=cleanup, git_cache=git_cache, verbose=verbose,
+                                   extra_env=self.environ, python=self.python,
+                                   build_deps=self.build_deps,
+                                   env_name=env_name,
+                                   build_limits=self.build_limits,
+                                   test_limits=self.test_limits,
+                                   **fixture_options)
+
+        # Stages completed by the interrupted run
+        built = (resume and fixture.get_build_mark() == build_fingerprint and
+                 checkpoints.get('build-' + side, build_fingerprint) is not None)
+        saved = checkpoints.get('results-' + side, results_fingerprint) if resume else None
+
+        if saved is not None:
+            print_logged("{0}: using the {1} test results of the interrupted run".format(
+                result.name, side))
+            side_result.update(saved['side_result'])
+            if keep and built:
+                fixtures[side] = (fixture, log)
+                if shared is not None:
+                    shared.keep(build_fingerprint, fixture, log)
+            else:
+                # The environment directory may be in use by the other side
+                log.close()
+            return saved['count'], saved['failures'], saved['warns']
 
-        for log_fn, test_log_fn, install in ((log_old_fn, test_log_old_fn, self.old_install),
-                                             (log_new_fn, test_log_new_fn, self.new_install)):
-            log = text_open(log_fn, 'w')
-            fixture = self.fixture_cls(cache_dir, log, print_logged=print_logged,
-                                       cleanup=cleanup, git_cache=git_cache, verbose=verbose,
-                                       extra_env=self.environ, python=self.python)
+        done = False
+        try:
+            # Run virtualenv setup + builds
             try:
-                # Run virtualenv setup + builds
-                wait_printer.set_log_file(log_fn)
-                try:
+                if built:
+                    print_logged("{0}: using {1} at {2} built by the interrupted run".format(
+                        result.name, fixture.name, os.path.relpath(fixture.env_dir)))
+                    side_result.update(checkpoints.get('build-' + side, build_fingerprint))
+                else:
+                    result.set_phase('setup-' + kind, log.name)
                     print_logged("{0}: setting up {1} at {2}...".format(
-                        self.name, fixture.name, os.path.relpath(fixture.env_dir)))
+                        result.name, fixture.name, os.path.relpath(fixture.env_dir)))
                     fixture.setup()
-                    print_logged("{0}: building (logging to {1})...".format(self.name, os.path.relpath(log_fn)))
+                    result.set_phase('build-' + kind, log.name)
+                    print_logged("{0}: building (logging to {1})...".format(result.name, os.path.relpath(log.name)))
                     fixture.install_spec(install)
-                except BaseException as exc:
-                    with text_open(log_fn, 'r') as f:
-                        msg = "{0}: ERROR: build failed: {1}\n".format(self.name, str(exc))
-                        msg += "    " + f.read().replace("\n", "\n    ")
-                        print_logged(msg)
-
-                    if not isinstance(exc, (subprocess.CalledProcessError, OSError)):
-                        raise
-
-                    if log_fn.endswith('-old.log'):
-                        test_count.append(-1)
-                        failures.append({})
-                        warns.append({})
-                        continue
-                    else:
-                        return -1, -1, -1, -1, -1
-
-                info = fixture.get_info()
-                fixture.print("{0}: installed {1}".format(self.name, info))
-
-                # Run tests
-                fixture.print("{0}: running tests (logging to {1})...".format(self.name, os.path.relpath(test_log_fn)))
-                with text_open(test_log_fn, 'w') as f:
-                    wait_printer.set_log_file(test_log_fn)
-                    fixture.run_test_cmd(self.run_cmd, log=f)
-
-                # Parse test results
-                with text_open(test_log_fn, 'r') as f:
-                    data = f.read()
-                    fail, warn, count, err_msg = self.parser(data, os.path.join(cache_dir, 'env'))
-                    test_count.append(count)
-                    failures.append(fail)
-                    warns.append(warn)
-
-                    if err_msg is not None:
-                        msg = "{0}: ERROR: failed to parse test output\n".format(self.name)
-                        msg += "{0}: {1}\n".format(self.name, err_msg)
-                        msg += "    " + data.replace("\n", "\n    ")
-                        print_logged(msg)
+                    self.print_cache_stats(fixture)
+                    side_result['parts'] = self.get_part_stats(fixture)
+                    side_result['revisions'] = dict(fixture.git_revisions)
+                    fixture.set_build_mark(build_fingerprint)
+                    checkpoints.put('build-' + side, build_fingerprint,
+                                    dict(parts=side_result['parts'],
+                                         revisions=side_result['revisions']))
+            except BaseException as exc:
+                log.flush()
+                msg = "{0}: ERROR: build failed: {1}\n".format(result.name, str(exc))
+                msg += "    " + read_log(log.name).replace("\n", "\n    ")
+                print_logged(msg)
+
+                if not isinstance(exc, (subprocess.CalledProcessError, OSError)):
+                    raise
+
+                done = True
+                if kind == 'old':
+                    return -1, {}, {}
+                return None
+
+            info = fixture.get_info()
+            side_result['info'] = info
+            fixture.print("{0}: installed {1}".format(result.name, info))
+
+            if self.import_modules:
+                import_log_fn = os.path.join(log_dir, '%s-import-%s.log' % (self.name, side))
+                side_result['import_times'] = self.measure_import_times(
+                    result, fixture, kind, import_log_fn)
+
+            # Run tests
+            fixture.print("{0}: running tests (logging to {1})...".format(
+                result.name, os.path.relpath(self.log_path(test_log_fn))))
+            timeout = None
+            try:
+                fail, warn, count, err_msg, details, data = self.run_tests(
+                    result, fixture, kind, test_log_fn)
+            except ProcessTimeout as exc:
+                timeout = exc
+
+            if timeout is not None:
+                side_result['status'] = 'timeout'
+                print_logged("{0}: ERROR: tests killed: {1} (see {2})".format(
+                    result.name, timeout, os.path.relpath(self.log_path(test_log_fn))))
+                done = True
+                if kind == 'old':
+                    return -1, {}, {}
+                return None
+
+            for note in details.get('notes', []):
+                print_logged("{0}: WARNING: {1}".format(result.name, note))
+
+            side_result['test_count'] = count
+            side_result['cases'] = details.get('cases', {})
+            if 'timings' in details:
+                side_result['timings'] = details['timings']
+            # Failures the parser could not attribute to test cases
+            for name in fail:
+                if side_result['cases'].get(name, ('failed',))[0] not in ('failed', 'error'):
+                    side_result['cases'][name] = ('failed', None)
+
+            if err_msg is not None:
+                side_result['status'] = 'parse-error'
+                msg = "{0}: ERROR: failed to parse test output\n".format(result.name)
+                msg += "{0}: {1}\n".format(result.name, err_msg)
+                msg += "    " + data.replace("\n", "\n    ")
+                print_logged(msg)
+            else:
+                side_result['status'] = 'ok'
+                checkpoints.put('results-' + side, results_fingerprint,
+                                dict(side_result=dict(side_result), count=count,
+                                     failures=fail, warns=warn))
+                if shared is not None:
+                    shared.put_output(results_fingerprint, result.name, side_result,
+                                      (count, fail, warn))
+            done = True
+            return count, fail, warn
+        finally:
+            if keep and side_result['info'] is not None:
+                fixtures[side] = (fixture, log)
+                if shared is not None:
+                    shared.keep(build_fingerprint, fixture, log)
+            elif done:
+                fixture.teardown()
+                log.close()
+            else:
+                # Interrupted: the environment is left for --resume
+                log.close()
+
+
+    def compare(self, result, old_output, new_output, fixtures, keep, rerun, verbose, log_dir):
+        """
+        Compare the results of a candidate with the baseline, rerunning
+        new failures if requested, and fill in the result counts.
+        """
+        result.set_phase(None)
+
+        failures = [old_output[1], new_output[1]]
+        warns = [old_output[2], new_output[2]]
+
+        # Classify new failures: known flaky ones, and by rerunning
+        classes = {}
+        added = set(failures[1].keys()) - set(failures[0].keys())
+        for test_id in added & self.known_flaky:
+            classes[test_id] = 'known-flaky'
+            result.reruns[test_id] = ('known-flaky', {})
+        to_rerun = added - self.known_flaky
+        if keep and to_rerun and 'new' in fixtures:
+            classes.update(self.rerun_failures(result, to_rerun, fixtures, rerun, log_dir))
+
+        fail_new_count, fail_same_count = self.check(failures, verbose, type_str="failures",
+                                                     classes=classes, name=result.name)
+        warn_new_count, warn_same_count = self.check(warns, verbose, type_str="warnings",
+                                                     name=result.name)
+
+        result.test_count = new_output[0]
+        result.fail_new_count = fail_new_count
+        result.fail_same_count = fail_same_count
+        result.warn_new_count = warn_new_count
+        result.warn_same_count = warn_same_count
+        result.flaky_count = sum(1 for c in classes.values() if c in ('flaky', 'known-flaky'))
+        result.env_fail_count = sum(1 for c in classes.values() if c == 'environment')
+
+    def measure_import_times(self, result, fixture, side, log_fn):
+        """
+        Import the packages `import_repeat` times with -X importtime,
+        after a warm-up import.
+
+        Returns
+        -------
+        samples : dict or None
+            Cumulative import times of each run, {module: [seconds, ...]},
+            or None if they could not be measured.
+
+        """
+        fixture.print("{0}: measuring import times (logging to {1})...".format(
+            result.name, os.path.relpath(self.log_path(log_fn))))
+        cmd = get_import_cmd(self.import_modules)
+        with self.open_log(log_fn, 'w') as f:
+            result.set_phase('import-' + side, f.name)
+            try:
+                fixture.run_test_cmd(cmd, log=f)
+                for j in range(self.import_repeat):
+                    f.write("{0} {1}/{2}\n".format(IMPORT_RUN_MARKER, j + 1, self.import_repeat))
+                    f.flush()
+                    fixture.run_test_cmd(cmd, log=f)
+            except ProcessTimeout as exc:
+                print_logged("{0}: WARNING: import time measurement killed: {1}".format(
+                    result.name, exc))
+                return None
+
+        samples = parse_import_runs(read_log(self.log_path(log_fn)))
+
+        missing = [module for module in self.import_modules if module not in samples]
+        if missing:
+            print_logged("{0}: WARNING: no import times for {1} in {2} (see {3})".format(
+                result.name, ", ".join(missing), side, os.path.relpath(self.log_path(log_fn))))
+            return None
+        return samples
+
+    def compare_import_times(self, result):
+        """
+        Report the packages significantly slower to import in 'new'.
+        """
+        old = result.sides.get('old', {}).get('import_times')
+        new = result.sides.get('new', {}).get('import_times')
+        if not old or not new:
+            return
+
+        result.import_regressions = compare_import_times(self.import_modules, old, new,
+                                                         factor=self.slowdown_factor)
+        if not result.import_regressions:
+            print_logged("{0}: no significant import time regressions".format(result.name))
+            return
+
+        lines = []
+        for module, ratio, old_stats, new_stats, offenders in result.import_regressions:
+            lines.append("{0}: import {1} {2:.2f}x slower: {3} -> {4}".format(
+                result.name, module, ratio, format_bench_stats(old_stats),
+                format_bench_stats(new_stats)))
+            for name, old_time, new_time in offenders:
+                lines.append("    {0:>10} -> {1:>10}  {2}".format(
+                    format_time(old_time) if old_time is not None else "(new)",
+                    format_time(new_time), name))
+        print_logged("\n".join(lines) + "\n")
+
+    def print_candidates(self, results):
+        """
+        Print a table comparing the candidates with the baseline.
+        """
+        fmt = "  {0:<24}  {1:>7}  {2:>12}  {3:>14}  {4:>12}  {5:>12}"
+        lines = ["{0}: candidates compared with old:".format(self.name),
+                 fmt.format("candidate", "tests", "new failures", "flaky/env-dep",
+                            "pre-existing", "new warnings")]
+        for result in results:
+            if result.error:
+                lines.append("  {0:<24}  ERROR".format(result.name))
+            else:
+                lines.append(fmt.format(result.name, result.test_count, result.fail_new_count,
+                                        result.flaky_count + result.env_fail_count,
+                                        result.fail_same_count, result.warn_new_count))
+        print_logged("\n".join(lines) + "\n")
+
+    def run_tests(self, result, fixture, side, test_log_fn):
+        """
+        Run the test suite, in shards if configured, and parse the results.
+
+        Returns
+        -------
+        failures, warns, test_count, err_msg, details
+            Parser results, merged over the shards.
+        output : str
+            Test output.
+
+        """
+        if self.shards > 1:
+            test_ids, data = self.collect_tests(result, fixture, side, test_log_fn)
+            if not test_ids:
+                return {}, {}, -1, "ERROR: the collect command found no tests", {}, data
+            return self.run_shards(result, fixture, side, test_log_fn, test_ids)
+
+        with self.open_log(test_log_fn, 'w') as f:
+            result.set_phase('test-' + side, f.name)
+            fixture.run_test_cmd(self.run_cmd, log=f)
+
+        result.set_phase('parse-' + side)
+        data = read_log(self.log_path(test_log_fn))
+        details = {}
+        fail, warn, count, err_msg = self.parser(data, fixture.env_dir, details=details)
+        return fail, warn, count, err_msg, details, data
+
+    def collect_tests(self, result, fixture, side, test_log_fn):
+        """
+        List the test ids with the collect command.
+
+        Returns
+        -------
+        test_ids : list of str
+        output : str
+            Output of the collect command.
+
+        """
+        collect_log_fn = test_log_fn[:-len('.log')] + '-collect.log'
+        with self.open_log(collect_log_fn, 'w') as f:
+            result.set_phase('test-' + side, f.name)
+            fixture.run_test_cmd(self.collect_cmd, log=f)
+        data = read_log(self.log_path(collect_log_fn))
+        return parse_collected(data), data
+
+    def run_shards(self, result, fixture, side, test_log_fn, test_ids):
+        """
+        Run the tests split into shards concurrently, and merge their
+        results.
+        """
+        shards = make_shards(test_ids, self.shards, self.shard_by, self.test_durations)
+        log_fns = [test_log_fn[:-len('.log')] + '-{0}.log'.format(j) for j in range(len(shards))]
+
+        fixture.print("{0}: running {1} tests in {2} shards by {3} (logging to {4})...".format(
+            result.name, len(test_ids), len(shards), self.shard_by,
+            os.path.relpath(self.log_path(test_log_fn[:-len('.log')] + '-*.log'))))
+        result.set_phase('test-' + side, self.log_path(log_fns[0]))
+
+        errors = []
+
+        def run_shard(j):
+            cmd = format_shard_cmd(self.run_cmd, j, len(shards), shards[j])
+            try:
+                with self.open_log(log_fns[j], 'w') as f:
+                    fixture.run_test_cmd(cmd, log=f)
+            except BaseException as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=run_shard, args=(j,)) for j in range(len(shards))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        # Each shard has its own output files, e.g. junit:junit-$SHARD.xml
+        result.set_phase('parse-' + side)
+        parsed = []
+        outputs = []
+        for j, log_fn in enumerate(log_fns):
+            data = read_log(self.log_path(log_fn))
+            outputs.append(data)
+            parser = get_parser(self.parser_name.replace('$SHARD', str(j)))
+            details = {}
+            fail, warn, count, err_msg = parser(data, fixture.env_dir, details=details)
+            parsed.append((fail, warn, count, err_msg, details))
+
+        return merge_results(parsed) + ("\n".join(outputs),)
+
+    def rerun_failures(self, result, test_ids, fixtures, count, log_dir):
+        """
+        Rerun new failures `count` times in both environments, and
+        classify them.
+
+        Returns
+        -------
+        classes : dict
+            {test_id: classification}
+
+        """
+        test_ids = sorted(test_ids)
+        counts = dict((test_id, {}) for test_id in test_ids)
+
+        print_logged("{0}: rerunning {1} new failures {2} times...".format(
+            result.name, len(test_ids), count))
+
+        for j in range(count):
+            for side in ('old', 'new'):
+                if side not in fixtures:
                     continue
+                fixture, log = fixtures[side]
+                log_fn = os.path.join(log_dir, '%s-rerun-%s.log' % (result.name.replace(':', '-'), side))
+                result.set_phase('rerun-' + side, self.log_path(log_fn))
+                outcomes = self.run_selected(fixture, test_ids, log_fn)
+
+                for test_id, outcome in outcomes.items():
+                    if outcome is not None:
+                        key = (side, 'fail' if outcome else 'pass')
+                        counts[test_id][key] = counts[test_id].get(key, 0) + 1
+
+        result.set_phase(None)
+
+        classes = {}
+        for test_id in test_ids:
+            classes[test_id] = classify(counts[test_id])
+            result.reruns[test_id] = (classes[test_id], counts[test_id])
+
+        print_logged("{0}: reruns: {1}".format(
+            result.name, ", ".join("{0} {1}".format(sum(1 for c in classes.values() if c == name), name)
+                                 for name in ('regression', 'flaky', 'environment', 'unknown'))))
+        return classes
+
+    def run_selected(self, fixture, test_ids, log_fn, hook_env=None):
+        """
+        Run only the given tests, with the rerun command, and the site
+        hooks activated by `hook_env`, if given.
+
+        Returns
+        -------
+        outcomes : dict
+            {test_id: True (failed), False (passed) or None (not run)}
+
+        """
+        cmd = format_rerun_cmd(self.rerun_cmd, test_ids)
+        with self.open_log(log_fn, 'w') as f:
+            try:
+                fixture.run_test_cmd(cmd, log=f, hook_env=hook_env)
+            except ProcessTimeout as exc:
+                print_logged("{0}: {1}".format(self.name, exc))
+                return dict((test_id, None) for test_id in test_ids)
+        details = {}
+        fail, warn, count, err_msg = self.parser(read_log(self.log_path(log_fn)), fixture.env_dir,
+                                                 details=details)
+        cases = details.get('cases', {})
+        return dict((test_id, get_outcome(test_id, fail, cases)) for test_id in test_ids)
+
+    def bisect(self, cache_dir, log_dir, history, git_cache=True, verbose=False,
+               fixture_options=None):
+        """
+        Find the commits of the git+ packages of 'new' that caused the
+        new failures in the latest recorded run.
+        """
+        if fixture_options is None:
+            fixture_options = {}
+
+        if self.rerun_cmd is None:
+            print_logged("{0}: ERROR: bisecting needs a 'rerun' command in the config".format(self.name))
+            return
+
+        if len(self.candidates) > 1:
+            print_logged("{0}: ERROR: bisecting sections with several 'new' candidates "
+                         "is not supported".format(self.name))
+            return
+
+        run_id = history.get_latest_run(self.name)
+        if run_id is None:
+            print_logged("{0}: no recorded runs to bisect".format(self.name))
+            return
+
+        # Flaky and environment-dependent failures are not bisected
+        reruns = history.get_reruns(run_id, self.name)
+        test_ids = [test_id for test_id in history.get_new_failures(run_id, self.name)
+                    if reruns.get(test_id, 'regression') in ('regression', 'unknown')]
+        if not test_ids:
+            print_logged("{0}: no new failures in run {1}".format(self.name, run_id))
+            return
+
+        ranges, notes = get_bisect_ranges(history, self.name, test_ids)
+        for note in notes:
+            print_logged("{0}: {1}".format(self.name, note))
+        if not ranges:
+            return
+
+        log_fn = os.path.join(log_dir, '%s-bisect.log' % self.name)
+        test_log_fn = os.path.join(log_dir, '%s-bisect-test.log' % self.name)
+
+        log = self.open_log(log_fn, 'w')
+        fixture = self.fixture_cls(cache_dir, log, print_logged=print_logged,
+                                   git_cache=git_cache, verbose=verbose,
+                                   extra_env=self.environ, python=self.python,
+                                   build_deps=self.build_deps, env_name='env-bisect',
+                                   build_limits=self.build_limits,
+                                   test_limits=self.test_limits,
+                                   **fixture_options)
+        try:
+            print_logged("{0}: setting up {1} at {2} (logging to {3})...".format(
+                self.name, fixture.name, os.path.relpath(fixture.env_dir), os.path.relpath(log.name)))
+            fixture.setup()
+            fixture.install_spec(self.new_install)
+
+            for (module, url, good, bad), ids in sorted(ranges.items()):
+                commits = fixture.get_git_commits(module, good, bad)
+                print_logged("{0}: bisecting {1} commits of {2} ({3}..{4}) for {5} tests...".format(
+                    self.name, len(commits) - 1, module, good[:10], bad[:10], len(ids)))
+
+                bisection = Bisection(commits, ids)
+                while True:
+                    index = bisection.next_commit()
+                    if index is None:
+                        break
+                    step_ids = bisection.get_tests(index)
+                    fixture.install_git_revision(module, url, commits[index])
+                    outcomes = self.run_selected(fixture, step_ids, test_log_fn)
+                    bisection.update(index, outcomes)
+                    print_logged("{0}: {1} {2}: {3} failed, {4} passed".format(
+                        self.name, module, commits[index][:10],
+                        sum(1 for x in outcomes.values() if x),
+                        sum(1 for x in outcomes.values() if x is False)))
+
+                for commit, commit_ids in sorted(bisection.get_results().items()):
+                    msg = "{0}: first bad commit of {1}: {2}\n".format(
+                        self.name, module, fixture.describe_git_commit(module, commit))
+                    msg += "".join("    {0}\n".format(test_id) for test_id in commit_ids)
+                    print_logged(msg)
+                if bisection.undetermined:
+                    msg = "{0}: could not run at some commits, not bisected:\n".format(self.name)
+                    msg += "".join("    {0}\n".format(test_id)
+                                   for test_id in sorted(bisection.undetermined))
+                    print_logged(msg)
+        except (subprocess.CalledProcessError, OSError) as exc:
+            print_logged("{0}: ERROR: bisecting failed: {1} (see {2})".format(
+                self.name, exc, os.path.relpath(log.name)))
+        finally:
+            fixture.teardown()
+            log.close()
+
+    def profile(self, cache_dir, log_dir, test_ids, git_cache=True, verbose=False,
+                fixture_options=None):
+        """
+        Rerun the given tests under cProfile in the 'old' and 'new'
+        environments, keep the profiles in the cache, and show the
+        functions whose cumulative time grew the most.
+        """
+        if fixture_options is None:
+            fixture_options = {}
+
+        if self.rerun_cmd is None:
+            print_logged("{0}: ERROR: profiling needs a 'rerun' command in the config".format(self.name))
+            return
+
+        profile_dir = os.path.join(cache_dir, 'profiles', self.name)
+        try:
+            os.makedirs(profile_dir)
+        except OSError:
+            # probably already exists
+            pass
+
+        profiles = {}
+        for side, install in self.get_sides():
+            log_fn = os.path.join(log_dir, '%s-profile-build-%s.log' % (self.name, side))
+            test_log_fn = os.path.join(log_dir, '%s-profile-test-%s.log' % (self.name, side))
+            prefix = os.path.abspath(os.path.join(profile_dir, side))
+            for fn in glob.glob(prefix + '-*.prof'):
+                os.unlink(fn)
+
+            log = self.open_log(log_fn, 'w')
+            fixture = self.fixture_cls(cache_dir, log, print_logged=print_logged,
+                                       git_cache=git_cache, verbose=verbose,
+                                       extra_env=self.environ, python=self.python,
+                                       build_deps=self.build_deps,
+                                       env_name='env-profile-' + side,
+                                       build_limits=self.build_limits,
+                                       test_limits=self.test_limits,
+                                       **fixture_options)
+            try:
+                print_logged("{0}: setting up {1} at {2} (logging to {3})...".format(
+                    self.name, fixture.name, os.path.relpath(fixture.env_dir), os.path.relpath(log.name)))
+                fixture.setup()
+                fixture.install_spec(install)
+
+                print_logged("{0}: profiling {1} tests in {2} (logging to {3})...".format(
+                    self.name, len(test_ids), side, os.path.relpath(self.log_path(test_log_fn))))
+                outcomes = self.run_selected(fixture, test_ids, test_log_fn,
+                                             hook_env={'TESTRIG_PROFILE': prefix})
+                print_logged("{0}: {1}: {2} failed, {3} passed, {4} not found".format(
+                    self.name, side,
+                    sum(1 for x in outcomes.values() if x),
+                    sum(1 for x in outcomes.values() if x is False),
+                    sum(1 for x in outcomes.values() if x is None)))
+            except (subprocess.CalledProcessError, OSError) as exc:
+                print_logged("{0}: ERROR: profiling failed: {1} (see {2})".format(
+                    self.name, exc, os.path.relpath(log.name)))
+                continue
             finally:
-                wait_printer.set_log_file(None)
                 fixture.teardown()
                 log.close()
 
-        wait_printer.stop()
+            profiles[side] = load_profiles(prefix)
+            if profiles[side] is None:
+                print_logged("{0}: ERROR: no profiles written in {1} (see {2})".format(
+                    self.name, side, os.path.relpath(self.log_path(test_log_fn))))
+
+        if profiles.get('old') is None:
+            return
 
-        fail_new_count, fail_same_count = self.check(failures, verbose, type_str="failures")
-        warn_new_count, warn_same_count = self.check(warns, verbose, type_str="warnings")
+        for side, install in self.candidates:
+            if profiles.get(side) is None:
+                continue
+            diff_fn = os.path.join(profile_dir, 'diff-%s.txt' % side)
+            diff = format_diff(profiles['old'], profiles[side])
+            with text_open(diff_fn, 'w') as f:
+                f.write(diff + "\n")
+            print_logged("{0}: cumulative time per function, old -> {1} (profiles in {2}):\n    {3}\n".format(
+                self.name, side, os.path.relpath(profile_dir), diff.replace("\n", "\n    ")))
+
+    def get_part_stats(self, fixture):
+        """
+        Durations and compiler cache hits/misses of the installed parts,
+        as a list of (label, seconds, hits, misses).
+        """
+        cache_stats = dict(fixture.cache_stats)
+        parts = []
+        for label, duration in fixture.part_durations:
+            stats = cache_stats.get(label, {})
+            hits = sum(h for h, m in stats.values()) if stats else None
+            misses = sum(m for h, m in stats.values()) if stats else None
+            parts.append((label, duration, hits, misses))
+        return parts
+
+    def print_cache_stats(self, fixture):
+        for label, stats in fixture.cache_stats:
+            if not stats:
+                continue
+            fixture.print("{0}: compiler cache for {1}: {2}".format(
+                self.name, label,
+                ", ".join(format_stats(name, hits, misses)
+                          for name, (hits, misses) in sorted(stats.items()))))
 
-        return test_count[1], fail_new_count, fail_same_count, warn_new_count, warn_same_count
+    def check(self, items, verbose, type_str="failures", classes=None, name=None):
+        if name is None:
+            name = self.name
 
-    def check(self, items, verbose, type_str="failures"):
         old, new = items
 
         old_set = set(old.keys())
@@ -404,82 +1596,276 @@ class Test(object):
         added_set = new_set - old_set
         same_set = new_set.intersection(old_set)
 
-        msg = ""
-        
-        if same_set and verbose:
-            msg += "\n\n\n"
-            msg += "="*79 + "\n"
-            msg += "{0}: pre-existing {1}\n".format(self.name, type_str)
-            msg += "="*79 + "\n"
+        # New items found flaky or environment-dependent are reported
+        # separately, by name only, and not counted as new
+        excused = {}
+        if classes:
+            for k in added_set:
+                if classes.get(k) in EXCUSED_TITLES:
+                    excused.setdefault(classes[k], []).append(k)
+            for keys in excused.values():
+                added_set.difference_update(keys)
 
-            for k in sorted(same_set):
-                msg += new[k] + "\n"
+        parts = []
+
+        if same_set and verbose:
+            clusters = cluster_failures(new, same_set)
+            parts.append("\n\n\n")
+            parts.append("="*79 + "\n")
+            parts.append("{0}: pre-existing {1} ({2} distinct)\n".format(name, type_str, len(clusters)))
+            parts.append("="*79 + "\n")
+            parts.extend(format_clusters(new, clusters, verbose))
 
         if added_set:
-            msg += "\n\n\n"
-            msg += "="*79 + "\n"
-            msg += "{0}: new {1}\n".format(self.name, type_str)
-            msg += "="*79 + "\n"
+            clusters = cluster_failures(new, added_set)
+            parts.append("\n\n\n")
+            parts.append("="*79 + "\n")
+            parts.append("{0}: new {1} ({2} distinct)\n".format(name, type_str, len(clusters)))
+            parts.append("="*79 + "\n")
+            parts.extend(format_clusters(new, clusters, verbose))
+
+        for cls, title in sorted(EXCUSED_TITLES.items()):
+            if cls not in excused:
+                continue
+            parts.append("\n\n\n")
+            parts.append("="*79 + "\n")
+            parts.append("{0}: new {1} in {2}\n".format(name, type_str, title))
+            parts.append("="*79 + "\n")
 
-            for k in sorted(added_set):
-                msg += new[k] + "\n"
+            if verbose:
+                parts.extend(format_clusters(new, cluster_failures(new, excused[cls]), verbose))
+            else:
+                parts.extend(k + "\n" for k in sorted(excused[cls]))
 
+        msg = "".join(parts)
         print_logged(msg)
 
         return len(added_set), len(same_set)
-        
 
-class WaitPrinter(object):
-    def __init__(self):
-        self.log_file = None
-        self.waiting = False
-        self.last_time = 0
-        self.last_log_size = 0
-        self.thread = None
-        self.printed = False
-        self.start_time = datetime.datetime.now()
-
-    def set_log_file(self, log_file):
-        self.last_time = time.time()
-        self.last_log_size = 0
-        self.log_file = log_file
-
-    def start(self):
-        if self.thread is not None:
+
+class BenchmarkTest(Test):
+    """
+    Benchmark suite run in the 'old' and 'new' environments, reporting
+    significant slowdowns instead of new failures.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.repeat = kwargs.pop('repeat', 5)
+        Test.__init__(self, *args, **kwargs)
+        if self.shards > 1:
+            raise ValueError("benchmarks cannot be run in shards")
+        if self.repeat < 1:
+            raise ValueError("'repeat' must be at least 1")
+
+    def format_extra_info(self):
+        return Test.format_extra_info(self) + ("    type=benchmark\n"
+                "    repeat={0}\n"
+                "    slowdown_factor={1}\n").format(self.repeat, self.slowdown_factor)
+
+    def get_parser(self, name):
+        return get_bench_parser(name)
+
+    def run_tests(self, result, fixture, side, test_log_fn):
+        """
+        Run the benchmarks `repeat` times, and pool the timings.  The
+        result files are removed before each run; a failing run or a
+        missing result file is an error for the side.
+
+        Returns
+        -------
+        failures, warns, test_count, err_msg, details
+            As from a test parser, with the pooled samples in
+            ``details['timings']``, and their medians as durations in
+            ``details['cases']``.
+        output : str
+            Benchmark output.
+
+        """
+        timings = {}
+        err_msg = None
+        with self.open_log(test_log_fn, 'w') as f:
+            for j in range(self.repeat):
+                result.set_phase('test-' + side, f.name)
+                f.write("testrig: benchmark run {0}/{1}\n".format(j + 1, self.repeat))
+                f.flush()
+                for fn in get_bench_result_files(self.parser, fixture.env_dir):
+                    os.unlink(fn)
+                returncode = fixture.run_test_cmd(self.run_cmd, log=f)
+
+                result.set_phase('parse-' + side)
+                if returncode != 0:
+                    err_msg = "ERROR: benchmark run {0} failed with exit status {1}".format(
+                        j + 1, returncode)
+                    break
+                run_timings, err_msg = self.parser(None, fixture.env_dir)
+                if err_msg is not None:
+                    break
+                for name, samples in run_timings.items():
+                    timings.setdefault(name, []).extend(samples)
+
+        data = read_log(self.log_path(test_log_fn))
+
+        if err_msg is not None:
+            return {}, {}, -1, err_msg, {}, data
+
+        cases = dict((name, ('passed', median(samples))) for name, samples in timings.items())
+        details = dict(cases=cases, timings=timings)
+        return {}, {}, len(timings), None, details, data
+
+    def compare(self, result, old_output, new_output, fixtures, keep, rerun, verbose, log_dir):
+        """
+        Compare the benchmark timings of a candidate with the baseline,
+        and fill in the result counts, with significant slowdowns
+        counted as new failures.
+        """
+        result.set_phase(None)
+
+        old_timings = result.sides.get('old', {}).get('timings')
+        new_timings = result.sides.get('new', {}).get('timings')
+        if old_timings is None:
+            print_logged("{0}: ERROR: no 'old' benchmark timings to compare with".format(result.name))
+            return
+        if new_timings is None:
+            print_logged("{0}: ERROR: no 'new' benchmark timings to compare".format(result.name))
             return
 
-        self.waiting = True
-        self.last_time = time.time()
-        self.thread = threading.Thread(target=self._run)
-        self.thread.daemon = True
-        self.thread.start()
-
-    def stop(self):
-        self.waiting = False
-        if self.printed:
-            elapsed = datetime.datetime.now() - self.start_time
-            print("    ... done ({0} elapsed)".format(elapsed),
-                  file=sys.stderr)
-            sys.stderr.flush()
-            self.printed = False
-
-    def _run(self):
-        self.start_time = datetime.datetime.now()
-        while self.waiting:
-            time.sleep(60)
-            if time.time() - self.last_time >= 60:
-                self.last_time = time.time()
-                try:
-                    size = os.stat(self.log_file).st_size
-                except (TypeError, OSError):
-                    continue
-                if size > self.last_log_size:
-                    self.printed = True
-                    elapsed = datetime.datetime.now() - self.start_time
-                    print("    ... still running ({0} elapsed)".format(elapsed), 
-                          file=sys.stderr)
-                    sys.stderr.flush()
-                self.last_log_size = size
+        changes = compare_timings(old_timings, new_timings, factor=self.slowdown_factor)
+        result.slowdowns = [(name, ratio, old_stats, new_stats)
+                            for name, ratio, old_stats, new_stats, change in changes
+                            if change == 'slower']
+        speedups = sum(1 for change in changes if change[-1] == 'faster')
+
+        lines = ["{0}: {1} benchmarks compared, {2} significantly slower, {3} significantly faster".format(
+            result.name, len(changes), len(result.slowdowns), speedups)]
+        for name, ratio, old_stats, new_stats, change in changes:
+            if change is None and not verbose:
+                continue
+            lines.append("    {0:<8} {1:>6.2f}x  {2}  ->  {3}  {4}".format(
+                change or '', ratio, format_bench_stats(old_stats), format_bench_stats(new_stats), name))
+        print_logged("\n".join(lines) + "\n")
+
+        result.test_count = len(changes)
+        result.fail_new_count = len(result.slowdowns)
+        result.fail_same_count = 0
+        result.warn_new_count = 0
+        result.warn_same_count = 0
+
+
+class SharedSides(object):
+    """
+    Sides that the tests of one job have in common: the test results
+    of each environment and test command, and the environments kept for
+    reruns, which are torn down at the end of the job.
+    """
+
+    def __init__(self):
+        self.outputs = {}
+        self.fixtures = {}
+        self.lock = threading.Lock()
+
+    def get_output(self, fingerprint):
+        with self.lock:
+            return self.outputs.get(fingerprint)
+
+    def put_output(self, fingerprint, name, side_result, output):
+        with self.lock:
+            self.outputs.setdefault(fingerprint, dict(name=name, side_result=dict(side_result),
+                                                      output=output))
+
+    def keep(self, fingerprint, fixture, log):
+        with self.lock:
+            self.fixtures.setdefault(fingerprint, (fixture, log))
+
+    def is_kept(self, fixture):
+        with self.lock:
+            return any(fixture is f for f, log in self.fixtures.values())
+
+    def teardown(self):
+        with self.lock:
+            for fixture, log in self.fixtures.values():
+                fixture.teardown()
+                log.close()
+            self.fixtures.clear()
+
+
+class TestResult(object):
+    """
+    Result of running a Test.
+
+    Attributes
+    ----------
+    name : str
+        Section name.
+    test_count, fail_new_count, fail_same_count, warn_new_count, warn_same_count : int
+        Counts of tests, new and pre-existing failures, new and
+        pre-existing warnings. -1 if the tests could not be run.
+    sides : dict
+        Details of the 'old' and 'new' sides: environment fingerprint
+        and spec, installed versions (info), status ('ok',
+        'build-error', 'timeout', 'parse-error'), test count, per-test
+        outcomes {test_id: (outcome, duration)} (cases), and the
+        installed parts [(label, duration, cache hits, cache misses)]
+        (parts).
+    timings : dict
+        Phase durations, {phase: seconds}.
+    reruns : dict
+        Classification and rerun counts of new failures,
+        {test_id: (classification, counts)}, see rerun.py.
+    flaky_count, env_fail_count : int
+        Numbers of new failures found flaky or environment-dependent.
+    import_regressions : list
+        Packages significantly slower to import in 'new',
+        [(module, ratio, old_stats, new_stats, offenders)], see
+        importtime.py.
+    slowdowns : list or None
+        For benchmarks, the significantly slower ones,
+        [(name, ratio, old_stats, new_stats)] with the (median, low,
+        high) of the timings; counted in fail_new_count.
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.test_count = -1
+        self.fail_new_count = -1
+        self.fail_same_count = -1
+        self.warn_new_count = -1
+        self.warn_same_count = -1
+        self.sides = {}
+        self.timings = {}
+        self.reruns = {}
+        self.flaky_count = 0
+        self.env_fail_count = 0
+        self.slowdowns = None
+        self.import_regressions = []
+        self._phase = None
+        self._phase_start = None
+
+    @property
+    def error(self):
+        return self.fail_new_count < 0 or self.test_count < 0
+
+    def format_excused(self):
+        parts = []
+        if self.flaky_count:
+            parts.append("{0} flaky, ".format(self.flaky_count))
+        if self.env_fail_count:
+            parts.append("{0} environment-dependent, ".format(self.env_fail_count))
+        return "".join(parts)
+
+    def set_phase(self, phase, log_fn=None):
+        """
+        Record the end of the current phase and the start of a new one,
+        and report it to the progress monitor. Phase None ends timing.
+        """
+        now = time.time()
+        if self._phase is not None:
+            self.timings[self._phase] = self.timings.get(self._phase, 0) + now - self._phase_start
+        if phase is None and self._phase is None:
+            return
+        self._phase = phase
+        self._phase_start = now
+        report_progress(self.name, phase, log_fn)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+"""
+Clustering of failures by a signature of their messages.
+
+A message is normalized by replacing the parts that differ between
+tests failing for the same reason -- the test's own name, memory
+addresses, temporary and other absolute paths, line numbers and numeric
+values -- and the signature is a hash of the result.  Failures with the
+same signature are reported once, with one representative message.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import re
+import hashlib
+
+
+# Test ids of a cluster listed, in addition to the representative
+MAX_LISTED = 20
+
+NORMALIZE_PATTERNS = [
+    # Memory addresses, e.g. <object at 0x7f2a3c>
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '<addr>'),
+    # Temporary paths
+    (re.compile(r'(?:/tmp|/var/tmp|/private/var/folders|[A-Za-z]:\\[^\s"\']*\\Temp)[/\\][^\s/\\"\':,)]*'),
+     '<tmp>'),
+    # Absolute paths, up to the last component
+    (re.compile(r'(?<![\w.])(?:/[^\s/"\':,()]+)+/(?=[^\s/"\']+)'), '.../'),
+    # Line numbers
+    (re.compile(r'\bline \d+'), 'line ?'),
+    (re.compile(r'(\.pyx?|\.pxd|\.c|\.h):\d+'), r'\1:?'),
+    # Numbers
+    (re.compile(r'(?<!\w)[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?'), '?'),
+]
+
+
+def normalize_message(text, test_id=None):
+    """
+    Normalize a failure message, for comparing failures of different
+    tests.
+    """
+    if test_id:
+        names = [test_id]
+        base = test_id.split('[', 1)[0]
+        names.append(base)
+        # The test function and class names
+        parts = [part for part in re.split(r'[\s().:/]+', base) if part]
+        names.extend(part for part in parts[-2:] if len(part) > 3)
+        for name in sorted(set(names), key=len, reverse=True):
+            text = text.replace(name, '<test>')
+
+    for pattern, replacement in NORMALIZE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return "\n".join(line.rstrip() for line in text.splitlines() if line.strip())
+
+
+def get_signature(text, test_id=None):
+    """
+    Signature of a failure message, as a short hex string.
+    """
+    normalized = normalize_message(text, test_id)
+    return hashlib.sha1(normalized.encode('utf-8', 'replace')).hexdigest()[:12]
+
+
+def cluster_failures(failures, test_ids=None):
+    """
+    Group failures by signature.
+
+    Parameters
+    ----------
+    failures : dict
+        Failure messages, {test_id: message}.
+    test_ids : iterable, optional
+        The failures to group, all by default.
+
+    Returns
+    -------
+    clusters : list of (signature, test_ids)
+        Largest cluster first, each with its test ids sorted.
+
+    """
+    if test_ids is None:
+        test_ids = failures.keys()
+
+    clusters = {}
+    for test_id in test_ids:
+        signature = get_signature(failures[test_id], test_id)
+        clusters.setdefault(signature, []).append(test_id)
+
+    result = [(signature, sorted(ids)) for signature, ids in clusters.items()]
+    result.sort(key=lambda item: (-len(item[1]), item[1][0]))
+    return result
+
+
+def format_clusters(failures, clusters, verbose=False):
+    """
+    Format the representative failure of each cluster, with the other
+    test ids of the cluster (at most MAX_LISTED unless `verbose`).
+
+    Returns
+    -------
+    parts : list of str
+        Lines of text, to be joined.
+
+    """
+    parts = []
+    for signature, test_ids in clusters:
+        if len(test_ids) > 1:
+            parts.append("[{0} tests failing alike (signature {1}), for example:]\n".format(
+                len(test_ids), signature))
+        parts.append(failures[test_ids[0]] + "\n")
+        if len(test_ids) > 1:
+            others = test_ids[1:]
+            shown = others if verbose else others[:MAX_LISTED]
+            parts.append("[also in:]\n")
+            parts.extend("    {0}\n".format(test_id) for test_id in shown)
+            if len(shown) < len(others):
+                parts.append("    ... and {0} more\n".format(len(others) - len(shown)))
+    return parts
@@ -0,0 +1,173 @@
+"""
+Compiler cache (ccache, f90cache) detection and statistics.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import re
+import subprocess
+
+
+class CompilerCache(object):
+    """
+    Compiler cache masquerading as some compilers on PATH.
+
+    Parameters
+    ----------
+    name : str
+        Name of the cache executable.
+    compilers : list of str
+        Compiler names the cache is expected to masquerade as.
+    dir_var : str
+        Environment variable selecting the cache directory.
+
+    """
+
+    def __init__(self, name, compilers, dir_var):
+        self.name = name
+        self.compilers = compilers
+        self.dir_var = dir_var
+        self.executable = None
+
+    def __repr__(self):
+        return "<CompilerCache {0} at {1}>".format(self.name, self.executable)
+
+    def detect(self, path):
+        """
+        Check whether some of the compilers found first on `path`
+        resolve to the cache.
+        """
+        for compiler in self.compilers:
+            exe = which(compiler, path)
+            if exe is None:
+                continue
+            real_exe = os.path.realpath(exe)
+            if os.path.basename(real_exe) == self.name:
+                self.executable = real_exe
+                return True
+        return False
+
+    def get_env(self, cache_dir):
+        """
+        Environment variables for using the cache directory `cache_dir`.
+        """
+        return {self.dir_var: os.path.join(cache_dir, self.name)}
+
+    def set_max_size(self, size, env):
+        """
+        Set the size limit of the cache (e.g. '5G').
+        """
+        subprocess.check_call([self.executable, '-M', size], env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def get_stats(self, env):
+        """
+        Get the current hit/miss counts of the cache.
+
+        Returns
+        -------
+        hits, misses : int
+            Counts, or (None, None) if they could not be obtained.
+
+        """
+        for flag in ('--print-stats', '-s'):
+            try:
+                p = subprocess.Popen([self.executable, flag], env=env,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                out, err = p.communicate()
+            except OSError:
+                return None, None
+            if p.returncode == 0:
+                hits, misses = parse_stats(out.decode('utf-8', 'replace'))
+                if hits is not None:
+                    return hits, misses
+        return None, None
+
+
+def get_compiler_caches():
+    return [CompilerCache('ccache', ['gcc', 'cc', 'g++', 'c++'], 'CCACHE_DIR'),
+            CompilerCache('f90cache', ['gfortran', 'f95', 'f90'], 'F90CACHE_DIR')]
+
+
+def detect_compiler_caches(path=None):
+    """
+    Return the compiler caches that are effective on `path`.
+    """
+    if path is None:
+        path = os.environ.get('PATH', '')
+    return [c for c in get_compiler_caches() if c.detect(path)]
+
+
+def which(name, path):
+    for d in path.split(os.pathsep):
+        if not d:
+            continue
+        fn = os.path.join(d, name)
+        if os.path.isfile(fn) and os.access(fn, os.X_OK):
+            return fn
+    return None
+
+
+def parse_stats(text):
+    """
+    Parse hit and miss counts from the statistics output of ccache or
+    f90cache.
+
+    Understands ``ccache --print-stats`` (ccache >= 4), and the ``-s``
+    outputs of ccache 3 / f90cache and ccache 4.
+
+    Returns
+    -------
+    hits, misses : int or None
+
+    """
+    hits = None
+    misses = None
+
+    def add(a, b):
+        return b if a is None else a + b
+
+    for line in text.splitlines():
+        # ccache --print-stats
+        m = re.match(r'^(direct_cache_hit|preprocessed_cache_hit|cache_miss)\t(\d+)\s*$', line)
+        if m:
+            if m.group(1) == 'cache_miss':
+                misses = add(misses, int(m.group(2)))
+            else:
+                hits = add(hits, int(m.group(2)))
+            continue
+
+        # ccache 3 / f90cache -s
+        m = re.match(r'^cache hit(?: \((?:direct|preprocessed)\))?\s+(\d+)\s*$', line)
+        if m:
+            hits = add(hits, int(m.group(1)))
+            continue
+
+        m = re.match(r'^cache miss\s+(\d+)\s*$', line)
+        if m:
+            misses = add(misses, int(m.group(1)))
+            continue
+
+    if hits is None and misses is None:
+        # ccache 4 -s: only the first (summary) Hits/Misses lines
+        m = re.search(r'^\s*Hits:\s+(\d+)', text, re.M)
+        if m:
+            hits = int(m.group(1))
+        m = re.search(r'^\s*Misses:\s+(\d+)', text, re.M)
+        if m:
+            misses = int(m.group(1))
+
+    if hits is not None and misses is None:
+        misses = 0
+    elif misses is not None and hits is None:
+        hits = 0
+
+    return hits, misses
+
+
+def format_stats(name, hits, misses):
+    total = hits + misses
+    if total == 0:
+        return "{0}: no compiler calls".format(name)
+    return "{0}: {1}/{2} hits ({3:.0f}%)".format(name, hits, total, 100.0 * hits / total)
@@ -0,0 +1,149 @@
+"""
+Reading the testrig.ini configuration.
+
+Values support string interpolation, ``{name}`` being replaced by the
+value of ``name`` in the same section.  A value referring to its own
+name gets the value it overrides, e.g. ``pkgs = {pkgs} extra`` in a
+section extends ``pkgs`` of ``DEFAULT``.  Each value is resolved once
+and memoized.
+
+A section with ``matrix.NAME`` keys is expanded into one cell for each
+combination of their values (one per line), with ``NAME`` set to the
+value in the cell.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import re
+import itertools
+
+
+MATRIX_PREFIX = 'matrix.'
+
+
+class Config(object):
+    """
+    Values of the sections of a configuration file.
+
+    Parameters
+    ----------
+    parser : RawConfigParser
+        Parsed configuration.
+
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self._cache = {}
+
+    def sections(self):
+        return [section for section in self.parser.sections() if section != 'DEFAULT']
+
+    def options(self, section):
+        return sorted(self.parser.options(section))
+
+    def get(self, section, name, default=None, cell=()):
+        """
+        Interpolated value of an option.
+
+        Parameters
+        ----------
+        section : str
+            Section name.
+        name : str
+            Option name.
+        default : str, optional
+            Value returned if the option is not set.
+        cell : tuple of (name, value), optional
+            Values of the matrix cell, overriding those of the section.
+
+        """
+        layers = self._get_layers(section, name, cell)
+        if not layers:
+            return default
+        return self._resolve(section, name, cell, 0, ())
+
+    def _get_layers(self, section, name, cell):
+        """
+        Raw values of an option, from the cell, the section and
+        DEFAULT, each overriding the next.
+        """
+        layers = [value for key, value in cell if key == name]
+        default = None
+        if self.parser.has_option('DEFAULT', name):
+            default = self.parser.get('DEFAULT', name)
+        if self.parser.has_option(section, name):
+            value = self.parser.get(section, name)
+            if value != default:
+                layers.append(value)
+        if default is not None:
+            layers.append(default)
+        return layers
+
+    def _resolve(self, section, name, cell, level, stack):
+        key = (section, cell, name, level)
+        if key in self._cache:
+            return self._cache[key]
+        if key in stack:
+            raise ValueError("string interpolation cycle for value {}".format(name))
+        stack = stack + (key,)
+
+        layers = self._get_layers(section, name, cell)
+        value = layers[level]
+        for ref in set(re.findall(r'{([^}]*)}', value)):
+            if ref == name:
+                # The value overridden by this one
+                if level + 1 < len(layers):
+                    v = self._resolve(section, name, cell, level + 1, stack)
+                else:
+                    v = ''
+            elif self._get_layers(section, ref, cell):
+                v = self._resolve(section, ref, cell, 0, stack)
+            else:
+                v = ''
+            value = value.replace('{' + ref + '}', v)
+
+        self._cache[key] = value
+        return value
+
+    def get_matrix(self, section):
+        """
+        Expand the matrix of a section.
+
+        Returns
+        -------
+        cells : list of (label, cell)
+            The cells, as tuples of (name, value) pairs, each with a label
+            made of the values, or ``[('', ())]`` if the section has no
+            matrix.
+
+        """
+        axes = []
+        for option in self.options(section):
+            if not option.startswith(MATRIX_PREFIX):
+                continue
+            name = option[len(MATRIX_PREFIX):]
+            values = []
+            for line in self.parser.get(section, option).splitlines():
+                line = line.strip()
+                if line and line not in values:
+                    values.append(line)
+            if not values:
+                raise ValueError("no values for '{0}'".format(option))
+
+            # Short values name the cells, others are numbered
+            if all(re.match(r'^[A-Za-z0-9_.+]{1,24}$', value) for value in values):
+                labels = values
+            else:
+                labels = ["{0}{1}".format(name, j + 1) for j in range(len(values))]
+            axes.append([((name, value), label) for value, label in zip(values, labels)])
+
+        if not axes:
+            return [('', ())]
+
+        cells = []
+        for combination in itertools.product(*axes):
+            cell = tuple(item for item, label in combination)
+            label = "-".join(label for item, label in combination)
+            cells.append((label, cell))
+        return cells
@@ -0,0 +1,256 @@
+"""
+Content-keyed cache for Cython-generated sources.
+
+This module is copied into the site hook directory of the fixtures, and
+imported from the ``sitecustomize.py`` there during builds, so it must
+not depend on the rest of testrig.
+
+The cache wraps ``Cython.Compiler.Main.run_pipeline`` and maps
+
+    (Cython version, module name, source path relative to the working
+     directory, compiler options, content of the source file and of all
+     files it includes or cimports)
+
+to the generated C/C++ files, so that unchanged ``.pyx`` files are not
+re-cythonized after ``git clean``.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+
+
+# CompilationOptions attributes affecting the generated code
+OPTION_NAMES = [
+    'compiler_directives', 'cplus', 'language_level', 'compile_time_env',
+    'embed', 'emit_linenums', 'c_line_in_traceback', 'gdb_debug',
+    'output_file', 'include_path', 'generate_pxi', 'capi_reexport_cincludes',
+    'common_utility_include_dir', 'formal_grammar',
+]
+
+
+def _stable_repr(value):
+    if isinstance(value, dict):
+        return "{" + ", ".join("{0}: {1}".format(_stable_repr(k), _stable_repr(v))
+                               for k, v in sorted(value.items(), key=lambda x: repr(x[0]))) + "}"
+    elif isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_stable_repr(v) for v in value) + "]"
+    else:
+        return repr(value)
+
+
+def get_dependencies(source):
+    """
+    Return the included/cimported dependency closure of a Cython source file.
+    """
+    from Cython.Build.Dependencies import create_dependency_tree
+    tree = create_dependency_tree()
+    return sorted(set(os.path.abspath(fn) for fn in tree.all_dependencies(source)))
+
+
+def get_key(source, options, full_module_name):
+    """
+    Compute the cache key for compiling `source` with given options.
+    """
+    import Cython
+
+    source = os.path.abspath(source)
+
+    h = hashlib.sha256()
+
+    def update(text):
+        h.update(text.encode('utf-8'))
+        h.update(b'\0')
+
+    update(Cython.__version__)
+    update(repr(full_module_name))
+    update(os.path.relpath(source, os.getcwd()))
+    for name in OPTION_NAMES:
+        update(name + '=' + _stable_repr(getattr(options, name, None)))
+
+    deps = get_dependencies(source)
+    if source not in deps:
+        deps.insert(0, source)
+    base_dir = os.path.dirname(source)
+    for fn in deps:
+        update(os.path.relpath(fn, base_dir))
+        with open(fn, 'rb') as f:
+            h.update(f.read())
+        h.update(b'\0')
+
+    return h.hexdigest()
+
+
+class CythonCache(object):
+    """
+    Cache directory of Cython outputs.
+
+    Each entry is a directory named by the cache key, containing the
+    generated files and a ``files.json`` mapping them to paths
+    relative to the source file.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def load(self, key, source):
+        """
+        Restore the cached outputs next to `source`.
+
+        Returns
+        -------
+        c_file : str or None
+            Absolute path of the restored main output file, or None if
+            there was no cache entry.
+
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, 'files.json'), 'r') as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        base_dir = os.path.dirname(os.path.abspath(source))
+        for index, relname in enumerate(meta['files']):
+            dst = os.path.normpath(os.path.join(base_dir, relname))
+            dst_dir = os.path.dirname(dst)
+            if not os.path.isdir(dst_dir):
+                os.makedirs(dst_dir)
+            shutil.copyfile(os.path.join(entry_dir, str(index)), dst)
+
+        return os.path.normpath(os.path.join(base_dir, meta['c_file']))
+
+    def store(self, key, source, c_file, extra_files):
+        """
+        Store the outputs of compiling `source` to the cache.
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+
+        parent = os.path.dirname(entry_dir)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                # created concurrently
+                pass
+
+        base_dir = os.path.dirname(os.path.abspath(source))
+        files = [c_file] + [fn for fn in extra_files if fn and os.path.isfile(fn)]
+        meta = {'c_file': os.path.relpath(c_file, base_dir),
+                'files': [os.path.relpath(fn, base_dir) for fn in files]}
+
+        # Write under a temporary name and rename, so that concurrent
+        # builds never see partial entries
+        tmp_dir = tempfile.mkdtemp(dir=parent)
+        try:
+            for index, fn in enumerate(files):
+                shutil.copyfile(fn, os.path.join(tmp_dir, str(index)))
+            with open(os.path.join(tmp_dir, 'files.json'), 'w') as f:
+                json.dump(meta, f)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # lost a race to another build, or out of space
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def patch(main_module, cache):
+    """
+    Wrap ``run_pipeline`` in Cython.Compiler.Main to use the cache.
+    """
+    orig_run_pipeline = main_module.run_pipeline
+
+    if getattr(orig_run_pipeline, '_testrig_cache', None) is not None:
+        return
+
+    def run_pipeline(source, options, full_module_name=None, *a, **kw):
+        try:
+            key = get_key(source, options, full_module_name)
+        except Exception:
+            # Dependency scanning failed; don't cache
+            return orig_run_pipeline(source, options, full_module_name, *a, **kw)
+
+        c_file = cache.load(key, source)
+        if c_file is not None:
+            result = main_module.CompilationResult()
+            result.main_source_file = os.path.abspath(source)
+            result.c_file = c_file
+            result.num_errors = 0
+            return result
+
+        result = orig_run_pipeline(source, options, full_module_name, *a, **kw)
+
+        if getattr(result, 'num_errors', 0) == 0 and result.c_file and os.path.isfile(result.c_file):
+            cache.store(key, source, result.c_file,
+                        [getattr(result, name, None) for name in ('h_file', 'api_file', 'i_file')])
+
+        return result
+
+    run_pipeline._testrig_cache = cache
+    main_module.run_pipeline = run_pipeline
+
+
+class _PatchingFinder(object):
+    """
+    Meta path finder patching Cython.Compiler.Main when it is imported.
+    """
+
+    name = 'Cython.Compiler.Main'
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != self.name:
+            return None
+
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        loader = spec.loader
+        exec_module = getattr(loader, 'exec_module', None)
+        if exec_module is None:
+            return spec
+
+        cache = self.cache
+
+        def exec_and_patch(module):
+            exec_module(module)
+            patch(module, cache)
+
+        loader.exec_module = exec_and_patch
+        return spec
+
+
+def install(cache_dir):
+    """
+    Arrange for Cython to use the cache in `cache_dir`.
+    """
+    cache = CythonCache(cache_dir)
+
+    if 'Cython.Compiler.Main' in sys.modules:
+        patch(sys.modules['Cython.Compiler.Main'], cache)
+    elif sys.version_info[0] >= 3:
+        sys.meta_path.insert(0, _PatchingFinder(cache))
+    else:
+        try:
+            import Cython.Compiler.Main
+        except ImportError:
+            return
+        patch(Cython.Compiler.Main, cache)
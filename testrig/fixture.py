@@ -3,10 +3,16 @@ from __future__ import absolute_import, division, print_function
 import sys
 import os
 import shutil
+import time
 import locale
 import subprocess
+import threading
 import multiprocessing
 import json
+import hashlib
+
+from .process import run_process
+from . import gitcache
 
 try:
     from shlex import quote as shell_quote
@@ -16,6 +22,13 @@ except ImportError:
 
 VIRTUALENV_LOCK = multiprocessing.Lock()
 
+CONDA_INFO = {}
+CONDA_INFO_LOCK = threading.Lock()
+
+# Locks for updating the cached git repositories, {path: Lock}
+GIT_CACHE_LOCKS = {}
+GIT_CACHE_LOCKS_LOCK = threading.Lock()
+
 
 class BaseFixture(object):
     """
@@ -42,12 +55,26 @@ class BaseFixture(object):
     """
 
     def __init__(self, cache_dir, log, print_logged=None, cleanup=True, git_cache=True, verbose=False,
-                 extra_env=None, python=None):
+                 extra_env=None, python=None, wheelhouse=None, offline=False, prefetcher=None,
+                 build_deps=None, site_hook_dir=None, cython_cache=None,
+                 compiler_caches=None, compiler_cache_dir=None, compiler_cache_size=None,
+                 conda_lock_dir=None, conda_pkgs_dir=None, refresh_conda_lock=False,
+                 conda_lock_max_age=None,
+                 env_name='env', build_limits=None, test_limits=None):
         self.log = log
         self.cleanup = cleanup
         self.git_cache = git_cache
         self.verbose = verbose
         self.python = python
+        self.wheelhouse = wheelhouse
+        self.offline = offline
+        self.prefetcher = prefetcher
+        self.build_deps = list(build_deps or [])
+        self.site_hook_dir = site_hook_dir
+        self.cython_cache = cython_cache
+        self.build_limits = build_limits
+        self.test_limits = test_limits
+        self.build_start = None
 
         if print_logged is None:
             self._print = print
@@ -56,16 +83,39 @@ class BaseFixture(object):
 
         self.cache_dir = os.path.abspath(cache_dir)
 
-        self.env_dir = os.path.join(self.cache_dir, 'env')
-        self.code_dir = os.path.join(self.cache_dir, 'code')
-        self.build_dir = os.path.join(self.cache_dir, 'build')
+        # Environments built concurrently (env-NAME) have their own
+        # source and build directories
+        suffix = env_name[len('env'):]
+        self.env_dir = os.path.join(self.cache_dir, env_name)
+        self.code_dir = os.path.join(self.cache_dir, 'code' + suffix)
+        self.build_dir = os.path.join(self.cache_dir, 'build' + suffix)
         self.repo_cache_dir = os.path.join(self.cache_dir, 'git-cache')
         if not extra_env:
             self.extra_env = {}
         else:
             self.extra_env = extra_env
 
+        # Relative cache directory is relative to the fixture's cache dir
+        self.compiler_caches = list(compiler_caches or [])
+        if compiler_cache_dir is not None:
+            self.compiler_cache_dir = os.path.join(self.cache_dir, compiler_cache_dir)
+        else:
+            self.compiler_cache_dir = None
+        self.compiler_cache_size = compiler_cache_size
+        self.cache_stats = []
+        self.part_durations = []
+        self.git_revisions = {}
+
+        # Used by conda fixtures only
+        self.conda_lock_dir = conda_lock_dir
+        self.conda_pkgs_dir = conda_pkgs_dir
+        self.refresh_conda_lock = refresh_conda_lock
+        self.conda_lock_max_age = conda_lock_max_age
+
     def setup(self):
+        # The build time limit counts from here
+        self.build_start = time.time()
+
         for d in (self.code_dir, self.build_dir, self.repo_cache_dir):
             if not os.path.isdir(d):
                 os.makedirs(d)
@@ -73,12 +123,37 @@ class BaseFixture(object):
         if os.path.isdir(self.env_dir):
             shutil.rmtree(self.env_dir)
 
+        if self.compiler_cache_dir is not None and self.compiler_cache_size:
+            env = dict(os.environ)
+            env.update(self.get_compiler_cache_env())
+            for cache in self.compiler_caches:
+                cache.set_max_size(self.compiler_cache_size, env)
+
     def teardown(self):
         if self.cleanup:
             for d in (self.env_dir, self.code_dir, self.build_dir):
                 if os.path.isdir(d):
                     shutil.rmtree(d)
 
+    def get_build_mark(self):
+        """
+        Fingerprint of the completed build in the environment directory,
+        or None if the environment was not completely built.
+        """
+        try:
+            with open(os.path.join(self.env_dir, '.testrig-build'), 'r') as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def set_build_mark(self, fingerprint):
+        """
+        Mark the environment as completely built from a specification
+        with the given fingerprint.
+        """
+        with open(os.path.join(self.env_dir, '.testrig-build'), 'w') as f:
+            f.write(fingerprint)
+
     def _decode(self, data):
         lang, encoding = locale.getdefaultlocale()
         try:
@@ -116,13 +191,71 @@ class BaseFixture(object):
             env = dict(env)
         env.setdefault('CCACHE_BASEDIR', self.env_dir)
         env.setdefault('CCACHE_SLOPPINESS', 'file_macro,time_macros')
+        if self.site_hook_dir is not None:
+            add_path(env, 'PYTHONPATH', self.site_hook_dir)
+        if self.cython_cache is not None:
+            env['TESTRIG_CYTHON_CACHE'] = self.cython_cache
+        env.update(self.get_compiler_cache_env())
         env.update(self.extra_env)
 
-        subprocess.check_call(cmd, stdout=self.log, stderr=self.log, cwd=cwd, env=env)
+        run_process(cmd, self.log, self.build_limits, start=self.build_start, cwd=cwd, env=env)
 
-    def run_test_cmd(self, cmd, log):
+    def run_test_cmd(self, cmd, log, hook_env=None):
+        """
+        Run a test command in the environment, and return its exit status.
+        """
         raise NotImplemented()
 
+    def add_hook_env(self, env, hook_env):
+        """
+        Add variables activating site hooks (see sitehook.py) in a test
+        command's environment.
+        """
+        env = dict(env)
+        env.update(hook_env)
+        if self.site_hook_dir is not None:
+            add_path(env, 'PYTHONPATH', self.site_hook_dir)
+        return env
+
+    def get_compiler_cache_env(self):
+        env = {}
+        if self.compiler_cache_dir is not None:
+            for cache in self.compiler_caches:
+                env.update(cache.get_env(self.compiler_cache_dir))
+        return env
+
+    def get_compiler_cache_stats(self):
+        env = dict(os.environ)
+        env.update(self.get_compiler_cache_env())
+        return dict((cache.name, cache.get_stats(env)) for cache in self.compiler_caches)
+
+    def install_part(self, label, func, *args):
+        """
+        Run an install function, recording its duration in
+        ``self.part_durations``, and the compiler cache hits and misses
+        it caused in ``self.cache_stats``.
+        """
+        start = time.time()
+        before = None
+        if self.compiler_caches:
+            before = self.get_compiler_cache_stats()
+        try:
+            return func(*args)
+        finally:
+            self.part_durations.append((label, time.time() - start))
+            if before is not None:
+                after = self.get_compiler_cache_stats()
+                stats = {}
+                for name, (hits, misses) in sorted(after.items()):
+                    old_hits, old_misses = before.get(name, (None, None))
+                    if None in (hits, misses, old_hits, old_misses):
+                        continue
+                    if hits < old_hits or misses < old_misses:
+                        # statistics were zeroed meanwhile
+                        continue
+                    stats[name] = (hits - old_hits, misses - old_misses)
+                self.cache_stats.append((label, stats))
+
     def run_python_script(self, cmd, cwd=None):
         cmd = [os.path.join(self.env_dir, 'bin', 'python')] + cmd
         self.run_cmd(cmd, cwd=cwd)
@@ -131,7 +264,54 @@ class BaseFixture(object):
         cmd = [os.path.join(self.env_dir, 'bin', 'pip')] + cmd
         return self.run_cmd(cmd, cwd=cwd)
 
-    def _parse_git_url(self, part):
+    def get_pip_install_args(self):
+        """
+        Extra arguments for ``pip install``: the local wheelhouse, and
+        the shared build environment.
+        """
+        args = []
+        if self.build_deps:
+            args += ['--no-build-isolation']
+        if self.wheelhouse is not None and os.path.isdir(self.wheelhouse):
+            args += ['--find-links', self.wheelhouse]
+        if self.offline:
+            args += ['--no-index']
+        return args
+
+    @classmethod
+    def get_download_python(cls, python):
+        """
+        Python interpreter to use for downloading packages for the fixture.
+        """
+        return python
+
+    @classmethod
+    def get_fetch_items(cls, package_spec):
+        """
+        Return the parts of the package specification that need fetching
+        over the network, in install order.
+
+        Returns
+        -------
+        items : list of (kind, item)
+            Either ('git', (module, url, branch)) or ('pip', (spec, binary_ok)).
+
+        """
+        items = []
+        binary_ok = True
+        for part in package_spec:
+            if part == '--binary':
+                binary_ok = True
+            elif part == '--no-binary':
+                binary_ok = False
+            elif part.startswith('git+'):
+                items.append(('git', cls._parse_git_url(part)))
+            else:
+                items.append(('pip', (part, binary_ok)))
+        return items
+
+    @classmethod
+    def _parse_git_url(cls, part):
         assert part.startswith('git+')
 
         part = part[4:]
@@ -147,10 +327,24 @@ class BaseFixture(object):
         module = url.strip('/').split('/')[-1]
         return module, url, branch
 
+    def install_build_deps(self):
+        """
+        Install the build dependencies into the environment.
+
+        With build dependencies given, packages are built without build
+        isolation against the environment itself, instead of each sdist
+        getting a new isolated build environment.
+        """
+        if self.build_deps:
+            self.print("installing build dependencies: {0}".format(" ".join(self.build_deps)), level=1)
+            self._env_install(self.build_deps, True)
+
     def install_spec(self, package_spec):
         """
         Install python packages, based on pip-like version specification string
         """
+        self.install_build_deps()
+
         binary_ok = True
         for part in package_spec:
             if part == '--binary':
@@ -159,9 +353,9 @@ class BaseFixture(object):
                 binary_ok = False
             elif part.startswith('git+'):
                 module, url, branch = self._parse_git_url(part)
-                self._git_install(module, url, branch)
+                self.install_part(module, self._git_install, module, url, branch)
             else:
-                self._env_install([part], binary_ok)
+                self.install_part(part, self._env_install, [part], binary_ok)
 
     def _git_install(self, module, src_repo, branch, setup_py=None):
         if setup_py is None:
@@ -172,13 +366,32 @@ class BaseFixture(object):
         if os.path.isdir(repo):
             shutil.rmtree(repo)
 
-        if self.git_cache:
+        if self.offline:
+            # Check out the url's branch as last fetched into the cache
+            cached_repo = self.get_cached_repo(module)
+            commit = None
+            if self.git_cache and os.path.isdir(cached_repo):
+                commit = gitcache.resolve(cached_repo, src_repo, branch)
+            if commit is None:
+                raise OSError("offline: {0} of {1} is not in the git cache; "
+                              "run once without --offline".format(branch or 'HEAD', src_repo))
+            self.run_cmd(['git', 'clone', '--no-checkout', cached_repo, repo])
+            self.run_cmd(['git', 'remote', 'set-url', 'origin', src_repo], cwd=repo)
+            if branch is not None:
+                self.run_cmd(['git', 'checkout', '-f', '-B', branch, commit], cwd=repo)
+            else:
+                self.run_cmd(['git', 'checkout', '-f', '--detach', commit], cwd=repo)
+        elif self.git_cache:
             cached_repo = self.get_cached_repo(module)
 
-            if not os.path.isdir(cached_repo):
-                self.run_cmd(['git', 'clone', '--bare', src_repo, cached_repo])
+            if self.prefetcher is not None:
+                self.print("waiting for git fetch of {0}".format(src_repo), level=1)
+                self.prefetcher.git_fetch(self.repo_cache_dir, module, src_repo).wait()
             else:
-                self.run_cmd(['git', 'fetch', src_repo], cwd=cached_repo)
+                with GIT_CACHE_LOCKS_LOCK:
+                    lock = GIT_CACHE_LOCKS.setdefault(cached_repo, threading.Lock())
+                with lock:
+                    gitcache.fetch(cached_repo, src_repo, run_cmd=self.run_cmd)
 
             if branch is not None:
                 self.run_cmd(['git', 'clone', '--reference', cached_repo, '-b', branch, src_repo, repo])
@@ -195,10 +408,68 @@ class BaseFixture(object):
         else:
             self.run_cmd(['git', 'reset', '--hard'], cwd=repo)
         self.run_cmd(['git', 'clean', '-f', '-d', '-x'], cwd=repo)
+        self.git_revisions[module] = (src_repo, self.get_git_revision(module))
 
         # Do it in a way better for ccache
         self.run_python_script([setup_py, 'build'], cwd=repo)
-        self.run_pip(['install', '.'], cwd=repo)
+        self.run_pip(['install'] + self.get_pip_install_args() + ['.'], cwd=repo)
+
+    def install_git_revision(self, module, src_repo, revision, setup_py=None):
+        """
+        Reinstall a package previously installed from git, at another
+        revision.
+
+        The checkout is reused, keeping its build outputs, so that only
+        the changes between the revisions need to be rebuilt.
+        """
+        if setup_py is None:
+            setup_py = 'setup.py'
+
+        # Each rebuild has its own build time limit
+        self.build_start = time.time()
+
+        repo = self.get_repo(module)
+        self.run_cmd(['git', 'checkout', '-f', revision], cwd=repo)
+        self.run_cmd(['git', 'clean', '-f', '-d'], cwd=repo)
+        self.git_revisions[module] = (src_repo, self.get_git_revision(module))
+
+        self.run_python_script([setup_py, 'build'], cwd=repo)
+        self.run_pip(['install', '--force-reinstall', '--no-deps'] + self.get_pip_install_args() + ['.'], cwd=repo)
+
+    def get_git_revision(self, module, ref='HEAD'):
+        out = subprocess.check_output(['git', 'rev-parse', ref], cwd=self.get_repo(module))
+        return out.decode('ascii').strip()
+
+    def get_git_commits(self, module, good, bad):
+        """
+        Return the first-parent commits from `good` to `bad` (inclusive),
+        oldest first.
+        """
+        repo = self.get_repo(module)
+        if os.path.exists(os.path.join(repo, '.git', 'shallow')):
+            # Cloned without the git cache
+            self.run_cmd(['git', 'fetch', '--unshallow'], cwd=repo)
+
+        out = subprocess.check_output(['git', 'rev-list', '--first-parent', '--reverse',
+                                       '{0}..{1}'.format(good, bad)],
+                                      cwd=repo)
+        return [good] + out.decode('ascii').split()
+
+    def describe_git_commit(self, module, revision):
+        out = subprocess.check_output(['git', 'log', '-1', '--date=short',
+                                       '--format=%h %s (%an, %ad)', revision],
+                                      cwd=self.get_repo(module))
+        return self._decode(out).strip()
+
+    def wait_downloads(self, packages, binary_ok):
+        """
+        Wait until the prefetcher has downloaded the given packages.
+        """
+        if self.prefetcher is None:
+            return
+        python = self.get_download_python(self.python)
+        for spec in packages:
+            self.prefetcher.wait_download(python, spec, binary_ok)
 
     def get_repo(self, module):
         return os.path.join(self.code_dir, module)
@@ -265,40 +536,123 @@ sysconfig.get_python_inc = _xx_get_python_inc
         # Specifying a constant build directory is better for ccache.
         # Can't use wheels, because the Numpy against which packages
         # are compiled may vary.
+        self.wait_downloads(packages, binary_ok)
         if os.path.isdir(self.build_dir):
             shutil.rmtree(self.build_dir)
         os.makedirs(self.build_dir)
         try:
             if binary_ok:
-                self.run_pip(['install', '-b', self.build_dir] + packages)
+                self.run_pip(['install', '-b', self.build_dir] + self.get_pip_install_args() + packages)
             else:
                 self.run_pip(['install',
                               '--upgrade', '--upgrade-strategy', 'only-if-needed', '--force-reinstall',
-                              '--no-binary', ':all:', '-b', self.build_dir] + packages)
+                              '--no-binary', ':all:', '-b', self.build_dir] + self.get_pip_install_args() + packages)
         finally:
             if os.path.isdir(self.build_dir):
                 shutil.rmtree(self.build_dir)
 
-    def run_test_cmd(self, cmd, log):
+    def run_test_cmd(self, cmd, log, hook_env=None):
         cmd = ". bin/activate; " + cmd
         cmd = "bash -c {0}".format(shell_quote(cmd))
 
-        self.print("$ cd cache/env; " + cmd, level=1)
+        self.print("$ cd {0}; {1}".format(os.path.relpath(self.env_dir), cmd), level=1)
 
-        subprocess.call(cmd, stdout=log, stderr=log, shell=True,
-                        cwd=self.env_dir)
+        env = None
+        if hook_env:
+            env = self.add_hook_env(os.environ, hook_env)
+
+        return run_process(cmd, log, self.test_limits, check=False, shell=True,
+                           cwd=self.env_dir, env=env)
+
+
+class VenvFixture(VirtualenvFixture):
+    """
+    Fixture using the stdlib venv module.
+
+    Environment creation does not need the global virtualenv lock, and
+    each run of consecutive pip-installed packages with the same
+    binary setting is installed in a single batched pip call.
+    """
+    name = "venv"
+
+    def setup(self):
+        BaseFixture.setup(self)
+
+        if self._is_current_python():
+            import venv
+            self.print("creating venv {0} in-process".format(os.path.relpath(self.env_dir)), level=1)
+            builder = venv.EnvBuilder(with_pip=True, symlinks=True)
+            builder.create(self.env_dir)
+        else:
+            self.run_cmd([self.python, '-mvenv', self.env_dir])
+
+    def _is_current_python(self):
+        if sys.version_info < (3, 4):
+            return False
+        try:
+            from shutil import which
+        except ImportError:
+            return False
+        exe = which(self.python)
+        return exe is not None and os.path.realpath(exe) == os.path.realpath(sys.executable)
+
+    def install_spec(self, package_spec):
+        self.install_build_deps()
+
+        # Packages not binary-OK are built from source together with
+        # their dependencies (--no-binary :all:), so that e.g. they are
+        # compiled against the Numpy under test; only consecutive
+        # packages with the same setting can share a pip call
+        batch = []
+        binary_ok = True
+        for part in package_spec:
+            if part in ('--binary', '--no-binary'):
+                if (part == '--binary') != binary_ok:
+                    self._batch_install(batch, binary_ok)
+                    batch = []
+                binary_ok = (part == '--binary')
+            elif part.startswith('git+'):
+                self._batch_install(batch, binary_ok)
+                batch = []
+                module, url, branch = self._parse_git_url(part)
+                self.install_part(module, self._git_install, module, url, branch)
+            else:
+                batch.append(part)
+        self._batch_install(batch, binary_ok)
+
+    def _batch_install(self, packages, binary_ok):
+        if packages:
+            self.install_part(" ".join(packages), self._env_install, packages, binary_ok)
+
+    def _env_install(self, packages, binary_ok):
+        self.wait_downloads(packages, binary_ok)
+        cmd = ['install', '--upgrade', '--upgrade-strategy', 'only-if-needed']
+        if not binary_ok:
+            cmd += ['--force-reinstall', '--no-binary', ':all:']
+        self.run_pip(cmd + self.get_pip_install_args() + packages)
 
 
 class CondaFixture(BaseFixture):
     name = "conda"
 
+    def __init__(self, *a, **kw):
+        BaseFixture.__init__(self, *a, **kw)
+        self._build_env = None
+        self._activation_env = None
+
     def setup(self):
         BaseFixture.setup(self)
-        py_ver = 'python={0}'.format(self.python)
-        self.run_cmd(['conda', 'create', '-y', '-p', self.env_dir, py_ver, 'pip'])
+        if self.conda_pkgs_dir is not None and not os.path.isdir(self.conda_pkgs_dir):
+            os.makedirs(self.conda_pkgs_dir)
+        if self.conda_lock_dir is not None and not os.path.isdir(self.conda_lock_dir):
+            os.makedirs(self.conda_lock_dir)
 
     def install_spec(self, package_spec):
-        conda_spec = []
+        # All conda packages (including build dependencies) are installed
+        # at environment creation, in a single solve, so they come before
+        # the git+ and pip parts whatever their order in the specification
+        self.create_env(self.get_conda_specs(self.build_deps) + self.get_conda_specs(package_spec))
+
         binary_ok = True
         for part in package_spec:
             if part == '--binary':
@@ -306,24 +660,168 @@ class CondaFixture(BaseFixture):
             elif part == '--no-binary':
                 binary_ok = False
             elif part.startswith('git+'):
-                if conda_spec:
-                    self._env_install(conda_spec, True)
-                    conda_spec = []
                 module, url, branch = self._parse_git_url(part)
-                self._git_install(module, url, branch)
+                self.install_part(module, self._git_install, module, url, branch)
             elif part.startswith('pip+') or not binary_ok:
-                if conda_spec:
-                    self._env_install(conda_spec, True)
-                    conda_spec = []
                 if part.startswith('pip+'):
                     part = part[4:]
-                self.pip_install([part])
+                self.install_part(part, self.pip_install, [part])
+
+    @classmethod
+    def get_conda_specs(cls, package_spec):
+        """
+        Return the parts of the package specification installed via conda.
+        """
+        specs = []
+        binary_ok = True
+        for part in package_spec:
+            if part == '--binary':
+                binary_ok = True
+            elif part == '--no-binary':
+                binary_ok = False
+            elif part.startswith('git+') or part.startswith('pip+') or not binary_ok:
+                continue
             else:
-                conda_spec.append(part)
+                specs.append(part.replace('==', '='))
+        return specs
+
+    def create_env(self, packages):
+        """
+        Create the conda environment with the given packages.
+
+        The solved environment is stored as an explicit package list,
+        keyed by the specification, channels and platform, and later
+        environments with the same key are created from it without
+        running the solver, until the list is older than
+        `conda_lock_max_age` seconds.
+        """
+        specs = ['python={0}'.format(self.python), 'pip'] + list(packages)
+        create_cmd = ['conda', 'create', '-y', '-p', self.env_dir]
 
-        if conda_spec:
-            self._env_install(conda_spec, True)
-            conda_spec = []
+        if self.conda_lock_dir is None:
+            self.run_cmd(create_cmd + specs)
+            return
+
+        lock_fn = os.path.join(self.conda_lock_dir, self.get_lock_key(specs) + '.txt')
+
+        if os.path.isfile(lock_fn) and self.is_lock_expired(lock_fn):
+            self.print("{0} has expired; solving again".format(os.path.relpath(lock_fn)), level=1)
+        elif os.path.isfile(lock_fn) and not self.refresh_conda_lock:
+            self.print("creating conda environment from {0}".format(os.path.relpath(lock_fn)), level=1)
+            try:
+                self.run_cmd(create_cmd + ['--file', lock_fn])
+                return
+            except subprocess.CalledProcessError:
+                self.print("creating from explicit package list failed; solving again")
+                if os.path.isdir(self.env_dir):
+                    shutil.rmtree(self.env_dir)
+
+        self.run_cmd(create_cmd + specs)
+
+        # Store the solution
+        out = subprocess.check_output(['conda', 'list', '--explicit', '-p', self.env_dir],
+                                      env=self.get_conda_env())
+        tmp_fn = lock_fn + '.tmp.{0}'.format(os.getpid())
+        with open(tmp_fn, 'wb') as f:
+            f.write(out)
+        os.rename(tmp_fn, lock_fn)
+
+    def is_lock_expired(self, lock_fn):
+        if self.conda_lock_max_age is None:
+            return False
+        return time.time() - os.path.getmtime(lock_fn) > self.conda_lock_max_age
+
+    def get_lock_key(self, specs):
+        info = self.get_conda_info()
+        data = json.dumps({'specs': list(specs),
+                           'channels': info.get('channels', []),
+                           'platform': info.get('platform')},
+                          sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get_conda_info(self):
+        return get_conda_info(self.get_conda_env())
+
+    def get_conda_env(self):
+        env = dict(os.environ)
+        if self.conda_pkgs_dir is not None:
+            env['CONDA_PKGS_DIRS'] = self.conda_pkgs_dir
+        return env
+
+    def get_build_env(self):
+        """
+        Environment for build commands, computed once per fixture.
+        """
+        if self._build_env is None:
+            env = self.get_conda_env()
+
+            # Add environment variables to ensure correct BLAS etc. is linked
+            add_path(env, 'PATH', os.path.join(self.env_dir, 'bin'))
+            add_path(env, 'CPATH', os.path.join(self.env_dir, 'include'))
+            add_path(env, 'LIBRARY_PATH', os.path.join(self.env_dir, 'lib'))
+            add_path(env, 'LD_LIBRARY_PATH', os.path.join(self.env_dir, 'lib'))
+
+            self._build_env = env
+        return dict(self._build_env)
+
+    def get_activation_env(self):
+        """
+        Environment of the activated conda environment.
+
+        Activation is done once, after the environment is fully
+        installed (so that activate.d scripts of all packages are
+        included), and the resulting environment is reused for all test
+        commands.
+        """
+        if self._activation_env is None:
+            info = self.get_conda_info()
+            activate_script = os.path.join(info['sys.prefix'], 'bin', 'activate')
+            cmd = "source {0} {1} >/dev/null && env -0".format(
+                shell_quote(os.path.abspath(activate_script)),
+                shell_quote(self.env_dir))
+            self.print("$ bash -c {0}".format(shell_quote(cmd)), level=1)
+            try:
+                # The log may be compressed, without a file descriptor
+                p = subprocess.Popen(['bash', '-c', cmd], env=self.get_build_env(),
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                out, err = p.communicate()
+                self.log.write(err.decode('utf-8', 'replace'))
+                self.log.flush()
+                if p.returncode != 0:
+                    raise subprocess.CalledProcessError(p.returncode, cmd)
+                env = {}
+                for item in out.decode('utf-8', 'replace').split('\0'):
+                    if '=' in item:
+                        name, value = item.split('=', 1)
+                        env[name] = value
+            except (subprocess.CalledProcessError, OSError) as exc:
+                self.print("WARNING: conda activation failed ({0}); using build environment".format(exc))
+                env = self.get_build_env()
+            self._activation_env = env
+        return dict(self._activation_env)
+
+    @classmethod
+    def get_download_python(cls, python):
+        # The environment Python does not exist before setup; sdists do
+        # not depend on the interpreter, so the current one will do.
+        return sys.executable
+
+    @classmethod
+    def get_fetch_items(cls, package_spec):
+        items = []
+        binary_ok = True
+        for part in package_spec:
+            if part == '--binary':
+                binary_ok = True
+            elif part == '--no-binary':
+                binary_ok = False
+            elif part.startswith('git+'):
+                items.append(('git', cls._parse_git_url(part)))
+            elif part.startswith('pip+'):
+                items.append(('pip', (part[4:], False)))
+            elif not binary_ok:
+                items.append(('pip', (part, False)))
+        return items
 
     def _env_install(self, packages, binary_ok):
         assert binary_ok
@@ -332,53 +830,70 @@ class CondaFixture(BaseFixture):
 
     def run_cmd(self, cmd, cwd=None, env=None):
         if env is None:
-            env = dict(os.environ)
+            env = self.get_build_env()
         else:
             env = dict(env)
-
-        def add_path(name, value):
-            env[name] = os.pathsep.join([value] + env.get(name, '').split(os.pathsep))
-
-        # Add environment variables to ensure correct BLAS etc. is linked
-        add_path('PATH', os.path.join(self.env_dir, 'bin'))
-        add_path('CPATH', os.path.join(self.env_dir, 'include'))
-        add_path('LIBRARY_PATH', os.path.join(self.env_dir, 'lib'))
-        add_path('LD_LIBRARY_PATH', os.path.join(self.env_dir, 'lib'))
+            add_path(env, 'PATH', os.path.join(self.env_dir, 'bin'))
+            add_path(env, 'CPATH', os.path.join(self.env_dir, 'include'))
+            add_path(env, 'LIBRARY_PATH', os.path.join(self.env_dir, 'lib'))
+            add_path(env, 'LD_LIBRARY_PATH', os.path.join(self.env_dir, 'lib'))
 
         return BaseFixture.run_cmd(self, cmd, cwd=cwd, env=env)
 
     def pip_install(self, packages):
+        self.wait_downloads(packages, False)
         if os.path.isdir(self.build_dir):
             shutil.rmtree(self.build_dir)
         os.makedirs(self.build_dir)
         try:
             self.run_pip(['install',
                           '--upgrade', '--upgrade-strategy', 'only-if-needed', '--force-reinstall',
-                          '--no-binary', ':all:', '-b', self.build_dir] + packages)
+                          '--no-binary', ':all:', '-b', self.build_dir] + self.get_pip_install_args() + packages)
         finally:
             if os.path.isdir(self.build_dir):
                 shutil.rmtree(self.build_dir)
 
-    def run_test_cmd(self, cmd, log):
-        out = subprocess.check_output(['conda', 'info', '--json'])
-        info = json.loads(out)
-        activate_script = os.path.join(info['sys.prefix'], 'bin', 'activate')
+    def run_test_cmd(self, cmd, log, hook_env=None):
+        env = self.get_activation_env()
+        if hook_env:
+            env = self.add_hook_env(env, hook_env)
 
-        cmd = "source {0} {1} && {2}".format(
-            shell_quote(os.path.abspath(activate_script)),
-            shell_quote(self.env_dir),
-            cmd)
-        cmd = "bash -c {0}".format(shell_quote(cmd))
+        self.print("$ cd {0}; bash -c {1}".format(os.path.relpath(self.env_dir), shell_quote(cmd)), level=1)
+
+        return run_process(['bash', '-c', cmd], log, self.test_limits, check=False,
+                           cwd=self.env_dir, env=env)
 
-        self.print("$ cd cache/env; " + cmd, level=1)
 
-        subprocess.call(cmd, stdout=log, stderr=log, shell=True,
-                        cwd=self.env_dir)
+def get_conda_info(env=None):
+    """
+    Return the output of ``conda info --json``, run once per process
+    for each conda configuration: the conda found on PATH, and the
+    CONDA* environment variables (e.g. CONDA_PKGS_DIRS) of `env`.
+    """
+    if env is None:
+        env = os.environ
+    key = tuple(sorted((name, value) for name, value in env.items()
+                       if name == 'PATH' or name.startswith('CONDA')))
+    with CONDA_INFO_LOCK:
+        info = CONDA_INFO.get(key)
+        if info is None:
+            out = subprocess.check_output(['conda', 'info', '--json'], env=dict(env))
+            info = json.loads(out.decode('utf-8'))
+            CONDA_INFO[key] = info
+        return info
+
+
+def add_path(env, name, value):
+    """
+    Prepend `value` to a path-list variable in the `env` dictionary.
+    """
+    env[name] = os.pathsep.join([value] + [x for x in env.get(name, '').split(os.pathsep) if x])
 
 
 def get_fixture_cls(env):
     types = {
         'virtualenv': VirtualenvFixture,
+        'venv': VenvFixture,
         'conda': CondaFixture,
     }
     try:
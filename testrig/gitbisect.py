@@ -0,0 +1,119 @@
+"""
+Bisection of new failures over the commits of git+ packages.
+
+The known-good and bad commits of each new failure are taken from the
+history: the revisions of the git+ packages installed in 'new' in the
+last run where the test passed, and in the first run of its current
+streak of failures.  Failures with the same range are bisected together,
+and at each step only the tests whose range contains the commit built
+are run.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+
+class Bisection(object):
+    """
+    Binary search for the first bad commit of several tests at once.
+
+    Parameters
+    ----------
+    commits : list of str
+        Commits, oldest first.  The first one is known to be good and
+        the last one bad for all tests.
+    test_ids : list of str
+        Tests to bisect.
+
+    """
+
+    def __init__(self, commits, test_ids):
+        self.commits = commits
+        # commits[lo] is good and commits[hi] bad for each test
+        self.ranges = dict((test_id, (0, len(commits) - 1)) for test_id in test_ids)
+        self.undetermined = set()
+
+    def next_commit(self):
+        """
+        Index of the commit to test next, the midpoint of the widest
+        remaining range, or None if all ranges are narrowed down.
+        """
+        best = None
+        for lo, hi in sorted(set(self.ranges.values())):
+            if hi - lo > 1 and (best is None or hi - lo > best[1] - best[0]):
+                best = (lo, hi)
+        if best is None:
+            return None
+        return (best[0] + best[1]) // 2
+
+    def get_tests(self, index):
+        """
+        Tests whose outcome at commit `index` is not yet known.
+        """
+        return sorted(test_id for test_id, (lo, hi) in self.ranges.items()
+                      if lo < index < hi)
+
+    def update(self, index, outcomes):
+        """
+        Narrow down the ranges from test outcomes at commit `index`,
+        {test_id: True (failed), False (passed) or None (not run)}.
+        """
+        for test_id in self.get_tests(index):
+            failed = outcomes.get(test_id)
+            lo, hi = self.ranges[test_id]
+            if failed is None:
+                del self.ranges[test_id]
+                self.undetermined.add(test_id)
+            elif failed:
+                self.ranges[test_id] = (lo, index)
+            else:
+                self.ranges[test_id] = (index, hi)
+
+    def get_results(self):
+        """
+        First bad commits, as {commit: [test_ids]}.
+        """
+        results = {}
+        for test_id, (lo, hi) in sorted(self.ranges.items()):
+            results.setdefault(self.commits[hi], []).append(test_id)
+        return results
+
+
+def get_bisect_ranges(history, section, test_ids):
+    """
+    Group tests by the git+ package and the range of its commits
+    between their last passing and first failing run.
+
+    Returns
+    -------
+    ranges : dict
+        {(module, url, good_revision, bad_revision): [test_ids]}
+    notes : list of str
+        Messages about tests that cannot be bisected.
+
+    """
+    ranges = {}
+    notes = []
+
+    for test_id in test_ids:
+        first_fail, last_pass = history.get_first_failure(section, test_id)
+        if first_fail is None or last_pass is None:
+            notes.append("{0}: no recorded run where it passed".format(test_id))
+            continue
+
+        good = history.get_revisions(last_pass[0], section)
+        bad = history.get_revisions(first_fail[0], section)
+        changed = sorted(module for module in bad
+                         if module in good and good[module][1] != bad[module][1])
+        if not changed:
+            notes.append("{0}: no git+ package changed between runs {1} and {2}".format(
+                test_id, last_pass[0], first_fail[0]))
+            continue
+        if len(changed) > 1:
+            notes.append("{0}: several git+ packages changed ({1}), bisecting {2}".format(
+                test_id, ", ".join(changed), changed[0]))
+
+        module = changed[0]
+        key = (module, bad[module][0], good[module][1], bad[module][1])
+        ranges.setdefault(key, []).append(test_id)
+
+    return ranges, notes
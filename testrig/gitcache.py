@@ -0,0 +1,71 @@
+"""
+Bare git repositories caching the git sources of the fixtures.
+
+Different urls (e.g. forks) of a package share its cached repository.
+Besides updating the objects, each fetch keeps the branches and HEAD of
+the url under a namespace of its own, ``refs/testrig/<key>/``, so that
+``--offline`` runs can check out a branch of a url as last fetched.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import hashlib
+import subprocess
+
+
+def get_ref_prefix(url):
+    """
+    Namespace of the refs fetched from `url` in a cached repository.
+    """
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    return 'refs/testrig/{0}/'.format(key)
+
+
+def fetch(cached_repo, url, run_cmd=subprocess.check_call):
+    """
+    Clone or update the cached repository from `url`.
+
+    Raises
+    ------
+    subprocess.CalledProcessError, OSError
+        If the fetch fails.
+
+    """
+    if not os.path.isdir(cached_repo):
+        run_cmd(['git', 'clone', '--bare', url, cached_repo])
+
+    prefix = get_ref_prefix(url)
+    run_cmd(['git', 'fetch', url,
+             '+HEAD:{0}HEAD'.format(prefix),
+             '+refs/heads/*:{0}heads/*'.format(prefix)],
+            cwd=cached_repo)
+
+
+def resolve(cached_repo, url, branch=None):
+    """
+    Commit of a branch (or tag) of `url` in the cached repository, or of
+    its HEAD if `branch` is None, without accessing the network.
+
+    Returns
+    -------
+    commit : str or None
+        The commit, or None if it is not in the cache.
+
+    """
+    prefix = get_ref_prefix(url)
+    if branch is None:
+        candidates = [prefix + 'HEAD']
+    else:
+        candidates = [prefix + 'heads/' + branch, 'refs/tags/' + branch]
+
+    for ref in candidates:
+        try:
+            with open(os.devnull, 'wb') as devnull:
+                out = subprocess.check_output(['git', 'rev-parse', '--verify', '-q',
+                                               ref + '^{commit}'],
+                                              cwd=cached_repo, stderr=devnull)
+        except (subprocess.CalledProcessError, OSError):
+            continue
+        return out.decode('ascii').strip()
+    return None
@@ -0,0 +1,527 @@
+"""
+History database of testrig runs.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+import socket
+import sqlite3
+import datetime
+
+from ..parser import OUTCOMES
+from ..rerun import CLASSIFICATIONS
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    start_time REAL NOT NULL,
+    end_time REAL,
+    hostname TEXT,
+    config TEXT,
+    version TEXT
+);
+
+-- Section names and test ids, interned
+CREATE TABLE IF NOT EXISTS names (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS envs (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    info TEXT NOT NULL,
+    UNIQUE (fingerprint, info)
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    section_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    test_count INTEGER NOT NULL,
+    fail_new INTEGER NOT NULL,
+    fail_same INTEGER NOT NULL,
+    warn_new INTEGER NOT NULL,
+    warn_same INTEGER NOT NULL,
+    PRIMARY KEY (section_id, run_id)
+) WITHOUT ROWID;
+
+-- side: 0 = old, 1 = new
+CREATE TABLE IF NOT EXISTS sides (
+    section_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    side INTEGER NOT NULL,
+    env_id INTEGER,
+    status TEXT NOT NULL,
+    test_count INTEGER NOT NULL,
+    fail_count INTEGER NOT NULL,
+    PRIMARY KEY (section_id, run_id, side)
+) WITHOUT ROWID;
+
+-- Tests that did not pass, and passing tests slower than
+-- MIN_DURATION; duration in milliseconds
+CREATE TABLE IF NOT EXISTS outcomes (
+    section_id INTEGER NOT NULL,
+    test_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    side INTEGER NOT NULL,
+    outcome INTEGER NOT NULL,
+    duration INTEGER,
+    PRIMARY KEY (section_id, test_id, run_id, side)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS outcomes_run ON outcomes (run_id, section_id, side);
+
+-- Installed parts (packages) of the build phases
+CREATE TABLE IF NOT EXISTS parts (
+    section_id INTEGER NOT NULL,
+    side INTEGER NOT NULL,
+    part_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    hits INTEGER,
+    misses INTEGER,
+    PRIMARY KEY (section_id, side, part_id, run_id)
+) WITHOUT ROWID;
+
+-- Revisions of the packages installed from git
+CREATE TABLE IF NOT EXISTS revisions (
+    section_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    side INTEGER NOT NULL,
+    module_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    PRIMARY KEY (section_id, run_id, side, module_id)
+) WITHOUT ROWID;
+
+-- Classification of new failures, see rerun.py
+CREATE TABLE IF NOT EXISTS reruns (
+    section_id INTEGER NOT NULL,
+    test_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    classification INTEGER NOT NULL,
+    new_fail INTEGER NOT NULL,
+    new_pass INTEGER NOT NULL,
+    old_fail INTEGER NOT NULL,
+    old_pass INTEGER NOT NULL,
+    PRIMARY KEY (section_id, run_id, test_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS phases (
+    section_id INTEGER NOT NULL,
+    phase TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    PRIMARY KEY (section_id, phase, run_id)
+) WITHOUT ROWID;
+"""
+
+SIDES = ('old', 'new')
+
+# Passing tests faster than this (seconds) are not stored
+MIN_DURATION = 0.01
+
+
+class History(object):
+    """
+    SQLite database of testrig runs.
+
+    Stores for each run and section the environments (spec fingerprint
+    and installed versions), the per-test outcomes and durations, and
+    the durations of each phase.
+
+    Passing tests are stored only if they are slow (see `MIN_DURATION`):
+    a test without an entry in a run where its section ran passed, or
+    did not exist.
+
+    Parameters
+    ----------
+    filename : str
+        Database file name.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, timeout=60)
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _intern(self, name):
+        cur = self.conn.execute("SELECT id FROM names WHERE name = ?", (name,))
+        row = cur.fetchone()
+        if row is not None:
+            return row[0]
+        return self.conn.execute("INSERT INTO names (name) VALUES (?)", (name,)).lastrowid
+
+    def _lookup(self, name):
+        row = self.conn.execute("SELECT id FROM names WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def _get_env(self, fingerprint, spec, info):
+        row = self.conn.execute("SELECT id FROM envs WHERE fingerprint = ? AND info = ?",
+                                (fingerprint, info)).fetchone()
+        if row is not None:
+            return row[0]
+        return self.conn.execute("INSERT INTO envs (fingerprint, spec, info) VALUES (?, ?, ?)",
+                                 (fingerprint, spec, info)).lastrowid
+
+    def add_run(self, results, start_time, end_time=None, config=None):
+        """
+        Record a run.
+
+        Parameters
+        ----------
+        results : list of TestResult
+            Results of the sections run.
+        start_time, end_time : float
+            Time stamps of the run.
+        config : str, optional
+            Configuration file name.
+
+        Returns
+        -------
+        run_id : int
+
+        """
+        from .. import __version__
+
+        if end_time is None:
+            end_time = time.time()
+
+        with self.conn:
+            run_id = self.conn.execute(
+                "INSERT INTO runs (start_time, end_time, hostname, config, version) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (start_time, end_time, socket.gethostname(), config, __version__)).lastrowid
+
+            for result in results:
+                section_id = self._intern(result.name)
+
+                self.conn.execute(
+                    "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (section_id, run_id, result.test_count, result.fail_new_count,
+                     result.fail_same_count, result.warn_new_count, result.warn_same_count))
+
+                for phase, duration in result.timings.items():
+                    self.conn.execute("INSERT INTO phases VALUES (?, ?, ?, ?)",
+                                      (section_id, phase, run_id, duration))
+
+                for test_id, (classification, counts) in result.reruns.items():
+                    self.conn.execute(
+                        "INSERT INTO reruns VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (section_id, self._intern(test_id), run_id,
+                         CLASSIFICATIONS.index(classification),
+                         counts.get(('new', 'fail'), 0), counts.get(('new', 'pass'), 0),
+                         counts.get(('old', 'fail'), 0), counts.get(('old', 'pass'), 0)))
+
+                for side_num, side in enumerate(SIDES):
+                    info = result.sides.get(side)
+                    if info is None:
+                        continue
+                    self._add_side(run_id, section_id, side_num, info)
+
+        return run_id
+
+    def _add_side(self, run_id, section_id, side_num, info):
+        if info.get('info') is not None:
+            env_id = self._get_env(info['fingerprint'], info['spec'], info['info'])
+        else:
+            env_id = None
+
+        cases = info.get('cases', {})
+        fail_count = sum(1 for outcome, duration in cases.values()
+                         if outcome in ('failed', 'error'))
+        self.conn.execute("INSERT INTO sides VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (section_id, run_id, side_num, env_id, info['status'],
+                           info.get('test_count', -1), fail_count))
+
+        rows = []
+        for test_id, (outcome, duration) in cases.items():
+            if outcome == 'passed' and (duration is None or duration < MIN_DURATION):
+                continue
+            if duration is not None:
+                duration = int(round(1000 * duration))
+            rows.append((section_id, self._intern(test_id), run_id, side_num,
+                         OUTCOMES.index(outcome), duration))
+        self.conn.executemany("INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+        rows = [(section_id, run_id, side_num, self._intern(module), url, revision)
+                for module, (url, revision) in info.get('revisions', {}).items()]
+        self.conn.executemany("INSERT OR REPLACE INTO revisions VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+        rows = [(section_id, side_num, self._intern(label), run_id, duration, hits, misses)
+                for label, duration, hits, misses in info.get('parts', [])]
+        self.conn.executemany("INSERT OR REPLACE INTO parts VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def get_runs(self, limit=20):
+        """
+        Return the latest runs, as a list of
+        (run_id, start_time, end_time, hostname, num_sections, num_failed).
+        """
+        cur = self.conn.execute(
+            "SELECT r.id, r.start_time, r.end_time, r.hostname, COUNT(s.section_id), "
+            "       SUM(s.fail_new != 0 OR s.test_count <= 0) "
+            "FROM runs r LEFT JOIN results s ON s.run_id = r.id "
+            "GROUP BY r.id ORDER BY r.id DESC LIMIT ?", (limit,))
+        return cur.fetchall()
+
+    def get_run(self, run_id):
+        """
+        Return the section results of a run, as a list of
+        (section, test_count, fail_new, fail_same, warn_new, warn_same).
+        """
+        cur = self.conn.execute(
+            "SELECT n.name, s.test_count, s.fail_new, s.fail_same, s.warn_new, s.warn_same "
+            "FROM results s JOIN names n ON n.id = s.section_id "
+            "WHERE s.run_id = ? ORDER BY n.name", (run_id,))
+        return cur.fetchall()
+
+    def get_envs(self, run_id, section):
+        """
+        Return {side: (spec, info)} of a section in a run.
+        """
+        section_id = self._lookup(section)
+        cur = self.conn.execute(
+            "SELECT s.side, e.spec, e.info FROM sides s JOIN envs e ON e.id = s.env_id "
+            "WHERE s.section_id = ? AND s.run_id = ?", (section_id, run_id))
+        return dict((SIDES[side], (spec, info)) for side, spec, info in cur)
+
+    def get_new_failures(self, run_id, section):
+        """
+        Return the test ids failing in 'new' but not in 'old' in a run.
+        """
+        section_id = self._lookup(section)
+        cur = self.conn.execute(
+            "SELECT n.name FROM outcomes o JOIN names n ON n.id = o.test_id "
+            "WHERE o.run_id = ? AND o.section_id = ? AND o.side = 1 AND o.outcome IN (1, 2) "
+            "AND NOT EXISTS (SELECT 1 FROM outcomes p WHERE p.run_id = o.run_id "
+            "    AND p.section_id = o.section_id AND p.side = 0 AND p.test_id = o.test_id "
+            "    AND p.outcome IN (1, 2)) "
+            "ORDER BY n.name", (run_id, section_id))
+        return [row[0] for row in cur]
+
+    def get_latest_run(self, section):
+        """
+        Return the id of the latest run of a section, or None.
+        """
+        section_id = self._lookup(section)
+        row = self.conn.execute("SELECT MAX(run_id) FROM results WHERE section_id = ?",
+                                (section_id,)).fetchone()
+        return row[0]
+
+    def get_revisions(self, run_id, section, side='new'):
+        """
+        Return the revisions of the git+ packages of a section in a run,
+        as {module: (url, revision)}.
+        """
+        section_id = self._lookup(section)
+        cur = self.conn.execute(
+            "SELECT n.name, v.url, v.revision FROM revisions v JOIN names n ON n.id = v.module_id "
+            "WHERE v.section_id = ? AND v.run_id = ? AND v.side = ?",
+            (section_id, run_id, SIDES.index(side)))
+        return dict((module, (url, revision)) for module, url, revision in cur)
+
+    def get_reruns(self, run_id, section):
+        """
+        Return the classifications of the new failures of a section in a
+        run, as {test_id: classification}.
+        """
+        section_id = self._lookup(section)
+        cur = self.conn.execute(
+            "SELECT n.name, f.classification FROM reruns f JOIN names n ON n.id = f.test_id "
+            "WHERE f.run_id = ? AND f.section_id = ?", (run_id, section_id))
+        return dict((name, CLASSIFICATIONS[c]) for name, c in cur)
+
+    def get_test_history(self, section, test_id, side='new', limit=None):
+        """
+        Return the outcomes of a test in the runs where its section ran,
+        latest first, as a list of (run_id, start_time, outcome, duration).
+
+        The outcome is None if the environment failed to build.
+        """
+        section_id = self._lookup(section)
+        test_num = self._lookup(test_id)
+        if section_id is None:
+            return []
+        sql = ("SELECT r.id, r.start_time, s.status, o.outcome, o.duration "
+               "FROM sides s JOIN runs r ON r.id = s.run_id "
+               "LEFT JOIN outcomes o ON o.section_id = s.section_id AND o.run_id = s.run_id "
+               "    AND o.side = s.side AND o.test_id = ? "
+               "WHERE s.section_id = ? AND s.side = ? ORDER BY r.id DESC")
+        args = (test_num, section_id, SIDES.index(side))
+        if limit is not None:
+            sql += " LIMIT ?"
+            args += (limit,)
+
+        items = []
+        for run_id, start_time, status, outcome, duration in self.conn.execute(sql, args):
+            if status != 'ok':
+                outcome = None
+            elif outcome is None:
+                outcome = 'passed'
+            else:
+                outcome = OUTCOMES[outcome]
+            if duration is not None:
+                duration /= 1000.0
+            items.append((run_id, start_time, outcome, duration))
+        return items
+
+    def get_first_failure(self, section, test_id, side='new'):
+        """
+        Find when a test started failing.
+
+        Returns
+        -------
+        first_fail : (run_id, start_time) or None
+            First run of the current streak of failures, or None if the
+            test is not failing in the latest run.
+        last_pass : (run_id, start_time) or None
+            Latest run where the test passed.
+
+        """
+        first_fail = None
+        for run_id, start_time, outcome, duration in self.get_test_history(section, test_id, side):
+            if outcome is None:
+                # build failure: no information
+                continue
+            if outcome in ('failed', 'error'):
+                first_fail = (run_id, start_time)
+            else:
+                return first_fail, (run_id, start_time)
+        return first_fail, None
+
+    def get_phase_history(self, section, limit=20):
+        """
+        Return the phase durations of a section in its latest runs,
+        as a list of (run_id, start_time, {phase: seconds}), latest first.
+        """
+        section_id = self._lookup(section)
+        cur = self.conn.execute(
+            "SELECT r.id, r.start_time, p.phase, p.duration "
+            "FROM phases p JOIN runs r ON r.id = p.run_id "
+            "WHERE p.section_id = ? AND p.run_id IN "
+            "    (SELECT run_id FROM results WHERE section_id = ? ORDER BY run_id DESC LIMIT ?) "
+            "ORDER BY r.id DESC", (section_id, section_id, limit))
+        items = []
+        for run_id, start_time, phase, duration in cur:
+            if not items or items[-1][0] != run_id:
+                items.append((run_id, start_time, {}))
+            items[-1][2][phase] = duration
+        return items
+
+    def get_expected_durations(self, sections, num_runs=5):
+        """
+        Expected phase durations of sections, the median over their
+        latest runs, as {section: {phase: seconds}}.
+        """
+        expected = {}
+        for section in sections:
+            phases = {}
+            for run_id, start_time, durations in self.get_phase_history(section, num_runs):
+                for phase, duration in durations.items():
+                    phases.setdefault(phase, []).append(duration)
+            if phases:
+                expected[section] = dict((phase, median(values))
+                                         for phase, values in phases.items())
+        return expected
+
+    def get_flaky_tests(self, sections, num_runs=20):
+        """
+        Tests found flaky on rerun in the latest runs of sections, as
+        {section: set of test ids}.
+
+        Tests that were skipped from reruns as already known flaky
+        count as well, so that a test stays in the set for as long as
+        it keeps failing intermittently.
+        """
+        flaky = {}
+        for section in sections:
+            section_id = self._lookup(section)
+            if section_id is None:
+                continue
+            cur = self.conn.execute(
+                "SELECT DISTINCT n.name FROM reruns f JOIN names n ON n.id = f.test_id "
+                "WHERE f.section_id = ? AND f.classification IN (?, ?) AND f.run_id IN "
+                "    (SELECT run_id FROM results WHERE section_id = ? ORDER BY run_id DESC LIMIT ?)",
+                (section_id, CLASSIFICATIONS.index('flaky'),
+                 CLASSIFICATIONS.index('known-flaky'), section_id, num_runs))
+            tests = set(row[0] for row in cur)
+            if tests:
+                flaky[section] = tests
+        return flaky
+
+    def get_test_durations(self, section, side='new', num_runs=5):
+        """
+        Durations of the tests of a section, the median over its latest
+        runs, as {test_id: seconds}.  Only tests with recorded durations
+        are included, see MIN_DURATION.
+        """
+        section_id = self._lookup(section)
+        if section_id is None:
+            return {}
+        cur = self.conn.execute(
+            "SELECT n.name, o.duration FROM outcomes o JOIN names n ON n.id = o.test_id "
+            "WHERE o.section_id = ? AND o.side = ? AND o.duration IS NOT NULL AND o.run_id IN "
+            "    (SELECT run_id FROM results WHERE section_id = ? ORDER BY run_id DESC LIMIT ?)",
+            (section_id, SIDES.index(side), section_id, num_runs))
+        durations = {}
+        for test_id, duration in cur:
+            durations.setdefault(test_id, []).append(duration / 1000.0)
+        return dict((test_id, median(values)) for test_id, values in durations.items())
+
+    def get_part_durations(self, sections, num_runs=5):
+        """
+        Expected durations of the installed parts of sections, the median
+        over their latest runs, as {section: {side: {label: seconds}}}.
+        """
+        expected = {}
+        for section in sections:
+            section_id = self._lookup(section)
+            if section_id is None:
+                continue
+            cur = self.conn.execute(
+                "SELECT p.side, n.name, p.duration FROM parts p JOIN names n ON n.id = p.part_id "
+                "WHERE p.section_id = ? AND p.run_id IN "
+                "    (SELECT run_id FROM results WHERE section_id = ? ORDER BY run_id DESC LIMIT ?)",
+                (section_id, section_id, num_runs))
+            values = {}
+            for side, label, duration in cur:
+                values.setdefault(SIDES[side], {}).setdefault(label, []).append(duration)
+            expected[section] = dict(
+                (side, dict((label, median(d)) for label, d in labels.items()))
+                for side, labels in values.items())
+        return expected
+
+    def get_cached_part_durations(self):
+        """
+        Durations of installed parts when (mostly) served from the
+        caches: the shortest recorded duration of each part, as
+        {label: seconds}.
+        """
+        cur = self.conn.execute(
+            "SELECT n.name, MIN(p.duration) FROM parts p JOIN names n ON n.id = p.part_id "
+            "GROUP BY p.part_id")
+        return dict(cur.fetchall())
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n//2]
+    return (values[n//2 - 1] + values[n//2]) / 2
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    return str(datetime.timedelta(seconds=int(round(seconds))))
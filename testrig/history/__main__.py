@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+testrig-history [OPTIONS] COMMAND ...
+
+Query the history of testrig runs.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import argparse
+import datetime
+
+from testrig.history import History, format_duration, median
+
+
+def main():
+    p = argparse.ArgumentParser(usage=__doc__.lstrip())
+    p.add_argument('--cache', action="store", dest="cache_dir", default='cache',
+                   help="testrig cache directory (default: ./cache)")
+    p.add_argument('--db', action="store", dest="db", default=None,
+                   help="history database file (default: CACHE/history.sqlite)")
+    sp = p.add_subparsers(dest="command", metavar="COMMAND")
+    sp.required = True
+
+    c = sp.add_parser('runs', help="list the latest runs")
+    c.add_argument('-n', type=int, default=20, dest="limit", help="number of runs")
+
+    c = sp.add_parser('show', help="show the results of a run")
+    c.add_argument('run_id', type=int, metavar='RUN')
+    c.add_argument('sections', nargs='*', metavar='SECTION')
+
+    c = sp.add_parser('test', help="outcomes of a test over runs, and when it started failing")
+    c.add_argument('section', metavar='SECTION')
+    c.add_argument('test_id', metavar='TEST_ID')
+    c.add_argument('-n', type=int, default=20, dest="limit", help="number of runs")
+    c.add_argument('--old', action="store_const", dest="side", const='old', default='new',
+                   help="history in the 'old' environment")
+
+    c = sp.add_parser('phases', help="trend of the phase durations of a section")
+    c.add_argument('section', metavar='SECTION')
+    c.add_argument('-n', type=int, default=20, dest="limit", help="number of runs")
+
+    args = p.parse_args()
+
+    db = args.db
+    if db is None:
+        db = os.path.join(args.cache_dir, 'history.sqlite')
+    if not os.path.isfile(db):
+        p.error("history database {0} not found".format(db))
+
+    history = History(db)
+    try:
+        if args.command == 'runs':
+            cmd_runs(history, args.limit)
+        elif args.command == 'show':
+            cmd_show(history, args.run_id, args.sections)
+        elif args.command == 'test':
+            cmd_test(history, args.section, args.test_id, args.side, args.limit)
+        elif args.command == 'phases':
+            cmd_phases(history, args.section, args.limit)
+    finally:
+        history.close()
+
+    sys.exit(0)
+
+
+def phase_sort_key(phase):
+    stages = ['setup', 'build', 'test', 'parse']
+    stage, _, side = phase.partition('-')
+    return (side != 'old', stages.index(stage) if stage in stages else len(stages), phase)
+
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
+
+
+def cmd_runs(history, limit):
+    for run_id, start_time, end_time, hostname, num_sections, num_failed in history.get_runs(limit):
+        duration = None if end_time is None else end_time - start_time
+        print("{0:6d}  {1}  {2:>9}  {3}  {4} sections, {5} failed".format(
+            run_id, format_time(start_time), format_duration(duration), hostname,
+            num_sections, num_failed or 0))
+
+
+def cmd_show(history, run_id, sections):
+    for name, test_count, fail_new, fail_same, warn_new, warn_same in history.get_run(run_id):
+        if sections and name not in sections:
+            continue
+        if fail_new < 0 or test_count < 0:
+            print("- {0}: ERROR".format(name))
+        else:
+            print("- {0}: {1} (ran {2} tests, {3} new failures, {4} pre-existing failures, "
+                  "{5} warnings, {6} pre-existing warnings)".format(
+                      name, "OK" if fail_new == 0 and test_count > 0 else "FAIL",
+                      test_count, fail_new, fail_same, warn_new, warn_same))
+        for side, (spec, info) in sorted(history.get_envs(run_id, name).items()):
+            print("    {0}: {1}".format(side, info))
+        reruns = history.get_reruns(run_id, name)
+        for test_id in history.get_new_failures(run_id, name):
+            if test_id in reruns:
+                print("    new failure: {0} ({1})".format(test_id, reruns[test_id]))
+            else:
+                print("    new failure: {0}".format(test_id))
+
+
+def cmd_test(history, section, test_id, side, limit):
+    items = history.get_test_history(section, test_id, side, limit)
+    if not items:
+        print("No runs of section {0}".format(section))
+        return
+
+    for run_id, start_time, outcome, duration in items:
+        print("{0:6d}  {1}  {2:<8}  {3}".format(
+            run_id, format_time(start_time), outcome or 'no build',
+            '' if duration is None else '{0:.3f} s'.format(duration)))
+
+    first_fail, last_pass = history.get_first_failure(section, test_id, side)
+    print("")
+    if first_fail is not None:
+        print("Failing since run {0} ({1})".format(first_fail[0], format_time(first_fail[1])))
+    else:
+        print("Not failing in the latest run")
+    if last_pass is not None:
+        print("Last passed in run {0} ({1})".format(last_pass[0], format_time(last_pass[1])))
+
+
+def cmd_phases(history, section, limit):
+    items = history.get_phase_history(section, limit)
+    if not items:
+        print("No runs of section {0}".format(section))
+        return
+
+    phases = sorted(set(phase for _, _, d in items for phase in d), key=phase_sort_key)
+
+    print("{0:>6}  {1:16}  {2}".format("run", "date", "  ".join("{0:>10}".format(phase) for phase in phases)))
+    for run_id, start_time, durations in items:
+        print("{0:6d}  {1}  {2}".format(
+            run_id, format_time(start_time),
+            "  ".join("{0:>10}".format(format_duration(durations.get(phase))) for phase in phases)))
+
+    # Trend: median of the latest half of the runs vs. the older half
+    if len(items) >= 4:
+        print("")
+        half = len(items) // 2
+        for phase in phases:
+            recent = [d[phase] for _, _, d in items[:half] if phase in d]
+            older = [d[phase] for _, _, d in items[half:] if phase in d]
+            if not recent or not older or median(older) <= 0:
+                continue
+            change = 100.0 * (median(recent) / median(older) - 1)
+            print("{0}: {1} -> {2} ({3:+.0f}%)".format(
+                phase, format_duration(median(older)), format_duration(median(recent)), change))
+
+
+if __name__ == "__main__":
+    main()
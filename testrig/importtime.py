@@ -0,0 +1,116 @@
+"""
+Import times of the packages under test.
+
+The packages are imported in a fresh interpreter with ``python -X
+importtime`` (Python >= 3.7) several times, after one warm-up import
+that compiles the ``.pyc`` files.  The cumulative import time of each
+module in each run is a sample, and the samples of 'old' and 'new' are
+compared as benchmark timings.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import re
+
+try:
+    from shlex import quote as shell_quote
+except ImportError:
+    from pipes import quote as shell_quote
+
+from .bench import compare_timings, median
+
+
+# Separates the output of the runs in the log
+RUN_MARKER = "testrig: import run"
+
+# Number of slower modules reported for each regression
+MAX_MODULES = 10
+
+
+def get_import_cmd(modules):
+    """
+    Shell command importing the modules with -X importtime.
+    """
+    code = "; ".join("import {0}".format(module) for module in modules)
+    return "python -X importtime -c {0}".format(shell_quote(code))
+
+
+def parse_importtime(text):
+    """
+    Parse the -X importtime output of one run.
+
+    Returns
+    -------
+    times : dict
+        Cumulative import times in seconds, {module: seconds}.
+
+    """
+    times = {}
+    for line in text.splitlines():
+        m = re.match(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|\s*(\S.*)$', line)
+        if m:
+            module = m.group(3).strip()
+            times[module] = times.get(module, 0) + int(m.group(2)) / 1e6
+    return times
+
+
+def parse_import_runs(text):
+    """
+    Parse the output of several runs, separated by RUN_MARKER lines.
+    The output before the first marker (the warm-up run) is skipped.
+
+    Returns
+    -------
+    samples : dict
+        Cumulative import times of each run, {module: [seconds, ...]}.
+
+    """
+    samples = {}
+    chunks = re.split(r'^' + re.escape(RUN_MARKER) + r'.*$', text, flags=re.M)
+    for chunk in chunks[1:]:
+        for module, seconds in parse_importtime(chunk).items():
+            samples.setdefault(module, []).append(seconds)
+    return samples
+
+
+def compare_import_times(modules, old, new, factor=1.1):
+    """
+    Find import time regressions of the given packages.
+
+    Parameters
+    ----------
+    modules : list of str
+        Packages imported.
+    old, new : dict
+        Samples, {module: [seconds, ...]}.
+    factor : float, optional
+        Smallest ratio of the medians reported.
+
+    Returns
+    -------
+    regressions : list of (module, ratio, old_stats, new_stats, offenders)
+        The packages significantly slower to import in 'new', with the
+        (median, low, high) of their cumulative times.  `offenders` are
+        the modules significantly slower or only imported in 'new', as
+        (module, old median or None, new median), largest increase
+        first.
+
+    """
+    changes = compare_timings(old, new, factor=factor)
+    slower = dict((name, (old_stats, new_stats)) for name, ratio, old_stats, new_stats, change
+                  in changes if change == 'slower')
+
+    regressions = []
+    for name, ratio, old_stats, new_stats, change in changes:
+        if name not in modules or change != 'slower':
+            continue
+
+        offenders = [(module, old_stats_[0], new_stats_[0])
+                     for module, (old_stats_, new_stats_) in slower.items()
+                     if module not in modules]
+        offenders += [(module, None, median(new[module]))
+                      for module in set(new) - set(old) if new[module]]
+        offenders.sort(key=lambda item: -(item[2] - (item[1] or 0)))
+        regressions.append((name, ratio, old_stats, new_stats, offenders[:MAX_MODULES]))
+
+    return regressions
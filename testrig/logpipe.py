@@ -0,0 +1,267 @@
+"""
+Writing of the main log and the stage logs.
+
+Messages for the console and the main log (``testrig.log``) go through
+a queue to a single writer thread, which writes all messages waiting
+in the queue at once and flushes the streams once per batch, so that
+jobs printing messages do not wait for the terminal or the disk.
+
+Stage logs (builds, test runs, ...) can be compressed with gzip as
+they are written.  The compressed stream is sync-flushed periodically,
+so that what has been written so far can be decompressed, e.g. by the
+progress monitor following the log.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import zlib
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+# Suffix of compressed stage logs
+COMPRESSED_SUFFIX = '.gz'
+
+# Compression level of the stage logs
+COMPRESS_LEVEL = 6
+
+# Number of old main logs kept by default
+KEEP_LOGS = 5
+
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def text_open(filename, mode):
+    if sys.version_info[0] >= 3:
+        return open(filename, mode, encoding='utf-8', errors='replace')
+    else:
+        return open(filename, mode)
+
+
+class LogPipeline(object):
+    """
+    Asynchronous writer of messages to several streams.
+
+    Parameters
+    ----------
+    streams : list of file
+        Streams receiving all messages, e.g. stdout and the main log.
+
+    """
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, text):
+        """
+        Queue text for writing.
+        """
+        if self.thread is None:
+            self._write([text])
+        else:
+            self.queue.put(text)
+
+    def stop(self):
+        """
+        Write the queued messages, and stop the writer thread.
+        """
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+            if batch:
+                self._write(batch)
+            if done:
+                break
+
+    def _write(self, batch):
+        text = "".join(batch)
+        for stream in self.streams:
+            try:
+                stream.write(text)
+                stream.flush()
+            except (IOError, OSError, ValueError):
+                # e.g. closed pipe; the other streams still get it
+                pass
+
+
+def rotate_logs(filename, keep=KEEP_LOGS):
+    """
+    Rename an existing log to filename.1, and older ones to .2, .3,
+    ..., keeping at most `keep` of them.
+    """
+    if not os.path.exists(filename):
+        return
+
+    if keep <= 0:
+        os.unlink(filename)
+        return
+
+    oldest = "{0}.{1}".format(filename, keep)
+    if os.path.exists(oldest):
+        os.unlink(oldest)
+    for j in range(keep - 1, 0, -1):
+        old_fn = "{0}.{1}".format(filename, j)
+        if os.path.exists(old_fn):
+            os.rename(old_fn, "{0}.{1}".format(filename, j + 1))
+    os.rename(filename, filename + ".1")
+
+
+class CompressedLog(object):
+    """
+    Text log file compressed with gzip as it is written.
+
+    `flush` ends the compressed data written so far with a sync flush,
+    after which it can be decompressed up to that point.  Appending
+    adds a new gzip member to the file.
+
+    Attributes
+    ----------
+    name : str
+        File name.
+    bytes_written : int
+        Amount of uncompressed output written.
+
+    """
+
+    mode = 'w'
+
+    def __init__(self, filename, mode='w', level=COMPRESS_LEVEL):
+        self.name = filename
+        self._file = open(filename, mode[0] + 'b')
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+        self._lock = threading.Lock()
+        self._pending = False
+        self.bytes_written = 0
+        self.closed = False
+
+    def write(self, text):
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8', 'replace')
+        self.write_bytes(text)
+
+    def write_bytes(self, data):
+        with self._lock:
+            if self.closed:
+                raise ValueError("I/O operation on closed log")
+            self._file.write(self._compressor.compress(data))
+            self.bytes_written += len(data)
+            self._pending = True
+
+    def flush(self):
+        with self._lock:
+            if self.closed:
+                return
+            if self._pending:
+                self._file.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+                self._pending = False
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self._file.write(self._compressor.flush())
+            self._file.close()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Decompressor(object):
+    """
+    Incremental decompressor of gzip data, which may be incomplete or
+    consist of several members.
+    """
+
+    def __init__(self):
+        self._obj = zlib.decompressobj(_GZIP_WBITS)
+
+    def feed(self, data):
+        """
+        Decompress more data, and return the output available so far.
+        """
+        out = []
+        while data:
+            out.append(self._obj.decompress(data))
+            data = self._obj.unused_data
+            if data:
+                # Next member
+                self._obj = zlib.decompressobj(_GZIP_WBITS)
+        return b"".join(out)
+
+
+def get_log_path(filename, compress=False):
+    """
+    Name of the file of a stage log.
+    """
+    if compress:
+        return filename + COMPRESSED_SUFFIX
+    return filename
+
+
+def open_log(filename, mode, compress=False):
+    """
+    Open a stage log for writing ('w') or appending ('a'), compressed
+    to filename.gz if `compress`.  When overwriting, a log with the
+    other compression from an earlier run is removed.
+    """
+    path = get_log_path(filename, compress)
+    if mode.startswith('w'):
+        other = get_log_path(filename, not compress)
+        if os.path.exists(other):
+            os.unlink(other)
+    if compress:
+        return CompressedLog(path, mode)
+    return text_open(path, mode)
+
+
+def read_log(filename):
+    """
+    Read a log written by open_log, compressed or not.
+    """
+    if not filename.endswith(COMPRESSED_SUFFIX):
+        with text_open(filename, 'r') as f:
+            return f.read()
+
+    with open(filename, 'rb') as f:
+        data = f.read()
+    try:
+        data = Decompressor().feed(data)
+    except zlib.error:
+        # Corrupt, e.g. the run was killed while writing
+        data = b""
+    return data.decode('utf-8', 'replace')
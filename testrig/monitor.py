@@ -0,0 +1,368 @@
+"""
+Progress monitor following the build and test logs of all running jobs.
+
+A single monitor thread serves the whole run.  It follows the active
+log files with inotify (on Linux), falling back to periodic seek-based
+tail reads, counts output bytes and test results incrementally, and
+prints status lines with elapsed times and ETAs from the durations of
+previous runs.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import re
+import sys
+import zlib
+import time
+import errno
+import select
+import struct
+import datetime
+import threading
+
+from .logpipe import COMPRESSED_SUFFIX, Decompressor
+
+
+PHASES = ['setup-old', 'build-old', 'test-old', 'setup-new', 'build-new', 'test-new']
+
+TEST_RESULT_RES = [
+    # pytest -v
+    (re.compile(r' (PASSED|FAILED|ERROR|SKIPPED|XFAIL|XPASS)\b'), ('FAILED', 'ERROR')),
+    # nose / unittest -v
+    (re.compile(r' \.\.\. (ok|FAIL|ERROR|SKIP|expected failure|unexpected success)\b'), ('FAIL', 'ERROR')),
+]
+PYTEST_PROGRESS_RE = re.compile(r'^\S+\.py ([.FEsxX]+)(?:\s+\[\s*\d+%\])?\s*$')
+
+
+class LogFollower(object):
+    """
+    Incremental reader of a growing log file, decompressing .gz logs.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.offset = 0
+        self.partial = b''
+        self.size = 0
+        self.decompressor = None
+        if filename.endswith(COMPRESSED_SUFFIX):
+            self.decompressor = Decompressor()
+        self.test_count = 0
+        self.fail_count = 0
+
+    def read(self, chunk_size=1 << 20):
+        """
+        Read new data from the file, and update the counters.
+
+        Returns
+        -------
+        changed : bool
+            Whether there was new output.
+
+        """
+        try:
+            f = open(self.filename, 'rb')
+        except (IOError, OSError):
+            return False
+
+        changed = False
+        with f:
+            f.seek(self.offset)
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                changed = True
+                self.offset += len(data)
+                if self.decompressor is not None:
+                    try:
+                        data = self.decompressor.feed(data)
+                    except zlib.error:
+                        # Corrupt, e.g. truncated by a new run: skip to the end
+                        self.decompressor = Decompressor()
+                        self.offset = os.fstat(f.fileno()).st_size
+                        break
+                self.size += len(data)
+                self._feed(data)
+        return changed
+
+    def _feed(self, data):
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.parse_line(line.decode('utf-8', 'replace'))
+
+    def parse_line(self, line):
+        for regex, failed in TEST_RESULT_RES:
+            m = regex.search(line)
+            if m:
+                self.test_count += 1
+                if m.group(1) in failed:
+                    self.fail_count += 1
+                return
+
+        m = PYTEST_PROGRESS_RE.match(line)
+        if m:
+            status = m.group(1)
+            self.test_count += len(status)
+            self.fail_count += status.count('F') + status.count('E')
+
+
+class Inotify(object):
+    """
+    Minimal ctypes wrapper for Linux inotify.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+
+    _event = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._paths = {}
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, path.encode(sys.getfilesystemencoding()),
+                                          self.IN_MODIFY | self.IN_CLOSE_WRITE)
+        if wd < 0:
+            return None
+        self._paths[wd] = path
+        return wd
+
+    def rm_watch(self, wd):
+        self._paths.pop(wd, None)
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        """
+        Wait for events, and return the set of modified paths.
+        """
+        try:
+            r, _, _ = select.select([self.fd], [], [], timeout)
+        except (OSError, select.error) as exc:
+            if exc.args[0] == errno.EINTR:
+                return set()
+            raise
+        if not r:
+            return set()
+
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as exc:
+            if exc.errno == errno.EAGAIN:
+                return set()
+            raise
+
+        paths = set()
+        pos = 0
+        while pos + self._event.size <= len(data):
+            wd, mask, cookie, name_len = self._event.unpack_from(data, pos)
+            pos += self._event.size + name_len
+            if wd in self._paths:
+                paths.add(self._paths[wd])
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Job(object):
+    def __init__(self, name, expected):
+        self.name = name
+        self.start_time = time.time()
+        self.phase = None
+        self.phase_start = None
+        self.follower = None
+        self.watch = None
+        self.expected = expected or {}
+        self.printed = False
+        self.last_size = 0
+
+    def eta(self, now):
+        """
+        Estimated remaining time, from the durations of previous runs.
+        """
+        if not self.expected or self.phase not in PHASES:
+            return None
+        remaining = 0.0
+        for phase in PHASES[PHASES.index(self.phase):]:
+            if phase not in self.expected:
+                continue
+            if phase == self.phase:
+                remaining += max(0, self.expected[phase] - (now - self.phase_start))
+            else:
+                remaining += self.expected[phase]
+        return remaining
+
+
+class ProgressMonitor(object):
+    """
+    Monitor following the logs of all running jobs.
+
+    Parameters
+    ----------
+    expected : dict, optional
+        Expected phase durations (seconds) for each job, {job: {phase: seconds}}.
+    interval : float, optional
+        Interval between status reports.  Defaults to 5 s on a
+        terminal, 60 s otherwise.
+    stream : file, optional
+        Where to print the status lines.
+
+    """
+
+    def __init__(self, expected=None, interval=None, stream=None):
+        if stream is None:
+            stream = sys.stderr
+        self.stream = stream
+        self.tty = hasattr(stream, 'isatty') and stream.isatty()
+        if interval is None:
+            interval = 5 if self.tty else 60
+        self.interval = interval
+        self.poll_interval = min(5, interval)
+        self.expected = expected or {}
+        self.jobs = {}
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError):
+            self.inotify = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        if self.tty:
+            self._write("\n")
+
+    def set_phase(self, name, phase, log_file):
+        """
+        Set the current phase of a job, and the log file to follow.
+        Phase None means the job has finished.
+        """
+        now = time.time()
+        with self.lock:
+            job = self.jobs.get(name)
+            if job is None:
+                if phase is None:
+                    return
+                job = Job(name, self.expected.get(name))
+                self.jobs[name] = job
+
+            self._end_phase(job)
+
+            if phase is None:
+                del self.jobs[name]
+                if job.printed and not self.tty:
+                    elapsed = datetime.timedelta(seconds=int(now - job.start_time))
+                    self._write("    ... {0}: done ({1} elapsed)\n".format(name, elapsed))
+                return
+
+            job.phase = phase
+            job.phase_start = now
+            if log_file is not None:
+                job.follower = LogFollower(log_file)
+                job.last_size = 0
+                if self.inotify is not None:
+                    job.watch = self.inotify.add_watch(log_file)
+
+    def _end_phase(self, job):
+        if job.watch is not None and self.inotify is not None:
+            self.inotify.rm_watch(job.watch)
+        job.watch = None
+        job.follower = None
+
+    def _run(self):
+        next_print = time.time() + self.interval
+        while self.running:
+            timeout = max(0.1, min(self.poll_interval, next_print - time.time()))
+
+            if self.inotify is not None:
+                changed = self.inotify.wait(timeout)
+            else:
+                time.sleep(timeout)
+                changed = None
+
+            with self.lock:
+                for job in self.jobs.values():
+                    if job.follower is None:
+                        continue
+                    # Files without a watch are polled
+                    if changed is None or job.watch is None or job.follower.filename in changed:
+                        job.follower.read()
+
+                if time.time() >= next_print:
+                    next_print = time.time() + self.interval
+                    self._print_status()
+
+    def _print_status(self):
+        now = time.time()
+        lines = []
+        for name in sorted(self.jobs.keys()):
+            job = self.jobs[name]
+            if job.follower is None:
+                continue
+            if not self.tty and job.follower.size <= job.last_size:
+                # no new output: possibly stuck, don't claim it's running
+                continue
+            job.last_size = job.follower.size
+            job.printed = True
+            lines.append(self.format_job(job, now))
+
+        if not lines:
+            return
+
+        if self.tty:
+            self._write("\r\033[K" + " | ".join(lines))
+        else:
+            self._write("".join("    ... {0}\n".format(line) for line in lines))
+
+    def format_job(self, job, now):
+        elapsed = datetime.timedelta(seconds=int(now - job.start_time))
+        parts = ["{0}: {1}".format(job.name, job.phase),
+                 "{0} elapsed".format(elapsed),
+                 format_size(job.follower.size)]
+        if job.follower.test_count:
+            parts.append("{0} tests ({1} failed)".format(job.follower.test_count,
+                                                         job.follower.fail_count))
+        eta = job.eta(now)
+        if eta is not None:
+            parts.append("ETA {0}".format(datetime.timedelta(seconds=int(eta))))
+        return ", ".join(parts)
+
+    def _write(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+
+
+def format_size(size):
+    if size < 1024:
+        return "{0} B".format(size)
+    for unit in ('kB', 'MB', 'GB'):
+        size /= 1024.0
+        if size < 1024 or unit == 'GB':
+            return "{0:.1f} {1}".format(size, unit)
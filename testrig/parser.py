@@ -4,16 +4,39 @@ import sys
 import re
 import os
 import io
+import glob
+import functools
+import multiprocessing
 
 import xml.etree.ElementTree as etree
 
+try:
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+except ImportError:
+    ProcessPoolExecutor = None
 
-def parse_nose(text, cwd, param):
+
+# Per-test outcomes reported in details['cases'] = {test_id: (outcome, duration)}
+OUTCOMES = ('passed', 'failed', 'error', 'skipped')
+
+# Smallest number of files parsed in a pool of processes; starting the
+# workers costs more than parsing a few files
+PARALLEL_MIN_ITEMS = 8
+
+NOSE_OUTCOMES = {'ok': 'passed', 'FAIL': 'failed', 'ERROR': 'error',
+                 'SKIP': 'skipped', 'skipped': 'skipped',
+                 'expected failure': 'passed', 'unexpected success': 'failed'}
+
+
+def parse_nose(text, cwd, param, details=None):
     if param is not None:
         raise ValueError("Unknown parameters '{:r}' for parser 'nose'".format(param))
 
     failures = {}
     test_count = -1
+    cases = {}
+    pending = None
 
     state = 'initial'
     name = ''
@@ -22,6 +45,16 @@ def parse_nose(text, cwd, param):
     for line in text.splitlines():
         line = line.rstrip()
 
+        if state == 'initial':
+            # Test result, possibly on a later line after other output
+            m = re.match(r'^(?:(.*\S) \.\.\. ?)?(?:(ok|FAIL|ERROR|SKIP|skipped|expected failure|unexpected success)(?!\w))?', line)
+            if m and m.group(1):
+                pending = m.group(1)
+            if m and m.group(2) and pending is not None:
+                cases[pending] = (NOSE_OUTCOMES[m.group(2)], None)
+                pending = None
+                continue
+
         m = re.match('^========+$', line)
         if m:
             if state == 'content':
@@ -32,6 +65,7 @@ def parse_nose(text, cwd, param):
         m = re.match('^(ERROR|FAIL): (.*)$', line)
         if m and state == 'top-header':
             name = m.group(2).strip()
+            cases[name] = ('error' if m.group(1) == 'ERROR' else 'failed', None)
             message = [line]
             state = 'name'
             continue
@@ -62,10 +96,21 @@ def parse_nose(text, cwd, param):
 
     warns = _parse_warnings(text, suite="nose")
 
+    if details is not None:
+        details['cases'] = cases
+
     return failures, warns, test_count, err_msg
 
 
-def parse_junit(text, cwd, param):
+def parse_junit(text, cwd, param, details=None):
+    """
+    Parse xUnit/jUnit XML result files.
+
+    `param` is a file name, a glob pattern or a directory (of ``*.xml``
+    files), relative to `cwd`.  Several files are parsed in parallel,
+    and merged as if they were one file; test ids appearing in more
+    than one file are reported in ``details['notes']``.
+    """
     if param is not None:
         logfile = param
     else:
@@ -73,26 +118,79 @@ def parse_junit(text, cwd, param):
 
     xml_fn = os.path.join(cwd, logfile)
 
-    if not os.path.isfile(xml_fn):
+    if os.path.isdir(xml_fn):
+        filenames = sorted(glob.glob(os.path.join(xml_fn, '*.xml')))
+    elif glob.has_magic(logfile):
+        filenames = sorted(glob.glob(xml_fn))
+    elif os.path.isfile(xml_fn):
+        filenames = [xml_fn]
+    else:
+        filenames = []
+
+    if not filenames:
         return {}, {}, -1, "ERROR: log file '{}' not found".format(logfile)
 
+    results = _map_parallel(_parse_junit_file, filenames)
+
     failures = {}
     warns = {}
+    cases = {}
+    notes = []
+    test_count = 0
+    seen = {}
+
+    for filename, (file_failures, file_warns, file_cases, err_msg) in zip(filenames, results):
+        if err_msg is not None:
+            return {}, {}, -1, err_msg
+
+        for name, outcome in file_cases:
+            if seen.get(name, filename) != filename:
+                notes.append("test id '{0}' appears in both {1} and {2}".format(
+                    name, os.path.relpath(seen[name], cwd), os.path.relpath(filename, cwd)))
+            seen[name] = filename
+            cases[name] = outcome
+
+        test_count += len(file_cases)
+        failures.update(file_failures)
+        warns.update(file_warns)
+
+    if details is not None:
+        details['cases'] = cases
+        if notes:
+            details['notes'] = notes
+
+    return failures, warns, test_count, None
+
+
+def _parse_junit_file(xml_fn):
+    """
+    Parse one junit file.
+
+    Returns
+    -------
+    failures : dict
+    warns : dict
+    cases : list of (test_id, (outcome, duration))
+        Test cases, in file order.
+    err_msg : str or None
+
+    """
+    failures = {}
+    warns = {}
+    cases = []
 
     try:
         tree = etree.parse(xml_fn)
     except Exception as exc:
-        return {}, {}, -1, "ERROR: opening 'junit.xml' failed: {0}".format(exc)
-
-    suite = tree.getroot()
-    cases = suite.findall('testcase')
-
-    test_count = len(cases)
+        return {}, {}, [], "ERROR: opening '{0}' failed: {1}".format(os.path.basename(xml_fn), exc)
 
-    for case in cases:
+    # The suites may be wrapped in <testsuites> (pytest >= 5.1)
+    for case in tree.getroot().iter('testcase'):
         failure = case.find('failure')
+        outcome = 'failed'
         if failure is None:
             failure = case.find('error')
+            outcome = 'error'
 
         stdout = case.find('system-out')
         stderr = case.find('system-err')
@@ -112,12 +210,43 @@ def parse_junit(text, cwd, param):
                 failure.attrib.get('type', '') != 'numpy.testing.utils.KnownFailureException'):
             message = "\n".join(["-"*79, name] + failure.text.splitlines())
             failures[name] = message
+        elif case.find('skipped') is not None or failure is not None:
+            outcome = 'skipped'
+        else:
+            outcome = 'passed'
+
+        try:
+            duration = float(case.attrib['time'])
+        except (KeyError, ValueError):
+            duration = None
+        cases.append((name, (outcome, duration)))
 
         # Warnings
         text = stdout + "\n" + stderr
         warns.update(_parse_warnings(text, 'single', name))
 
-    return failures, warns, test_count, None
+    return failures, warns, cases, None
+
+
+def _map_parallel(func, items):
+    """
+    map(func, items) in a pool of processes, or sequentially if there
+    are only a few items or that is not possible.
+
+    The workers are spawned rather than forked: the parsers run while
+    other threads of testrig (parallel jobs, log pumps) hold locks.
+    """
+    if (ProcessPoolExecutor is not None and len(items) >= PARALLEL_MIN_ITEMS and
+            sys.version_info[:2] >= (3, 7)):
+        try:
+            ctx = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(len(items), multiprocessing.cpu_count()),
+                                     mp_context=ctx) as executor:
+                return list(executor.map(func, items))
+        except (OSError, ImportError, NotImplementedError, BrokenProcessPool):
+            # e.g. no working multiprocessing on the platform
+            pass
+    return [func(item) for item in items]
 
 
 def _parse_warnings(text, suite, default_test_name=None):
@@ -134,7 +263,7 @@ def _parse_warnings(text, suite, default_test_name=None):
                 key = None
                 test_name = m.group(1).strip()
         elif suite == 'pytest':
-            m = re.search('^([^\t ]+::test_[^\t ]+)\s+', line)
+            m = re.search(r'^([^\t ]+::test_[^\t ]+)\s+', line)
             if m:
                 key = None
                 test_name = m.group(1).strip()
@@ -180,4 +309,5 @@ def get_parser(name):
         raise ValueError("Unknown parser name: {0}; not one of {1}".format(name,
                                                                            sorted(parsers.keys())))
 
-    return lambda text, suite: func(text, suite, param)
+    # partial (instead of lambda) keeps the parser picklable
+    return functools.partial(func, param=param)
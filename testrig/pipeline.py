@@ -0,0 +1,250 @@
+"""
+Prefetch pipeline overlapping network I/O with builds.
+
+Git fetches and sdist/wheel downloads for all install parts of all
+queued tests are submitted up front to a bounded pool of I/O worker
+threads, in the order the builds are going to need them.  The fixtures
+then wait only for the artifacts of the install part they are about to
+build, so that fetch latency is hidden behind compilation.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import subprocess
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import gitcache
+from . import wheelhouse
+
+
+# Build backend installed by pip for isolated builds of packages that do
+# not declare another one in pyproject.toml
+ISOLATED_BUILD_DEPS = ('setuptools', 'wheel')
+
+
+class Task(object):
+    """
+    Prefetch task, run in an I/O worker thread.
+    """
+
+    def __init__(self, key, func, args):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.error = None
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self.func(*self.args)
+        except BaseException as exc:
+            self.error = exc
+        finally:
+            self._done.set()
+
+    def cancel(self):
+        """
+        Mark a task that has not started as failed.
+        """
+        self.error = OSError("prefetching {0!r} cancelled".format(self.key))
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self):
+        """
+        Wait for the task to finish, and re-raise its exception, if any.
+        """
+        # Wait with a timeout, so that KeyboardInterrupt is delivered
+        while not self._done.wait(1.0):
+            pass
+        if self.error is not None:
+            raise self.error
+
+
+class Prefetcher(object):
+    """
+    Bounded pool of I/O workers running git fetches and downloads.
+
+    Parameters
+    ----------
+    wheelhouse_dir : str
+        Directory to download distributions to.
+    log : file
+        Log file for the output of the fetch commands.
+    num_workers : int
+        Number of I/O worker threads.
+    print_logged : callable
+        Function for printing messages.
+
+    """
+
+    def __init__(self, wheelhouse_dir, log, num_workers=4, print_logged=print):
+        self.wheelhouse_dir = wheelhouse_dir
+        self.log = log
+        self.num_workers = max(1, num_workers)
+        self._print = print_logged
+        self._tasks = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._repo_locks = {}
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+
+        if not os.path.isdir(self.wheelhouse_dir):
+            os.makedirs(self.wheelhouse_dir)
+
+        for j in range(self.num_workers):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        Cancel the tasks not yet started, and wait for the running ones
+        and the worker threads to finish.
+        """
+        while True:
+            try:
+                task = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if task is not None:
+                task.cancel()
+
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            task.run()
+
+    def _submit(self, key, func, *args):
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                task = Task(key, func, args)
+                self._tasks[key] = task
+                self._queue.put(task)
+            return task
+
+    def get(self, key):
+        with self._lock:
+            return self._tasks.get(key)
+
+    def _run_cmd(self, cmd, cwd=None):
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
+        out, _ = p.communicate()
+        with self._log_lock:
+            print("$ " + " ".join(cmd), file=self.log)
+            print(out.decode('utf-8', 'replace'), file=self.log)
+            self.log.flush()
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, cmd)
+
+    def git_fetch(self, repo_cache_dir, module, url):
+        """
+        Submit fetching `url` into the bare cached repository for `module`.
+        """
+        cached_repo = os.path.join(repo_cache_dir, module)
+        key = ('git', cached_repo, url)
+        return self._submit(key, self._git_fetch, cached_repo, url)
+
+    def _git_fetch(self, cached_repo, url):
+        # Different urls may map to the same cached repository
+        with self._lock:
+            lock = self._repo_locks.setdefault(cached_repo, threading.Lock())
+
+        with lock:
+            gitcache.fetch(cached_repo, url, run_cmd=self._run_cmd)
+
+    def download(self, python, spec, binary_ok):
+        """
+        Submit downloading `spec` into the wheelhouse.
+        """
+        key = ('download', python, spec, binary_ok)
+        return self._submit(key, self._download, python, spec, binary_ok)
+
+    def _download(self, python, spec, binary_ok):
+        try:
+            wheelhouse.download(python, spec, binary_ok, self.wheelhouse_dir,
+                                run_cmd=self._run_cmd)
+        except (subprocess.CalledProcessError, OSError) as exc:
+            self._print("WARNING: prefetching {0} failed: {1}".format(spec, exc))
+            raise
+
+    def wait_download(self, python, spec, binary_ok):
+        """
+        Wait for a submitted download to finish, if there is one.
+
+        Download failures are ignored here; pip falls back to the
+        package index for anything not in the wheelhouse.
+        """
+        task = self.get(('download', python, spec, binary_ok))
+        if task is None:
+            return
+        try:
+            task.wait()
+        except (subprocess.CalledProcessError, OSError):
+            pass
+
+    def submit_tests(self, tests, repo_cache_dirs, git_cache=True, download=True):
+        """
+        Submit all fetches needed by the given tests, in build order.
+
+        Parameters
+        ----------
+        tests : list of Test
+            Tests in the order they are going to be run.
+        repo_cache_dirs : dict
+            Git cache directory for each test name.
+        git_cache : bool
+            Whether to prefetch git repositories.
+        download : bool
+            Whether to download pip packages into the wheelhouse.
+
+        Returns
+        -------
+        count : int
+            Number of submitted tasks.
+
+        """
+        for test in tests:
+            python = test.fixture_cls.get_download_python(test.python)
+            builds = False
+            for install in [test.build_deps] + [install for side, install in test.get_sides()]:
+                for kind, item in test.fixture_cls.get_fetch_items(install):
+                    if kind == 'git':
+                        builds = True
+                        if git_cache:
+                            module, url, branch = item
+                            self.git_fetch(repo_cache_dirs[test.name], module, url)
+                    elif kind == 'pip' and download:
+                        spec, binary_ok = item
+                        builds = builds or not binary_ok
+                        self.download(python, spec, binary_ok)
+
+            # For isolated builds from the wheelhouse with --offline
+            if builds and download and not test.build_deps:
+                for spec in ISOLATED_BUILD_DEPS:
+                    self.download(python, spec, True)
+        with self._lock:
+            return len(self._tasks)
@@ -0,0 +1,186 @@
+"""
+Scheduling of the test jobs from the durations of previous runs.
+
+Jobs are ordered longest first and packed onto the available job slots
+(the longest processing time rule), which is also the order in which the
+parallel backends start them.  A job's build phases are expected to be
+shorter when packages it installs were already built by an earlier job
+in the same run, as they then come mostly from the compiler caches.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+from .history import SIDES, format_duration
+
+PHASE_ORDER = ['setup-old', 'build-old', 'test-old', 'parse-old',
+               'setup-new', 'build-new', 'test-new', 'parse-new']
+
+# Smaller expected savings (seconds) are ignored
+MIN_SAVING = 1.0
+
+
+class PlannedJob(object):
+    def __init__(self, test, estimate, known, phases):
+        self.test = test
+        self.name = test.name
+        self.estimate = estimate
+        self.known = known
+        self.phases = phases
+        self.slot = None
+        self.start = None
+        self.end = None
+        self.saved = 0.0
+        self.reused = []
+
+    @property
+    def duration(self):
+        return self.estimate - self.saved
+
+    def get_phase_offset(self, phase, end=False):
+        """
+        Expected time from the start of the job to the start (or end)
+        of a phase.
+        """
+        offset = 0.0
+        for p in PHASE_ORDER:
+            if p == phase and not end:
+                break
+            offset += self.phases.get(p, 0)
+            if p == phase:
+                break
+        return offset
+
+
+class Plan(object):
+    """
+    Predicted schedule of jobs.
+
+    Attributes
+    ----------
+    jobs : list of PlannedJob
+        Jobs in start order, with their slot, predicted start and end
+        times, and the build time saved by cache reuse.
+    num_slots : int
+        Number of jobs run at the same time.
+
+    """
+
+    def __init__(self, jobs, num_slots):
+        self.jobs = jobs
+        self.num_slots = num_slots
+
+    @property
+    def tests(self):
+        return [job.test for job in self.jobs]
+
+    @property
+    def makespan(self):
+        return max([job.end for job in self.jobs] + [0])
+
+    @property
+    def total(self):
+        return sum(job.duration for job in self.jobs)
+
+    def format(self):
+        lines = ["Plan for {0} jobs on {1} slots:".format(len(self.jobs), self.num_slots),
+                 "  {0:>4}  {1:>9}  {2:>9}  {3}".format("slot", "start", "end", "job")]
+        for job in self.jobs:
+            note = ""
+            if not job.known:
+                note = "  (no history)"
+            elif job.saved > 0:
+                note = "  ({0} saved by cache reuse)".format(format_duration(job.saved))
+            lines.append("  {0:>4}  {1:>9}  {2:>9}  {3}{4}".format(
+                job.slot, format_duration(job.start), format_duration(job.end), job.name, note))
+
+        reused = [(job, item) for job in self.jobs for item in job.reused]
+        if reused:
+            lines.append("")
+            lines.append("Cache reuse:")
+            for job, (side, label, source, saved) in reused:
+                lines.append("  {0} ({1}): {2} built by {3}, {4} saved".format(
+                    job.name, side, label, source, format_duration(saved)))
+
+        lines.append("")
+        lines.append("Expected wall-clock time: {0} (total job time {1})".format(
+            format_duration(self.makespan), format_duration(self.total)))
+        return "\n".join(lines)
+
+
+def make_plan(tests, expected, part_durations=None, cached_part_durations=None,
+              num_slots=1, shared_cache=True, order=True):
+    """
+    Order the tests and predict the schedule.
+
+    Parameters
+    ----------
+    tests : list of Test
+        Tests to run.
+    expected : dict
+        Expected phase durations, {section: {phase: seconds}}.
+    part_durations : dict, optional
+        Expected durations of the installed parts,
+        {section: {side: {label: seconds}}}.
+    cached_part_durations : dict, optional
+        Durations of the installed parts when served from the caches,
+        {label: seconds}.
+    num_slots : int, optional
+        Number of jobs run at the same time.
+    shared_cache : bool, optional
+        Whether the jobs share the compiler caches.
+    order : bool, optional
+        Whether to order the jobs longest first, instead of keeping
+        the given order.
+
+    Returns
+    -------
+    plan : Plan
+
+    """
+    if part_durations is None:
+        part_durations = {}
+    if cached_part_durations is None:
+        cached_part_durations = {}
+
+    estimates = dict((name, sum(phases.values())) for name, phases in expected.items())
+    # Jobs without history are assumed long, so that they do not end up last
+    default_estimate = max(list(estimates.values()) + [0])
+
+    jobs = [PlannedJob(t, estimates.get(t.name, default_estimate), t.name in estimates,
+                       expected.get(t.name, {}))
+            for t in tests]
+    if order:
+        jobs.sort(key=lambda job: -job.estimate)
+
+    slots = [0.0] * max(1, num_slots)
+    built = {}
+
+    for job in jobs:
+        job.slot = min(range(len(slots)), key=lambda j: slots[j])
+        job.start = slots[job.slot]
+
+        # Parts built by earlier jobs before this job's build starts
+        # are expected to come from the caches
+        parts = part_durations.get(job.name, {})
+        for side in SIDES:
+            build_start = job.start + job.get_phase_offset('build-' + side)
+            for label, duration in sorted(parts.get(side, {}).items()):
+                source, built_time = built.get((job.test.python, label), (None, None))
+                if source is None or built_time > build_start or not shared_cache:
+                    continue
+                saved = max(0.0, duration - cached_part_durations.get(label, duration))
+                if saved >= MIN_SAVING:
+                    job.saved += saved
+                    job.reused.append((side, label, source, saved))
+
+        for side in SIDES:
+            build_end = job.start + job.get_phase_offset('build-' + side, end=True)
+            for label in parts.get(side, {}):
+                key = (job.test.python, label)
+                if key not in built or built[key][1] > build_end:
+                    built[key] = (job.name, build_end)
+
+        job.end = job.start + job.duration
+        slots[job.slot] = job.end
+
+    return Plan(jobs, len(slots))
@@ -0,0 +1,367 @@
+"""
+Running commands with wall-clock timeouts, hang detection and resource
+limits.
+
+Commands run in a process group of their own, so that on timeout the
+whole group (e.g. the test runner and the processes it started) can be
+killed.  A command is considered hung when its log has not grown for
+the stall timeout.  Per-process memory and CPU time limits are set
+with ulimit, in a shell that then execs the command.
+
+Logs without a file descriptor (compressed logs) get the output through
+a pipe, copied by a thread that flushes the log when the output pauses
+and at least every PUMP_INTERVAL seconds.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import re
+import sys
+import time
+import select
+import signal
+import threading
+import subprocess
+
+# Time given to processes to exit after SIGTERM, before SIGKILL
+KILL_GRACE = 10.0
+
+# Interval for flushing logs receiving output through a pipe, in seconds
+PUMP_INTERVAL = 0.5
+
+
+class ProcessTimeout(subprocess.CalledProcessError):
+    """
+    Command killed after exceeding its time limit, or after producing
+    no output for too long.
+
+    Attributes
+    ----------
+    reason : str
+        'timeout' or 'stall'.
+    timeout : float
+        The limit exceeded, in seconds.
+
+    """
+
+    def __init__(self, cmd, reason, timeout):
+        subprocess.CalledProcessError.__init__(self, -signal.SIGKILL, cmd)
+        self.reason = reason
+        self.timeout = timeout
+
+    def __str__(self):
+        if self.reason == 'stall':
+            what = "produced no output for {0:g} s".format(self.timeout)
+        else:
+            what = "exceeded the time limit of {0:g} s".format(self.timeout)
+        return "Command '{0}' {1}, killed".format(self.cmd, what)
+
+
+class Limits(object):
+    """
+    Limits for running a command.
+
+    Parameters
+    ----------
+    timeout : float, optional
+        Wall-clock time limit, in seconds, counted from the start of the
+        stage the command belongs to.
+    stall_timeout : float, optional
+        Limit for the time without new output in the log, in seconds.
+    process_memory : int, optional
+        Address space limit of each process, in bytes.
+    process_cpu_time : int, optional
+        CPU time limit of each process, in seconds.
+
+    The memory and CPU time limits are resource limits, which every
+    process of the command gets in full: they do not limit the total of
+    e.g. parallel test workers, nor isolate the jobs from each other.
+
+    """
+
+    def __init__(self, timeout=None, stall_timeout=None, process_memory=None,
+                 process_cpu_time=None):
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.process_memory = process_memory
+        self.process_cpu_time = process_cpu_time
+
+    def __repr__(self):
+        return ("<Limits timeout={0} stall_timeout={1} process_memory={2} "
+                "process_cpu_time={3}>").format(self.timeout, self.stall_timeout,
+                                                self.process_memory, self.process_cpu_time)
+
+    def __bool__(self):
+        return any(x is not None for x in (self.timeout, self.stall_timeout,
+                                           self.process_memory, self.process_cpu_time))
+
+    __nonzero__ = __bool__
+
+    def get_popen_kwargs(self):
+        """
+        Keyword arguments for Popen to start a new process group.
+        """
+        if sys.version_info[0] >= 3:
+            return dict(start_new_session=True)
+        else:
+            # setsid only: no Python code runs in the child before exec
+            return dict(preexec_fn=os.setsid)
+
+    def wrap_command(self, cmd, shell=False):
+        """
+        Wrap the command in a shell setting the resource limits before
+        exec, so that they apply to all processes the command starts.
+        """
+        ulimits = []
+        if self.process_memory is not None:
+            ulimits.append("ulimit -v {0}".format(int(self.process_memory) // 1024))
+        if self.process_cpu_time is not None:
+            ulimits.append("ulimit -t {0}".format(int(self.process_cpu_time)))
+        if not ulimits:
+            return cmd
+
+        if shell:
+            return "; ".join(ulimits + [cmd])
+        return ['sh', '-c', "; ".join(ulimits + ['exec "$@"']), 'sh'] + list(cmd)
+
+
+def parse_duration(text):
+    """
+    Parse a duration such as '90', '30s', '45m', '2h' into seconds.
+    """
+    if text is None or not text.strip():
+        return None
+    m = re.match(r'^\s*([0-9.]+)\s*([smh]?)\s*$', text)
+    if not m:
+        raise ValueError("invalid duration '{0}'".format(text))
+    return float(m.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[m.group(2)]
+
+
+def parse_size(text):
+    """
+    Parse a size such as '4G', '512M', '1000000' into bytes.
+    """
+    if text is None or not text.strip():
+        return None
+    m = re.match(r'^\s*([0-9.]+)\s*([kKMGT]?)i?B?\s*$', text)
+    if not m:
+        raise ValueError("invalid size '{0}'".format(text))
+    scale = {'': 1, 'k': 2**10, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}[m.group(2)]
+    return int(float(m.group(1)) * scale)
+
+
+def kill_group(p, grace=KILL_GRACE):
+    """
+    Terminate the process group of `p`, and kill it if it does not
+    exit in time.
+    """
+    try:
+        os.killpg(p.pid, signal.SIGTERM)
+    except OSError:
+        return
+
+    end = time.time() + grace
+    while time.time() < end:
+        if p.poll() is not None:
+            break
+        time.sleep(0.1)
+
+    # Also processes of the group that outlived the leader
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    p.wait()
+
+
+def _get_log_size(log):
+    size = getattr(log, 'bytes_written', None)
+    if size is not None:
+        return size
+    try:
+        return os.fstat(log.fileno()).st_size
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _has_fileno(log):
+    try:
+        log.fileno()
+        return True
+    except (AttributeError, ValueError, OSError, IOError):
+        return False
+
+
+class OutputPump(object):
+    """
+    Thread copying the output of a process from a pipe to a log.
+    """
+
+    def __init__(self, p, log, interval=PUMP_INTERVAL):
+        self.p = p
+        self.log = log
+        self.interval = interval
+        self.exited = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Copy the rest of the output, after the process has exited.  The
+        output of processes it left behind is copied until it pauses,
+        for at most KILL_GRACE seconds.
+        """
+        self.exited.set()
+        self.thread.join()
+
+    def _run(self):
+        fd = self.p.stdout.fileno()
+        pending = False
+        last_flush = time.time()
+        end = None
+        try:
+            while True:
+                try:
+                    r, _, _ = select.select([fd], [], [], self.interval)
+                except (OSError, select.error):
+                    r = [fd]
+                data = os.read(fd, 65536) if r else None
+                if data == b'':
+                    break
+                if data:
+                    self.log.write_bytes(data)
+                    pending = True
+
+                now = time.time()
+                if pending and (data is None or now - last_flush >= self.interval):
+                    self.log.flush()
+                    pending = False
+                    last_flush = now
+
+                if self.exited.is_set():
+                    if end is None:
+                        end = now + KILL_GRACE
+                    if data is None or now > end:
+                        break
+        finally:
+            self.p.stdout.close()
+            self.log.flush()
+
+
+def run_process(cmd, log, limits=None, check=True, start=None, poll_interval=1.0, **kwargs):
+    """
+    Run a command with its output going to `log`, within the limits.
+
+    Parameters
+    ----------
+    cmd : list of str or str
+        Command, as for subprocess.Popen.
+    log : file
+        File receiving stdout and stderr, or an object with
+        write_bytes(), flush() and bytes_written (e.g. a compressed
+        log).  Its growth is used for detecting hung commands.
+    limits : Limits, optional
+        Limits to apply.
+    check : bool, optional
+        Whether to raise CalledProcessError on nonzero exit status.
+    start : float, optional
+        Start time of the stage, from which the timeout is counted.
+        Default: now.
+    poll_interval : float, optional
+        Interval for checking the limits, in seconds.
+    **kwargs
+        Passed on to subprocess.Popen.
+
+    Returns
+    -------
+    returncode : int
+
+    Raises
+    ------
+    ProcessTimeout
+        If the command exceeded the timeout or stall timeout.
+    subprocess.CalledProcessError
+        If `check` and the command failed.
+
+    """
+    if limits is None:
+        limits = Limits()
+
+    if _has_fileno(log):
+        kwargs.update(stdout=log, stderr=log)
+    else:
+        kwargs.update(stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    if not limits:
+        p = subprocess.Popen(cmd, **kwargs)
+        pump = OutputPump(p, log) if p.stdout is not None else None
+        try:
+            returncode = p.wait()
+        finally:
+            if pump is not None:
+                pump.stop()
+    else:
+        kwargs.update(limits.get_popen_kwargs())
+        p = subprocess.Popen(limits.wrap_command(cmd, shell=kwargs.get('shell', False)),
+                             **kwargs)
+        pump = OutputPump(p, log) if p.stdout is not None else None
+
+        try:
+            reason, timeout = _wait_within_limits(p, log, limits, start, poll_interval)
+        except BaseException:
+            # The process group does not get e.g. the terminal's SIGINT
+            kill_group(p)
+            raise
+        finally:
+            if pump is not None and p.returncode is not None:
+                pump.stop()
+
+        if reason is not None:
+            kill_group(p)
+            if pump is not None:
+                pump.stop()
+            exc = ProcessTimeout(cmd, reason, timeout)
+            msg = "\ntestrig: {0}\n".format(exc)
+            try:
+                if 'b' in getattr(log, 'mode', ''):
+                    msg = msg.encode('utf-8')
+                log.write(msg)
+                log.flush()
+            except (ValueError, IOError, OSError):
+                pass
+            raise exc
+
+        returncode = p.returncode
+
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return returncode
+
+
+def _wait_within_limits(p, log, limits, start, poll_interval):
+    """
+    Wait for the process to exit.  Returns (reason, timeout) if it
+    exceeded a limit first, and (None, None) otherwise.
+    """
+    last_output = time.time()
+    if start is None:
+        start = last_output
+    last_size = _get_log_size(log)
+
+    while p.poll() is None:
+        time.sleep(poll_interval)
+        now = time.time()
+
+        size = _get_log_size(log)
+        if size != last_size:
+            last_size = size
+            last_output = now
+
+        if limits.timeout is not None and now - start > limits.timeout:
+            return 'timeout', limits.timeout
+        elif limits.stall_timeout is not None and now - last_output > limits.stall_timeout:
+            return 'stall', limits.stall_timeout
+
+    return None, None
@@ -0,0 +1,133 @@
+"""
+Profiling test runs, and function-level diffs of the profiles.
+
+This module is copied into the site hook directory of the fixtures, and
+imported from the ``sitecustomize.py`` there when ``TESTRIG_PROFILE``
+is set, so it must not depend on the rest of testrig.  Each Python
+process of the command then runs under cProfile, and writes its
+profile to ``$TESTRIG_PROFILE-<pid>.prof`` at exit.
+
+The profiles of the 'old' and 'new' environments are compared by the
+cumulative time of each function.  Functions are identified by their
+file, relative to ``site-packages`` or the Python library directory so
+that they match between the environments, and their name; line numbers
+are ignored, as they change between versions.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import re
+import glob
+import pstats
+
+
+# Number of functions shown in a diff
+MAX_FUNCTIONS = 25
+
+
+def install(prefix):
+    """
+    Profile the current process, writing the profile at exit.
+    """
+    import atexit
+    import cProfile
+
+    profile = cProfile.Profile()
+
+    def save():
+        profile.disable()
+        # The pid at exit: forked processes write profiles of their own
+        profile.dump_stats("{0}-{1}.prof".format(prefix, os.getpid()))
+
+    atexit.register(save)
+    profile.enable()
+
+
+def get_function_name(key):
+    """
+    Name of a function from a pstats key (filename, line, name), the
+    same in different environments.
+    """
+    filename, line, name = key
+    if filename == '~':
+        # Built-in function
+        return name
+    m = re.search(r'[/\\](?:site|dist)-packages[/\\](.*)$', filename)
+    if m is None:
+        m = re.search(r'[/\\]lib[/\\]python[0-9.]*[/\\](.*)$', filename)
+    if m is not None:
+        filename = m.group(1)
+    return "{0}:{1}".format(filename.replace(os.sep, '/'), name)
+
+
+def load_profiles(prefix):
+    """
+    Load and aggregate the profiles written with the given prefix.
+
+    Returns
+    -------
+    functions : dict or None
+        {function: (calls, total time, cumulative time)}, or None if
+        there are no profiles.
+
+    """
+    filenames = sorted(glob.glob(prefix + '-*.prof'))
+    if not filenames:
+        return None
+
+    functions = {}
+    for filename in filenames:
+        stats = pstats.Stats(filename)
+        for key, (cc, nc, tt, ct, callers) in stats.stats.items():
+            name = get_function_name(key)
+            calls, total, cumulative = functions.get(name, (0, 0.0, 0.0))
+            functions[name] = (calls + nc, total + tt, cumulative + ct)
+    return functions
+
+
+def diff_profiles(old, new):
+    """
+    Difference of cumulative time per function.
+
+    Returns
+    -------
+    rows : list of (function, old, new)
+        Functions appearing in either, with their (calls, total time,
+        cumulative time) in each, or None where missing, largest
+        increase of cumulative time first.
+
+    """
+    rows = [(name, old.get(name), new.get(name)) for name in set(old) | set(new)]
+
+    def increase(row):
+        name, old_row, new_row = row
+        return (new_row[2] if new_row else 0.0) - (old_row[2] if old_row else 0.0)
+
+    rows.sort(key=lambda row: (-increase(row), row[0]))
+    return rows
+
+
+def format_diff(old, new, max_functions=MAX_FUNCTIONS):
+    """
+    Format a table of the functions that got slower the most.
+    """
+    total_old = sum(total for calls, total, cumulative in old.values())
+    total_new = sum(total for calls, total, cumulative in new.values())
+
+    lines = ["total time: old {0:.3f} s, new {1:.3f} s".format(total_old, total_new),
+             "{0:>10} {1:>10} {2:>10} {3:>17}  {4}".format(
+                 "cum. old", "cum. new", "change", "calls old/new", "function")]
+
+    for name, old_row, new_row in diff_profiles(old, new)[:max_functions]:
+        old_calls, old_total, old_cum = old_row or (0, 0.0, 0.0)
+        new_calls, new_total, new_cum = new_row or (0, 0.0, 0.0)
+        if new_cum - old_cum <= 0:
+            break
+        lines.append("{0:>10} {1:>10} {2:>+10.4f} {3:>17}  {4}".format(
+            "{0:.4f}".format(old_cum) if old_row else "-",
+            "{0:.4f}".format(new_cum) if new_row else "-",
+            new_cum - old_cum,
+            "{0}/{1}".format(old_calls, new_calls),
+            name))
+    return "\n".join(lines)
@@ -0,0 +1,84 @@
+"""
+Targeted reruns of new failures, and their classification.
+
+New failures are rerun a few times in both the 'old' and the 'new'
+environment.  A failure that reproduces every time in 'new' and never
+in 'old' is a regression; one that does not reproduce consistently is
+flaky; and one that also fails in 'old' depends on the environment the
+tests run in rather than on the packages compared.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import re
+
+try:
+    from shlex import quote as shell_quote
+except ImportError:
+    from pipes import quote as shell_quote
+
+
+CLASSIFICATIONS = ('regression', 'flaky', 'environment', 'unknown', 'known-flaky')
+
+
+def format_rerun_cmd(template, test_ids):
+    """
+    Fill in the test ids in a rerun command template.
+
+    ``$TESTS`` is replaced by the shell-quoted test ids, and ``$TESTS_K``
+    by a pytest ``-k`` expression matching the test function names.
+    """
+    names = []
+    for test_id in test_ids:
+        name = re.split(r'[.:]', test_id.split('[')[0].split(' ')[0])[-1]
+        if name and name not in names:
+            names.append(name)
+
+    cmd = template.replace('$TESTS_K', shell_quote(" or ".join(names)))
+    cmd = cmd.replace('$TESTS', " ".join(shell_quote(test_id) for test_id in test_ids))
+    return cmd
+
+
+def get_outcome(test_id, failures, cases):
+    """
+    Outcome of a test in a parsed rerun: True (failed), False (passed)
+    or None (not run).
+    """
+    if test_id in failures:
+        return True
+    outcome = cases.get(test_id, (None, None))[0]
+    if outcome in ('failed', 'error'):
+        return True
+    elif outcome == 'passed':
+        return False
+    return None
+
+
+def classify(counts):
+    """
+    Classify a new failure from its rerun counts.
+
+    Parameters
+    ----------
+    counts : dict
+        Numbers of failed and passed reruns,
+        {('old' | 'new', 'fail' | 'pass'): count}.
+
+    Returns
+    -------
+    classification : str
+        One of 'regression', 'flaky', 'environment', 'unknown'.
+
+    """
+    new_fail = counts.get(('new', 'fail'), 0)
+    new_pass = counts.get(('new', 'pass'), 0)
+    old_fail = counts.get(('old', 'fail'), 0)
+    old_pass = counts.get(('old', 'pass'), 0)
+
+    if new_pass or (old_fail and old_pass):
+        return 'flaky'
+    elif not new_fail:
+        return 'unknown'
+    elif old_fail:
+        return 'environment'
+    return 'regression'
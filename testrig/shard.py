@@ -0,0 +1,152 @@
+"""
+Splitting a test suite into shards run concurrently in one environment.
+
+The test ids are collected with the section's ``collect`` command, and
+split into shards by module, by test id, or by test id balanced by the
+durations recorded in the history.  Modules or tests are assigned to the
+least loaded shard so far, heaviest first.  The results of the shards
+are merged into one, as if from a single run.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import re
+
+try:
+    from shlex import quote as shell_quote
+except ImportError:
+    from pipes import quote as shell_quote
+
+
+SHARD_BY = ('module', 'id', 'duration')
+
+
+def parse_collected(text):
+    """
+    Test ids from the output of a collect command, one per line.  Lines
+    with whitespace (other than pytest ids containing '::'), such as
+    summaries, are ignored.
+    """
+    test_ids = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or (re.search(r'\s', line) and '::' not in line):
+            continue
+        if line not in test_ids:
+            test_ids.append(line)
+    return test_ids
+
+
+def get_module(test_id):
+    """
+    Module of a test id: the file of a pytest node id, or the dotted
+    name up to the test class or function otherwise.
+    """
+    if '::' in test_id:
+        return test_id.split('::', 1)[0]
+    return test_id.rsplit('.', 1)[0]
+
+
+def make_shards(test_ids, num_shards, shard_by='module', durations=None,
+                default_duration=0.01):
+    """
+    Split tests into shards.
+
+    Parameters
+    ----------
+    test_ids : list of str
+        Collected test ids.
+    num_shards : int
+        Number of shards.
+    shard_by : {'module', 'id', 'duration'}
+        Whether to split whole modules (balanced by the number of
+        tests), single tests, or single tests balanced by their
+        durations.
+    durations : dict, optional
+        Test durations from previous runs, {test_id: seconds}.
+    default_duration : float, optional
+        Duration assumed for tests with no recorded duration.
+
+    Returns
+    -------
+    shards : list of list of str
+        Nonempty shards, each a list of module names or test ids.
+
+    """
+    if shard_by not in SHARD_BY:
+        raise ValueError("Unknown shard_by '{0}'; not one of {1}".format(shard_by, list(SHARD_BY)))
+    if durations is None:
+        durations = {}
+
+    weights = {}
+    if shard_by == 'module':
+        for test_id in test_ids:
+            module = get_module(test_id)
+            weights[module] = weights.get(module, 0) + 1
+    elif shard_by == 'id':
+        weights = dict((test_id, 1) for test_id in test_ids)
+    else:
+        weights = dict((test_id, durations.get(test_id, default_duration))
+                       for test_id in test_ids)
+
+    shards = [[] for j in range(max(1, num_shards))]
+    loads = [0] * len(shards)
+    for unit in sorted(weights, key=lambda unit: (-weights[unit], unit)):
+        j = min(range(len(shards)), key=lambda j: (loads[j], j))
+        shards[j].append(unit)
+        loads[j] += weights[unit]
+
+    return [sorted(shard) for shard in shards if shard]
+
+
+def format_shard_cmd(template, shard, num_shards, units):
+    """
+    Fill in ``$SHARD`` (the shard index, from 0), ``$NUM_SHARDS`` and
+    ``$SHARD_TESTS`` (the shell-quoted modules or test ids of the shard)
+    in a command.
+    """
+    cmd = template.replace('$SHARD_TESTS', " ".join(shell_quote(unit) for unit in units))
+    cmd = cmd.replace('$NUM_SHARDS', str(num_shards))
+    cmd = cmd.replace('$SHARD', str(shard))
+    return cmd
+
+
+def merge_results(results):
+    """
+    Merge parsed results of shards.
+
+    Parameters
+    ----------
+    results : list of (failures, warns, test_count, err_msg, details)
+        Parser results of each shard.
+
+    Returns
+    -------
+    failures, warns, test_count, err_msg, details
+        Merged results, as returned by a parser.
+
+    """
+    failures = {}
+    warns = {}
+    cases = {}
+    notes = []
+    test_count = 0
+    err_msgs = []
+
+    for j, (fail, warn, count, err_msg, details) in enumerate(results):
+        failures.update(fail)
+        warns.update(warn)
+        cases.update(details.get('cases', {}))
+        notes.extend(details.get('notes', []))
+        if err_msg is not None:
+            err_msgs.append("shard {0}: {1}".format(j, err_msg))
+        if count < 0:
+            test_count = -1
+        elif test_count >= 0:
+            test_count += count
+
+    err_msg = "\n".join(err_msgs) if err_msgs else None
+    details = dict(cases=cases)
+    if notes:
+        details['notes'] = notes
+    return failures, warns, test_count, err_msg, details
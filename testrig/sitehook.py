@@ -0,0 +1,100 @@
+"""
+Site hook directory injected via PYTHONPATH into commands run in the
+fixtures.
+
+The directory contains a ``sitecustomize.py`` that activates testrig's
+in-process hooks, depending on environment variables set by the
+fixture.
+
+The directory comes first on PYTHONPATH, so its ``sitecustomize.py``
+shadows any other one of the environment or the system Python (e.g.
+Debian's).  After the hooks, it runs the next ``sitecustomize`` found on
+``sys.path``.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+
+
+SITECUSTOMIZE = """\
+# Generated by testrig -- do not edit
+import os
+
+if os.environ.get('TESTRIG_CYTHON_CACHE'):
+    try:
+        import testrig_cythoncache
+        testrig_cythoncache.install(os.environ['TESTRIG_CYTHON_CACHE'])
+    except Exception as exc:
+        import sys
+        sys.stderr.write("testrig: Cython cache disabled: {0}\\n".format(exc))
+
+if os.environ.get('TESTRIG_PROFILE'):
+    try:
+        import testrig_profile
+        testrig_profile.install(os.environ['TESTRIG_PROFILE'])
+    except Exception as exc:
+        import sys
+        sys.stderr.write("testrig: profiling disabled: {0}\\n".format(exc))
+
+
+def _run_next_sitecustomize():
+    import sys
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.abspath(path or os.curdir) for path in sys.path]
+    if here not in paths:
+        return
+    # After the last occurrence, not to find this one again
+    rest = sys.path[len(paths) - paths[::-1].index(here):]
+
+    try:
+        from importlib.machinery import PathFinder
+        from importlib.util import module_from_spec
+    except ImportError:
+        # Python 2
+        import imp
+        try:
+            f, filename, description = imp.find_module('sitecustomize', rest)
+        except ImportError:
+            return
+        try:
+            imp.load_module('_testrig_next_sitecustomize', f, filename, description)
+        finally:
+            if f is not None:
+                f.close()
+        return
+
+    spec = PathFinder.find_spec('sitecustomize', rest)
+    if spec is None or spec.loader is None:
+        return
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+
+try:
+    _run_next_sitecustomize()
+except Exception as exc:
+    import sys
+    sys.stderr.write("testrig: running the next sitecustomize failed: {0}\\n".format(exc))
+"""
+
+
+def create_hook_dir(hook_dir):
+    """
+    Create (or update) the site hook directory.
+    """
+    if not os.path.isdir(hook_dir):
+        os.makedirs(hook_dir)
+
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    shutil.copyfile(os.path.join(src_dir, 'cythoncache.py'),
+                    os.path.join(hook_dir, 'testrig_cythoncache.py'))
+    shutil.copyfile(os.path.join(src_dir, 'profdiff.py'),
+                    os.path.join(hook_dir, 'testrig_profile.py'))
+
+    with open(os.path.join(hook_dir, 'sitecustomize.py'), 'w') as f:
+        f.write(SITECUSTOMIZE)
+
+    return hook_dir
@@ -0,0 +1,137 @@
+from __future__ import absolute_import, division, print_function
+
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+from testrig import cli
+from testrig.logpipe import LogPipeline
+from testrig.bench import get_bench_parser, get_bench_result_files, median_ci, compare_timings
+
+
+def test_parsers():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tmpdir, 'benchmark.json'), 'w') as f:
+            json.dump({'benchmarks': [
+                {'name': 'test_a', 'fullname': 'tests/test_x.py::test_a',
+                 'stats': {'median': 0.5, 'data': [0.4, 0.5, 0.6]}},
+                {'name': 'test_b', 'stats': {'median': 0.25}}]}, f)
+
+        parser = get_bench_parser('pytest-benchmark')
+        timings, err_msg = parser(None, tmpdir)
+        assert err_msg is None
+        assert timings == {'tests/test_x.py::test_a': [0.4, 0.5, 0.6], 'test_b': [0.25]}
+
+        results_dir = os.path.join(tmpdir, 'results', 'machine')
+        os.makedirs(results_dir)
+        with open(os.path.join(results_dir, 'abcdef-env.json'), 'w') as f:
+            json.dump({'result_columns': ['result', 'params', 'version', 'samples'],
+                       'results': {
+                           'bench.time_sum': [[1.0, 2.0], [['10', '100']], 'v', [[0.9, 1.1], None]],
+                           'bench.time_plain': [[3.0], [], 'v', None],
+                           'bench.track_value': [[5], [], 'v', None]}}, f)
+
+        parser = get_bench_parser('asv:results/*/*.json')
+        timings, err_msg = parser(None, tmpdir)
+        assert err_msg is None
+        assert timings == {'bench.time_sum(10)': [0.9, 1.1], 'bench.time_sum(100)': [2.0],
+                           'bench.time_plain': [3.0]}
+
+        with open(os.path.join(results_dir, 'machine.json'), 'w') as f:
+            json.dump({}, f)
+        assert get_bench_result_files(parser, tmpdir) == [os.path.join(results_dir, 'abcdef-env.json')]
+
+        timings, err_msg = get_bench_parser('pytest-benchmark:missing.json')(None, tmpdir)
+        assert timings == {} and 'not found' in err_msg
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_compare_timings():
+    med, low, high = median_ci(list(range(1, 21)))
+    assert med == 10.5
+    assert (low, high) == (6, 15)
+
+    # Too few samples for the confidence level: the whole range
+    assert median_ci([3, 1, 2]) == (2, 1, 3)
+
+    old = {'a': [1.0, 1.1, 0.9, 1.0, 1.05], 'b': [1.0, 1.1, 0.9, 1.0, 1.05], 'c': [1.0]}
+    new = {'a': [1.5, 1.6, 1.4, 1.5, 1.55], 'b': [1.0, 1.2, 0.95, 1.0, 1.1], 'c': [0.5]}
+    changes = dict((name, (ratio, change)) for name, ratio, old_stats, new_stats, change
+                   in compare_timings(old, new))
+    assert changes['a'] == (1.5, 'slower')
+    assert changes['b'][1] is None
+    assert changes['c'] == (0.5, 'faster')
+
+
+class FakeFixture(object):
+    """
+    Fixture whose benchmark runs write the given results.
+    """
+
+    def __init__(self, env_dir, runs):
+        self.env_dir = env_dir
+        self.runs = list(runs)
+
+    def run_test_cmd(self, cmd, log, hook_env=None):
+        returncode, samples = self.runs.pop(0)
+        if samples is not None:
+            with open(os.path.join(self.env_dir, 'benchmark.json'), 'w') as f:
+                json.dump({'benchmarks': [{'name': 'test_a', 'stats': {'data': samples}}]}, f)
+        return returncode
+
+
+def test_benchmark_runs():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        test = cli.BenchmarkTest('bench', 'numpy', 'numpy', 'true', 'pytest-benchmark', 'venv',
+                                 '', tmpdir, sys.executable, repeat=2)
+        log_fn = os.path.join(tmpdir, 'test.log')
+
+        def run(runs):
+            result = cli.TestResult('bench')
+            fixture = FakeFixture(tmpdir, runs)
+            return test.run_tests(result, fixture, 'new', log_fn)
+
+        fail, warn, count, err_msg, details, output = run([(0, [1.0, 2.0]), (0, [3.0])])
+        assert err_msg is None
+        assert details['timings'] == {'test_a': [1.0, 2.0, 3.0]}
+        assert get_bench_result_files(test.parser, tmpdir) == [os.path.join(tmpdir, 'benchmark.json')]
+
+        # The results of the previous run are not read again
+        fail, warn, count, err_msg, details, output = run([(0, [1.0]), (0, None)])
+        assert count == -1 and 'not found' in err_msg
+
+        fail, warn, count, err_msg, details, output = run([(1, [1.0])])
+        assert count == -1 and 'exit status 1' in err_msg
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_benchmark_failed_new_run(monkeypatch):
+    stream = io.StringIO()
+    monkeypatch.setattr(cli, 'LOG_PIPELINE', LogPipeline([stream]))
+
+    test = cli.BenchmarkTest('bench', 'numpy', 'numpy', 'true', 'pytest-benchmark', 'venv',
+                             '', os.getcwd(), sys.executable)
+
+    def run_side(result, side, install, env_name, **kwargs):
+        # As _run_side, for a failing benchmark run in 'new'
+        if side == 'old':
+            result.sides[side] = dict(status='ok', timings={'test_a': [1.0]})
+        else:
+            result.sides[side] = dict(status='parse-error')
+        return -1, {}, {}
+
+    monkeypatch.setattr(test, '_run_side', run_side)
+
+    result = cli.TestResult('bench')
+    test._run_sides(result, [result], None, None, True, True, False, {}, 0, False,
+                    {}, None, False, None)
+
+    assert result.error
+    assert "bench: ERROR: no 'new' benchmark timings to compare" in stream.getvalue()
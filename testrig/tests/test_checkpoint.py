@@ -0,0 +1,27 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+
+from testrig.checkpoint import Checkpoints, get_fingerprint
+
+
+def test_checkpoints():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        checkpoints = Checkpoints(os.path.join(tmpdir, 'scipy'))
+        fingerprint = get_fingerprint({'install': ['numpy']}, 'pytest')
+
+        assert checkpoints.get('results-old', fingerprint) is None
+        checkpoints.put('results-old', fingerprint, {'count': 3})
+        assert checkpoints.get('results-old', fingerprint) == {'count': 3}
+
+        # Changed inputs invalidate the checkpoint
+        other = get_fingerprint({'install': ['scipy']}, 'pytest')
+        assert checkpoints.get('results-old', other) is None
+
+        checkpoints.clear()
+        assert checkpoints.get('results-old', fingerprint) is None
+    finally:
+        shutil.rmtree(tmpdir)
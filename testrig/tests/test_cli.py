@@ -0,0 +1,92 @@
+from __future__ import absolute_import, division, print_function
+
+import io
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from testrig import cli
+from testrig.logpipe import LogPipeline
+from testrig.parser import get_parser
+
+
+class FakeTest(object):
+    """
+    Job reporting the environment it runs in.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        # Parsers must pickle
+        self.parser = get_parser('junit:junit.xml')
+
+    def run(self, cache_dir, log_dir, cleanup, git_cache, verbose, **kwargs):
+        cli.print_logged("{0}: running in worker".format(self.name))
+        fail, warn, count, err_msg = self.parser('', os.getcwd())
+        return [(self.name, os.getpid(), os.getcwd(), os.environ.get('TESTRIG_TEST_VAR'),
+                 os.path.basename(cache_dir), err_msg)]
+
+
+@pytest.mark.skipif(cli.ProcessPoolExecutor is None, reason="needs concurrent.futures")
+def test_run_processes(monkeypatch):
+    tmpdir = os.path.realpath(tempfile.mkdtemp())
+    try:
+        stream = io.StringIO()
+        monkeypatch.setattr(cli, 'LOG_PIPELINE', LogPipeline([stream]))
+
+        jobs = [[FakeTest('a')], [FakeTest('b')]]
+        cache_dirs = dict((name, os.path.join(tmpdir, 'cache-' + name)) for name in ('a', 'b'))
+        env = {'TESTRIG_TEST_VAR': 'value', 'PATH': os.environ.get('PATH', '')}
+        results = cli.run_processes(jobs, cache_dirs, tmpdir, 2, env, tmpdir,
+                                    dict(cleanup=True, git_cache=True, verbose=False))
+
+        assert sorted(results.keys()) == ['a', 'b']
+        for name, job_results in results.items():
+            (result_name, pid, cwd, var, cache_name, err_msg), = job_results
+            assert result_name == name
+            assert pid != os.getpid()
+            assert (cwd, var, cache_name) == (tmpdir, 'value', 'cache-' + name)
+            assert err_msg == "ERROR: log file 'junit.xml' not found"
+
+        # Messages of the workers are printed and logged by the parent
+        assert sorted(stream.getvalue().splitlines()) == ["a: running in worker",
+                                                          "b: running in worker"]
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+class RecordingFixture(object):
+    """
+    Fixture recording its options, failing to set up.
+    """
+    options = []
+
+    def __init__(self, cache_dir, log, **kwargs):
+        self.options.append(kwargs)
+        self.name = kwargs['env_name']
+        self.env_dir = os.path.join(cache_dir, self.name)
+
+    def setup(self):
+        raise OSError("no environment")
+
+    def teardown(self):
+        pass
+
+
+def test_profile_git_cache(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        stream = io.StringIO()
+        monkeypatch.setattr(cli, 'LOG_PIPELINE', LogPipeline([stream]))
+
+        test = cli.Test('scipy', 'scipy', 'scipy', 'true', 'junit', 'venv', '', tmpdir,
+                        None, rerun_cmd='true $TESTS')
+        test.fixture_cls = RecordingFixture
+        test.profile(tmpdir, tmpdir, ['t.a'], git_cache=False)
+
+        assert [options['git_cache'] for options in RecordingFixture.options] == [False, False]
+        assert "profiling failed: no environment" in stream.getvalue()
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,47 @@
+from __future__ import absolute_import, division, print_function
+
+from testrig.cluster import normalize_message, cluster_failures, format_clusters
+
+
+MESSAGE = """\
+-------------------------------------------------------------------------------
+pkg.tests.test_mod.TestX.{name}
+Traceback (most recent call last):
+  File "/tmp/{tmp}/lib/python3.6/site-packages/pkg/tests/test_mod.py", line {line}, in {name}
+    assert_allclose(x, {value})
+AssertionError: Not equal to tolerance rtol=1e-07 <object at {addr}>"""
+
+
+def make_failures():
+    failures = {}
+    for j in range(5):
+        name = 'test_{0}'.format(j)
+        failures['pkg.tests.test_mod.TestX.' + name] = MESSAGE.format(
+            name=name, tmp='tmp{0}x'.format(j), line=10 + j, value=j * 0.5, addr=hex(1000 + j))
+    failures['pkg.tests.test_mod.TestX.test_other'] = "AssertionError: something else"
+    return failures
+
+
+def test_normalize_message():
+    failures = make_failures()
+    text = normalize_message(failures['pkg.tests.test_mod.TestX.test_3'],
+                             'pkg.tests.test_mod.TestX.test_3')
+    assert 'test_3' not in text
+    assert '0x' not in text
+    assert 'tmp3x' not in text
+    assert 'line ?, in <test>' in text
+    assert 'test_mod.py' in text
+
+
+def test_cluster_failures():
+    failures = make_failures()
+    clusters = cluster_failures(failures)
+    assert len(clusters) == 2
+    assert len(clusters[0][1]) == 5
+    assert clusters[1][1] == ['pkg.tests.test_mod.TestX.test_other']
+
+    text = "".join(format_clusters(failures, clusters))
+    assert text.count('Traceback') == 1
+    assert '[5 tests failing alike' in text
+    assert '    pkg.tests.test_mod.TestX.test_4\n' in text
+    assert 'something else' in text
@@ -0,0 +1,46 @@
+from __future__ import absolute_import, division, print_function
+
+import textwrap
+
+from testrig.compcache import parse_stats
+
+
+def test_parse_stats_ccache3():
+    text = textwrap.dedent("""
+    cache directory                     /home/user/.ccache
+    primary config                      /home/user/.ccache/ccache.conf
+    cache hit (direct)                   120
+    cache hit (preprocessed)              30
+    cache miss                            50
+    called for link                       10
+    files in cache                      1234
+    """)
+    assert parse_stats(text) == (150, 50)
+
+
+def test_parse_stats_f90cache():
+    text = textwrap.dedent("""
+    cache hit                              7
+    cache miss                             3
+    """)
+    assert parse_stats(text) == (7, 3)
+
+
+def test_parse_stats_ccache4():
+    text = textwrap.dedent("""
+    Cacheable calls:    200 / 210 (95.24%)
+      Hits:             150 / 200 (75.00%)
+        Direct:         120 / 150 (80.00%)
+        Preprocessed:    30 / 150 (20.00%)
+      Misses:            50 / 200 (25.00%)
+    Local storage:
+      Cache size (GB): 1.0 / 5.0 (20.00%)
+      Hits:             150 / 200 (75.00%)
+      Misses:            50 / 200 (25.00%)
+    """)
+    assert parse_stats(text) == (150, 50)
+
+    text = "direct_cache_hit\t120\npreprocessed_cache_hit\t30\ncache_miss\t50\nfiles_in_cache\t9\n"
+    assert parse_stats(text) == (150, 50)
+
+    assert parse_stats("nothing here") == (None, None)
@@ -0,0 +1,123 @@
+from __future__ import absolute_import, division, print_function
+
+import io
+import os
+import time
+import shutil
+import tempfile
+
+from testrig import fixture
+from testrig.fixture import CondaFixture
+
+
+INFO = {'channels': ['https://conda.anaconda.org/conda-forge/linux-64'],
+        'platform': 'linux-64', 'sys.prefix': '/opt/conda'}
+
+
+def make_fixture(tmpdir, monkeypatch, info=INFO, **kw):
+    f = CondaFixture(os.path.join(tmpdir, 'cache'), io.StringIO(), print_logged=lambda *a: None,
+                     python='3.11', conda_lock_dir=os.path.join(tmpdir, 'lock'), **kw)
+    f.commands = []
+    monkeypatch.setattr(f, 'get_conda_info', lambda: info)
+    monkeypatch.setattr(f, 'run_cmd', lambda cmd, cwd=None, env=None: f.commands.append(cmd))
+    return f
+
+
+def test_conda_lock_key(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        f = make_fixture(tmpdir, monkeypatch)
+        key = f.get_lock_key(['python=3.11', 'numpy'])
+        assert key == f.get_lock_key(['python=3.11', 'numpy'])
+        assert key != f.get_lock_key(['python=3.11', 'numpy=1.26'])
+
+        other = make_fixture(tmpdir, monkeypatch, info=dict(INFO, channels=['defaults']))
+        assert other.get_lock_key(['python=3.11', 'numpy']) != key
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_conda_lock_reuse(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        monkeypatch.setattr(fixture.subprocess, 'check_output',
+                            lambda cmd, env=None: b"@EXPLICIT\n")
+
+        def create(**kw):
+            f = make_fixture(tmpdir, monkeypatch, **kw)
+            f.setup()
+            f.create_env(['numpy'])
+            cmd, = f.commands
+            return cmd
+
+        # Solved, and the solution stored
+        cmd = create()
+        assert cmd[-2:] == ['pip', 'numpy']
+        lock_fn, = [os.path.join(tmpdir, 'lock', fn) for fn in os.listdir(os.path.join(tmpdir, 'lock'))]
+
+        # Created from the solution
+        cmd = create(conda_lock_max_age=3600)
+        assert cmd[-2:] == ['--file', lock_fn]
+
+        # ... unless it is too old, or refreshing
+        old = time.time() - 7200
+        os.utime(lock_fn, (old, old))
+        cmd = create(conda_lock_max_age=3600)
+        assert cmd[-2:] == ['pip', 'numpy']
+        assert os.path.getmtime(lock_fn) > old
+
+        cmd = create(refresh_conda_lock=True)
+        assert cmd[-2:] == ['pip', 'numpy']
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_conda_info_cache(monkeypatch):
+    calls = []
+
+    def check_output(cmd, env=None):
+        calls.append(env.get('CONDA_PKGS_DIRS'))
+        return '{{"pkgs_dirs": ["{0}"]}}'.format(env.get('CONDA_PKGS_DIRS')).encode('utf-8')
+
+    monkeypatch.setattr(fixture.subprocess, 'check_output', check_output)
+    monkeypatch.setattr(fixture, 'CONDA_INFO', {})
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        def make(pkgs_dir):
+            return CondaFixture(os.path.join(tmpdir, 'cache'), io.StringIO(),
+                                print_logged=lambda *a: None, conda_pkgs_dir=pkgs_dir)
+
+        assert make('/a').get_conda_info()['pkgs_dirs'] == ['/a']
+        assert make('/a').get_conda_info()['pkgs_dirs'] == ['/a']
+        assert make('/b').get_conda_info()['pkgs_dirs'] == ['/b']
+        assert calls == ['/a', '/b']
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_conda_activation_env(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # Activation script recording its calls
+        bin_dir = os.path.join(tmpdir, 'conda', 'bin')
+        os.makedirs(bin_dir)
+        count_fn = os.path.join(tmpdir, 'count')
+        with open(os.path.join(bin_dir, 'activate'), 'w') as f:
+            f.write('echo x >> {0}\nexport TESTRIG_ACTIVATED="$1"\n'.format(count_fn))
+
+        f = make_fixture(tmpdir, monkeypatch,
+                         info=dict(INFO, **{'sys.prefix': os.path.join(tmpdir, 'conda')}))
+
+        build_env = f.get_build_env()
+        assert build_env['PATH'].split(os.pathsep)[0] == os.path.join(f.env_dir, 'bin')
+        build_env['FOO'] = 'modified copy'
+        assert 'FOO' not in f.get_build_env()
+
+        for j in range(2):
+            env = f.get_activation_env()
+            assert env['TESTRIG_ACTIVATED'] == f.env_dir
+        with open(count_fn) as fp:
+            assert fp.read() == "x\n"
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,111 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import textwrap
+
+import pytest
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+
+from testrig.cli import get_tests, group_tests
+from testrig.config import Config
+
+
+def write_config(text):
+    tmpdir = tempfile.mkdtemp()
+    fn = os.path.join(tmpdir, 'testrig.ini')
+    with open(fn, 'w') as f:
+        f.write(textwrap.dedent(text))
+    return tmpdir, fn
+
+
+def test_candidates():
+    tmpdir, fn = write_config("""
+    [DEFAULT]
+    env = venv
+    pkgs = pytest
+    old = numpy==1.11.3 {pkgs}
+    run = python -mpytest --pyarg scipy
+    parser = nose
+
+    [scipy]
+    new.master = git+https://github.com/numpy/numpy@master {pkgs}
+    new.maint = git+https://github.com/numpy/numpy@maintenance/1.12.x {pkgs}
+
+    [scipy-plain]
+    new = numpy==1.12.0 {pkgs}
+    """)
+    try:
+        tests = dict((t.name, t) for t in get_tests(fn))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    t = tests['scipy']
+    assert t.candidates == [('new-maint', ['git+https://github.com/numpy/numpy@maintenance/1.12.x', 'pytest']),
+                            ('new-master', ['git+https://github.com/numpy/numpy@master', 'pytest'])]
+    assert t.result_names == ['scipy:maint', 'scipy:master']
+    assert t.get_fingerprint('new-maint') != t.get_fingerprint('new-master')
+
+    t = tests['scipy-plain']
+    assert t.candidates == [('new', ['numpy==1.12.0', 'pytest'])]
+    assert t.result_names == ['scipy-plain']
+
+
+def test_matrix():
+    tmpdir, fn = write_config("""
+    [DEFAULT]
+    env = venv
+    pkgs = pytest
+    new = numpy==1.12.0 {pkgs}
+    run = python{python} -mpytest --pyarg scipy
+    parser = nose
+
+    [scipy]
+    pkgs = {pkgs} Cython
+    matrix.python = 3.5
+        3.6
+    matrix.old = numpy==1.11.3 {pkgs}
+        numpy==1.10.4 {pkgs}
+    """)
+    try:
+        tests = get_tests(fn)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    names = [t.name for t in tests]
+    assert names == ['scipy-old1-3.5', 'scipy-old1-3.6', 'scipy-old2-3.5', 'scipy-old2-3.6']
+    assert all(t.section == 'scipy' for t in tests)
+
+    t = tests[1]
+    assert t.python == '3.6'
+    assert t.run_cmd == 'python3.6 -mpytest --pyarg scipy'
+    assert t.old_install == ['numpy==1.11.3', 'pytest', 'Cython']
+    assert t.new_install == ['numpy==1.12.0', 'pytest', 'Cython']
+
+    # Cells with the same python share the 'new' environment
+    jobs = group_tests(tests)
+    assert [[t.name for t in job] for job in jobs] == [['scipy-old1-3.5', 'scipy-old2-3.5'],
+                                                       ['scipy-old1-3.6', 'scipy-old2-3.6']]
+
+
+def test_interpolation_cycle():
+    tmpdir, fn = write_config("""
+    [DEFAULT]
+    a = {b}
+    b = x {a}
+    """)
+    try:
+        p = configparser.RawConfigParser()
+        p.read(fn)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    config = Config(p)
+    with pytest.raises(ValueError):
+        config.get('DEFAULT', 'a')
+    assert config.get('DEFAULT', 'c', 'default') == 'default'
@@ -0,0 +1,106 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+from testrig.cythoncache import CythonCache, get_key
+from testrig.sitehook import create_hook_dir
+
+
+class Options(object):
+    cplus = False
+    language_level = 3
+    compiler_directives = {}
+
+
+def write_file(filename, text):
+    with open(filename, 'w') as f:
+        f.write(text)
+
+
+def test_get_key():
+    pytest.importorskip('Cython')
+
+    tmpdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(tmpdir)
+        write_file('a.pyx', 'include "b.pxi"\ndef f():\n    return g()\n')
+        write_file('b.pxi', 'def g():\n    return 1\n')
+
+        key = get_key('a.pyx', Options(), 'a')
+        assert key == get_key(os.path.abspath('a.pyx'), Options(), 'a')
+
+        # Options, module name and included files are part of the key
+        options = Options()
+        options.cplus = True
+        assert get_key('a.pyx', options, 'a') != key
+        assert get_key('a.pyx', Options(), 'pkg.a') != key
+
+        write_file('b.pxi', 'def g():\n    return 2\n')
+        assert get_key('a.pyx', Options(), 'a') != key
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmpdir)
+
+
+def test_cache_round_trip():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = CythonCache(os.path.join(tmpdir, 'cache'))
+        src_dir = os.path.join(tmpdir, 'src')
+        os.makedirs(src_dir)
+        source = os.path.join(src_dir, 'a.pyx')
+        write_file(source, 'def f(): pass\n')
+        write_file(os.path.join(src_dir, 'a.c'), '/* a.c */\n')
+        write_file(os.path.join(src_dir, 'a.h'), '/* a.h */\n')
+
+        assert cache.load('abcdef', source) is None
+        cache.store('abcdef', source, os.path.join(src_dir, 'a.c'),
+                    [os.path.join(src_dir, 'a.h'), None, os.path.join(src_dir, 'missing.pxi')])
+
+        # Restored next to a source elsewhere
+        other_dir = os.path.join(tmpdir, 'other')
+        os.makedirs(other_dir)
+        c_file = cache.load('abcdef', os.path.join(other_dir, 'a.pyx'))
+        assert c_file == os.path.join(other_dir, 'a.c')
+        assert sorted(os.listdir(other_dir)) == ['a.c', 'a.h']
+        with open(c_file) as f:
+            assert f.read() == '/* a.c */\n'
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_patched_run_pipeline():
+    # Cython imported in a command run with the site hooks uses the cache
+    pytest.importorskip('Cython')
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        hook_dir = create_hook_dir(os.path.join(tmpdir, 'hooks'))
+        cache_dir = os.path.join(tmpdir, 'cache')
+        write_file(os.path.join(tmpdir, 'a.pyx'), 'def f():\n    return 1\n')
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = hook_dir
+        env['TESTRIG_CYTHON_CACHE'] = cache_dir
+        cmd = [sys.executable, '-m', 'cython', '-3', 'a.pyx']
+
+        subprocess.check_call(cmd, cwd=tmpdir, env=env)
+        entries = [os.path.join(dirpath, fn) for dirpath, dirnames, filenames in os.walk(cache_dir)
+                   for fn in filenames if fn == '0']
+        assert len(entries) == 1
+
+        # The second run restores the cached file instead of cythonizing
+        write_file(entries[0], '/* from cache */\n')
+        os.unlink(os.path.join(tmpdir, 'a.c'))
+        subprocess.check_call(cmd, cwd=tmpdir, env=env)
+        with open(os.path.join(tmpdir, 'a.c')) as f:
+            assert f.read() == '/* from cache */\n'
+    finally:
+        shutil.rmtree(tmpdir)
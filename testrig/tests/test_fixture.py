@@ -0,0 +1,85 @@
+from __future__ import absolute_import, division, print_function
+
+import io
+import os
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+from testrig import gitcache
+from testrig.fixture import VenvFixture
+
+
+def test_venv_batch_install(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        f = VenvFixture(os.path.join(tmpdir, 'cache'), io.StringIO(), print_logged=lambda *a: None,
+                        build_deps=['setuptools', 'Cython'])
+        commands = []
+        monkeypatch.setattr(f, 'run_pip', lambda cmd, cwd=None: commands.append(cmd))
+        monkeypatch.setattr(f, 'get_pip_install_args', lambda: [])
+
+        f.install_spec(['pytest', 'six', '--no-binary', 'numpy==1.26', 'scipy',
+                        '--binary', 'dask[complete]'])
+
+        base = ['install', '--upgrade', '--upgrade-strategy', 'only-if-needed']
+        assert commands == [
+            base + ['setuptools', 'Cython'],
+            base + ['pytest', 'six'],
+            # The dependencies of source-built packages too are built
+            base + ['--force-reinstall', '--no-binary', ':all:', 'numpy==1.26', 'scipy'],
+            base + ['dask[complete]'],
+        ]
+        assert [label for label, duration in f.part_durations] == [
+            'pytest six', 'numpy==1.26 scipy', 'dask[complete]']
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def git(*args, **kwargs):
+    cmd = ['git', '-c', 'user.name=t', '-c', 'user.email=t@example.com'] + list(args)
+    return subprocess.check_output(cmd, **kwargs).decode('ascii').strip()
+
+
+def test_offline_git_install(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmpdir, 'src')
+        git('init', '-q', src)
+        git('commit', '-q', '--allow-empty', '-m', 'a', cwd=src)
+        git('checkout', '-q', '-b', 'dev', cwd=src)
+        git('commit', '-q', '--allow-empty', '-m', 'b', cwd=src)
+        fetched = git('rev-parse', 'HEAD', cwd=src)
+
+        log = open(os.path.join(tmpdir, 'build.log'), 'w')
+        f = VenvFixture(os.path.join(tmpdir, 'cache'), log, print_logged=lambda *a: None,
+                        offline=True)
+        monkeypatch.setattr(f, 'run_python_script', lambda *a, **kw: None)
+        monkeypatch.setattr(f, 'run_pip', lambda *a, **kw: None)
+        for d in (f.code_dir, f.repo_cache_dir):
+            os.makedirs(d)
+
+        with pytest.raises(OSError):
+            f._git_install('pkg', src, 'dev')
+
+        gitcache.fetch(f.get_cached_repo('pkg'), src)
+        git('commit', '-q', '--allow-empty', '-m', 'c', cwd=src)
+
+        # The branch as last fetched, not as in the cloned cache
+        f._git_install('pkg', src, 'dev')
+        assert f.git_revisions['pkg'] == (src, fetched)
+        f._git_install('pkg', src, None)
+        assert f.git_revisions['pkg'] == (src, fetched)
+
+        gitcache.fetch(f.get_cached_repo('pkg'), src)
+        f._git_install('pkg', src, 'dev')
+        assert f.git_revisions['pkg'] == (src, git('rev-parse', 'HEAD', cwd=src))
+
+        # Other urls of the package are not in the cache
+        with pytest.raises(OSError):
+            f._git_install('pkg', src + '/.', 'dev')
+        log.close()
+    finally:
+        shutil.rmtree(tmpdir)
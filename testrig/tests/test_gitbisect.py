@@ -0,0 +1,32 @@
+from __future__ import absolute_import, division, print_function
+
+from testrig.gitbisect import Bisection
+
+
+def test_bisection_groups():
+    commits = ['c{0}'.format(j) for j in range(11)]
+    first_bad = {'a': 3, 'b': 3, 'c': 8, 'd': 10}
+    bisection = Bisection(commits, sorted(first_bad))
+
+    steps = 0
+    while True:
+        index = bisection.next_commit()
+        if index is None:
+            break
+        steps += 1
+        outcomes = dict((test_id, index >= first_bad[test_id])
+                        for test_id in bisection.get_tests(index))
+        bisection.update(index, outcomes)
+
+    assert bisection.get_results() == {'c3': ['a', 'b'], 'c8': ['c'], 'c10': ['d']}
+    # Tests with the same range share the builds
+    assert steps <= 7
+
+
+def test_bisection_undetermined():
+    bisection = Bisection(['c0', 'c1', 'c2'], ['a', 'b'])
+    assert bisection.next_commit() == 1
+    bisection.update(1, {'a': True})
+    assert bisection.next_commit() is None
+    assert bisection.get_results() == {'c1': ['a']}
+    assert bisection.undetermined == set(['b'])
@@ -0,0 +1,74 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+
+from testrig import cli
+from testrig.history import History
+
+
+def make_result(new_cases, old_cases=None):
+    r = cli.TestResult('scipy')
+    r.test_count = len(new_cases)
+    r.fail_new_count = r.fail_same_count = r.warn_new_count = r.warn_same_count = 0
+    r.timings = {'build-new': 10.0, 'test-new': 2.0}
+    for side, cases in (('old', old_cases or {}), ('new', new_cases)):
+        r.sides[side] = dict(fingerprint='abc', spec='{}', info='numpy 1.0', status='ok',
+                             test_count=len(cases), cases=cases)
+    return r
+
+
+def test_history_first_failure():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        history = History(os.path.join(tmpdir, 'history.sqlite'))
+
+        ok = {'t.a': ('passed', 0.001), 't.b': ('passed', 0.5)}
+        bad = {'t.a': ('failed', 0.001), 't.b': ('passed', 0.5)}
+        runs = [history.add_run([make_result(cases)], 1000.0 + j)
+                for j, cases in enumerate([ok, bad, ok, bad, bad])]
+
+        items = history.get_test_history('scipy', 't.a')
+        assert [x[2] for x in items] == ['failed', 'failed', 'passed', 'failed', 'passed']
+        assert history.get_test_history('scipy', 't.b')[0][3] == 0.5
+
+        first_fail, last_pass = history.get_first_failure('scipy', 't.a')
+        assert first_fail[0] == runs[3]
+        assert last_pass[0] == runs[2]
+
+        assert history.get_new_failures(runs[-1], 'scipy') == ['t.a']
+        assert history.get_expected_durations(['scipy', 'numpy']) == {
+            'scipy': {'build-new': 10.0, 'test-new': 2.0}}
+
+        # passing fast tests are not stored
+        count, = history.conn.execute("SELECT COUNT(*) FROM outcomes WHERE test_id = "
+                                      "(SELECT id FROM names WHERE name = 't.a')").fetchone()
+        assert count == 3
+        history.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_history_flaky_tests():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        history = History(os.path.join(tmpdir, 'history.sqlite'))
+
+        cases = {'t.a': ('failed', 0.001), 't.b': ('failed', 0.001)}
+        reruns = [{'t.a': ('flaky', {('new', 'pass'): 1}),
+                   't.b': ('regression', {('new', 'fail'): 1})},
+                  {'t.a': ('known-flaky', {})},
+                  {'t.a': ('known-flaky', {})}]
+        for j, rerun in enumerate(reruns):
+            r = make_result(cases)
+            r.reruns = rerun
+            history.add_run([r], 1000.0 + j)
+
+        assert history.get_flaky_tests(['scipy', 'numpy']) == {'scipy': set(['t.a'])}
+
+        # known-flaky runs alone keep the test in the set
+        assert history.get_flaky_tests(['scipy'], num_runs=2) == {'scipy': set(['t.a'])}
+        history.close()
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,36 @@
+from __future__ import absolute_import, division, print_function
+
+from testrig.importtime import parse_import_runs, compare_import_times, get_import_cmd
+
+
+def make_output(heavy_us, runs=5):
+    lines = ["import time: self [us] | cumulative | imported package",
+             "import time:       100 |        100 |   json"]
+    for j in range(runs):
+        lines.append("testrig: import run {0}/{1}".format(j + 1, runs))
+        lines.append("import time: self [us] | cumulative | imported package")
+        lines.append("import time:       {0} |       {1} |     pkg.core".format(900 + j, 1000 + j))
+        if heavy_us:
+            lines.append("import time:       {0} |       {0} |     pkg.heavy".format(heavy_us + j))
+        lines.append("import time:        50 |       {0} |   pkg".format(1050 + 2*j + heavy_us))
+    return "\n".join(lines)
+
+
+def test_import_times():
+    assert get_import_cmd(['pkg', 'numpy']) == "python -X importtime -c 'import pkg; import numpy'"
+
+    old = parse_import_runs(make_output(0))
+    new = parse_import_runs(make_output(5000))
+
+    # The warm-up run is skipped
+    assert 'json' not in old
+    assert old['pkg.core'] == [1000e-6, 1001e-6, 1002e-6, 1003e-6, 1004e-6]
+
+    regressions = compare_import_times(['pkg'], old, new)
+    assert len(regressions) == 1
+    module, ratio, old_stats, new_stats, offenders = regressions[0]
+    assert module == 'pkg'
+    assert ratio > 5
+    assert offenders == [('pkg.heavy', None, 5002e-6)]
+
+    assert compare_import_times(['pkg'], old, old) == []
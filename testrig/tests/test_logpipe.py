@@ -0,0 +1,75 @@
+from __future__ import absolute_import, division, print_function
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+
+from testrig.logpipe import LogPipeline, rotate_logs, open_log, read_log
+from testrig.monitor import LogFollower
+from testrig.process import run_process
+
+
+def test_compressed_log_tail():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmpdir, 'test.log')
+        with open(fn, 'w') as f:
+            f.write("stale\n")
+
+        log = open_log(fn, 'w', compress=True)
+        assert log.name == fn + '.gz'
+        assert not os.path.exists(fn)
+
+        follower = LogFollower(log.name)
+        log.write("test_a (mod.Test) ... ok\n")
+        log.flush()
+        assert follower.read()
+        assert (follower.test_count, follower.fail_count) == (1, 0)
+
+        # Output of a command goes through a pipe
+        run_process([sys.executable, '-c', 'print("test_b (mod.Test) ... FAIL")'], log)
+        assert log.bytes_written == follower.size + len("test_b (mod.Test) ... FAIL\n")
+        assert follower.read()
+        assert (follower.test_count, follower.fail_count) == (2, 1)
+        assert read_log(log.name) == "test_a (mod.Test) ... ok\ntest_b (mod.Test) ... FAIL\n"
+        log.close()
+
+        # Appending adds a gzip member
+        with open_log(fn, 'a', compress=True) as log:
+            log.write("more\n")
+        assert read_log(fn + '.gz').endswith("FAIL\nmore\n")
+        assert follower.read()
+        assert follower.size == len(read_log(fn + '.gz'))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_rotate_logs():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmpdir, 'testrig.log')
+        for j in range(4):
+            rotate_logs(fn, keep=2)
+            with open(fn, 'w') as f:
+                f.write(str(j))
+
+        assert sorted(os.listdir(tmpdir)) == ['testrig.log', 'testrig.log.1', 'testrig.log.2']
+        for name, content in [('testrig.log', '3'), ('testrig.log.1', '2'), ('testrig.log.2', '1')]:
+            with open(os.path.join(tmpdir, name)) as f:
+                assert f.read() == content
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_log_pipeline():
+    streams = [io.StringIO(), io.StringIO()]
+    pipeline = LogPipeline(streams)
+    pipeline.start()
+    for j in range(100):
+        pipeline.put(u"{0}\n".format(j))
+    pipeline.stop()
+
+    expected = u"".join(u"{0}\n".format(j) for j in range(100))
+    assert [stream.getvalue() for stream in streams] == [expected, expected]
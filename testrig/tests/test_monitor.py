@@ -0,0 +1,31 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+
+from testrig.monitor import LogFollower
+
+
+def test_log_follower_incremental():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmpdir, 'test.log')
+        follower = LogFollower(fn)
+        assert not follower.read()
+
+        with open(fn, 'w') as f:
+            f.write("test_a (mod.Test) ... ok\ntest_b (mod.Test) ... FAIL\n"
+                    "mod/test_x.py::test_c PASS")
+        assert follower.read()
+        assert (follower.test_count, follower.fail_count) == (2, 1)
+
+        # Partial line completed
+        with open(fn, 'a') as f:
+            f.write("ED\nmod/test_y.py ..F.s  [ 50%]\n")
+        assert follower.read()
+        assert (follower.test_count, follower.fail_count) == (8, 2)
+        assert follower.size == os.path.getsize(fn)
+        assert not follower.read()
+    finally:
+        shutil.rmtree(tmpdir)
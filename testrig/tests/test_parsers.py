@@ -5,6 +5,9 @@ import textwrap
 import shutil
 import tempfile
 
+import pytest
+
+from testrig import parser
 from testrig.parser import get_parser
 
 
@@ -65,3 +68,90 @@ def test_nose_parser_basic():
     assert warns == expected, warns
     assert test_count == 3, test_count
     assert err_msg is None
+
+
+def test_nose_parser_details():
+    text = textwrap.dedent("""
+    test_a (mod.T) ... ok
+    test_b (mod.T) ... FAIL
+    test_c (mod.T) ... skipped 'no'
+    test_d (mod.T) ... /path/mod.py:1: DeprecationWarning: foo
+      bar()
+    ok
+
+    ======================================================================
+    FAIL: test_b (mod.T)
+    ----------------------------------------------------------------------
+    bbb
+
+    ----------------------------------------------------------------------
+    Ran 4 tests in 0.002s
+    """)
+
+    details = {}
+    parser = get_parser('nose')
+    failures, warns, test_count, err_msg = parser(text, None, details=details)
+    assert sorted(failures.keys()) == ['test_b (mod.T)']
+    assert details['cases'] == {'test_a (mod.T)': ('passed', None),
+                                'test_b (mod.T)': ('failed', None),
+                                'test_c (mod.T)': ('skipped', None),
+                                'test_d (mod.T)': ('passed', None)}
+
+
+def test_junit_parser_details():
+    text = textwrap.dedent("""\
+    <?xml version="1.0" encoding="utf-8"?>
+    <testsuites><testsuite name="pytest" tests="3">
+    <testcase classname="pkg.test_a" name="test_ok" time="0.5"/>
+    <testcase classname="pkg.test_a" name="test_bad" time="0.1"><failure message="x">bbb</failure></testcase>
+    <testcase classname="pkg.test_a" name="test_skip" time="0"><skipped/></testcase>
+    </testsuite></testsuites>
+    """)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tmpdir, 'junit.xml'), 'w') as f:
+            f.write(text)
+        details = {}
+        parser = get_parser('junit:junit.xml')
+        failures, warns, test_count, err_msg = parser('', tmpdir, details=details)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    assert err_msg is None
+    assert test_count == 3
+    assert sorted(failures.keys()) == ['pkg.test_a.test_bad']
+    assert details['cases'] == {'pkg.test_a.test_ok': ('passed', 0.5),
+                                'pkg.test_a.test_bad': ('failed', 0.1),
+                                'pkg.test_a.test_skip': ('skipped', 0.0)}
+
+
+@pytest.mark.parametrize('min_items', [1, parser.PARALLEL_MIN_ITEMS])
+def test_junit_parser_multiple_files(min_items, monkeypatch):
+    # Parsed in a pool of processes, or sequentially
+    monkeypatch.setattr(parser, 'PARALLEL_MIN_ITEMS', min_items)
+
+    cases = ['<testcase classname="m{0}" name="t{1}" time="0.1">{2}</testcase>'.format(
+                 j % 3, j, '<failure>x{0}</failure>'.format(j) if j % 4 == 0 else '')
+             for j in range(20)]
+    # Duplicate test id in two files
+    cases.append(cases[5])
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(tmpdir, 'parts'))
+        for j in range(3):
+            with open(os.path.join(tmpdir, 'parts', 'junit-{0}.xml'.format(j)), 'w') as f:
+                f.write('<testsuite>' + "".join(cases[7*j:7*j + 7]) + '</testsuite>')
+        with open(os.path.join(tmpdir, 'all.xml'), 'w') as f:
+            f.write('<testsuite>' + "".join(cases) + '</testsuite>')
+
+        expected = get_parser('junit:all.xml')('', tmpdir)
+        for param in ('parts', 'parts/junit-*.xml'):
+            details = {}
+            result = get_parser('junit:' + param)('', tmpdir, details=details)
+            assert result == expected
+            assert details['notes'] == ["test id 'm2.t5' appears in both "
+                                        "parts/junit-0.xml and parts/junit-2.xml"]
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,57 @@
+from __future__ import absolute_import, division, print_function
+
+import io
+import shutil
+import tempfile
+import threading
+
+from testrig import cli
+from testrig.pipeline import Prefetcher
+
+
+def test_prefetcher_stop():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        started = threading.Event()
+        release = threading.Event()
+
+        def run_first():
+            started.set()
+            release.wait()
+
+        prefetcher = Prefetcher(tmpdir, io.StringIO(), num_workers=1)
+        prefetcher.start()
+        threads = list(prefetcher._threads)
+        first = prefetcher._submit('first', run_first)
+        second = prefetcher._submit('second', lambda: None)
+        assert started.wait(10)
+
+        # The running task finishes, the queued one is cancelled
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        prefetcher.stop()
+        timer.join()
+
+        assert first.done() and first.error is None
+        assert second.done() and isinstance(second.error, OSError)
+        assert not any(thread.is_alive() for thread in threads)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_prefetcher_submit_tests():
+    tests = [cli.Test('a', 'six', 'six git+https://example.com/pkg.git', 'true', 'junit', 'venv',
+                      '', '.', 'python'),
+             cli.Test('b', 'six', 'six', 'true', 'junit', 'venv', '', '.', 'python'),
+             cli.Test('c', 'six', 'git+https://example.com/pkg.git', 'true', 'junit', 'venv',
+                      '', '.', 'python', build_deps='setuptools')]
+
+    # Not started: the tasks are only queued
+    prefetcher = Prefetcher('wheelhouse', io.StringIO())
+    prefetcher.submit_tests(tests, {}, git_cache=False)
+    keys = set(prefetcher._tasks)
+
+    # Isolated builds need the build backend, unless there are build_deps
+    assert keys == set([('download', 'python', 'six', True),
+                        ('download', 'python', 'setuptools', True),
+                        ('download', 'python', 'wheel', True)])
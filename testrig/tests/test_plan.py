@@ -0,0 +1,41 @@
+from __future__ import absolute_import, division, print_function
+
+from testrig.plan import make_plan
+
+
+class FakeTest(object):
+    def __init__(self, name):
+        self.name = name
+        self.python = 'python3'
+
+
+def test_plan_longest_first():
+    tests = [FakeTest(name) for name in ('a', 'b', 'c', 'd')]
+    expected = {'a': {'build-new': 10.0},
+                'b': {'build-new': 30.0, 'test-new': 10.0},
+                'c': {'build-new': 20.0}}
+    plan = make_plan(tests, expected, num_slots=2)
+
+    # 'd' has no history: assumed long
+    assert [job.name for job in plan.jobs] == ['b', 'd', 'c', 'a']
+    assert [job.slot for job in plan.jobs] == [0, 1, 0, 1]
+    assert plan.makespan == 60.0
+
+    plan = make_plan(tests, expected, num_slots=2, order=False)
+    assert [job.name for job in plan.jobs] == ['a', 'b', 'c', 'd']
+    assert plan.makespan == 70.0
+
+
+def test_plan_cache_reuse():
+    tests = [FakeTest('a'), FakeTest('b')]
+    expected = {'a': {'build-new': 100.0}, 'b': {'build-new': 90.0}}
+    parts = {'a': {'new': {'numpy': 80.0}}, 'b': {'new': {'numpy': 70.0, 'six': 1.0}}}
+    cached = {'numpy': 10.0, 'six': 1.0}
+
+    plan = make_plan(tests, expected, parts, cached, num_slots=1)
+    assert [job.name for job in plan.jobs] == ['a', 'b']
+    assert plan.jobs[1].reused == [('new', 'numpy', 'a', 60.0)]
+    assert plan.makespan == 100.0 + 30.0
+
+    plan = make_plan(tests, expected, parts, cached, num_slots=1, shared_cache=False)
+    assert plan.makespan == 190.0
@@ -0,0 +1,50 @@
+from __future__ import absolute_import, division, print_function
+
+import time
+import tempfile
+
+import pytest
+
+from testrig.process import Limits, ProcessTimeout, run_process, parse_duration, parse_size
+
+
+def test_run_process_limits():
+    with tempfile.TemporaryFile() as log:
+        assert run_process(['sh', '-c', 'echo ok'], log, Limits(timeout=10), poll_interval=0.1) == 0
+
+        start = time.time()
+        with pytest.raises(ProcessTimeout) as exc:
+            run_process(['sh', '-c', 'sleep 30 & sleep 30'], log, Limits(timeout=0.5),
+                        poll_interval=0.1)
+        assert exc.value.reason == 'timeout'
+        assert time.time() - start < 10
+
+        # Output keeps a command alive until the timeout
+        with pytest.raises(ProcessTimeout) as exc:
+            run_process(['sh', '-c', 'echo a; sleep 0.3; echo b; sleep 30'], log,
+                        Limits(stall_timeout=0.6), poll_interval=0.1)
+        assert exc.value.reason == 'stall'
+
+
+def test_parse_limits():
+    assert parse_duration('90') == 90
+    assert parse_duration('2h') == 7200
+    assert parse_duration('') is None
+    assert parse_size('4G') == 4 * 2**30
+    assert parse_size('512MB') == 512 * 2**20
+    with pytest.raises(ValueError):
+        parse_duration('soon')
+
+
+def test_run_process_rlimits():
+    resource = pytest.importorskip('resource')
+    cmd = ['sh', '-c', 'ulimit -v; ulimit -t; sh -c "ulimit -v"']
+    limits = Limits(process_memory=2**30, process_cpu_time=600)
+    with tempfile.TemporaryFile() as log:
+        run_process(cmd, log, limits, poll_interval=0.1)
+        run_process('ulimit -v', log, limits, shell=True, poll_interval=0.1)
+        log.seek(0)
+        assert log.read().split() == [b'1048576', b'600', b'1048576', b'1048576']
+
+    # The limits are not set in the parent
+    assert resource.getrlimit(resource.RLIMIT_CPU)[0] != 600
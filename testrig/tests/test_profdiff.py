@@ -0,0 +1,85 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import textwrap
+import subprocess
+import cProfile
+
+import pytest
+
+from testrig.profdiff import get_function_name, load_profiles, diff_profiles, format_diff
+
+
+def work(n):
+    return sum(range(n))
+
+
+def test_get_function_name():
+    assert get_function_name(('/x/env/lib/python3.6/site-packages/numpy/core/fromnumeric.py', 10, 'sum')) == \
+        'numpy/core/fromnumeric.py:sum'
+    assert get_function_name(('/usr/lib/python3.6/json/decoder.py', 332, 'decode')) == \
+        'json/decoder.py:decode'
+    assert get_function_name(('~', 0, "<built-in method builtins.sum>")) == \
+        "<built-in method builtins.sum>"
+
+
+def test_profile_diff():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for side, count in (('old', 1), ('new', 20)):
+            for j in range(2):
+                profile = cProfile.Profile()
+                profile.enable()
+                for k in range(count):
+                    work(100000)
+                profile.disable()
+                profile.dump_stats(os.path.join(tmpdir, '{0}-{1}.prof'.format(side, j)))
+
+        assert load_profiles(os.path.join(tmpdir, 'missing')) is None
+        old = load_profiles(os.path.join(tmpdir, 'old'))
+        new = load_profiles(os.path.join(tmpdir, 'new'))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    name = [key for key in new if key.endswith(':work')][0]
+    assert old[name][0] == 2
+    assert new[name][0] == 40
+
+    rows = diff_profiles(old, new)
+    assert name in [row[0] for row in rows[:3]]
+
+    text = format_diff(old, new)
+    assert name in text
+    assert "2/40" in text
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs os.fork")
+def test_profile_fork():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        prefix = os.path.join(tmpdir, 'new')
+        script = textwrap.dedent("""
+        import os, sys
+        from testrig.profdiff import install
+        install(sys.argv[1])
+        pid = os.fork()
+        if pid == 0:
+            sys.exit(0)
+        os.waitpid(pid, 0)
+        print(pid)
+        """)
+        out = subprocess.check_output([sys.executable, '-c', script, prefix],
+                                      cwd=os.path.dirname(os.path.dirname(os.path.dirname(
+                                          os.path.abspath(__file__)))))
+        child_pid = int(out.decode('ascii'))
+
+        # Each process writes a profile of its own at exit
+        names = sorted(os.listdir(tmpdir))
+        assert len(names) == 2
+        assert 'new-{0}.prof'.format(child_pid) in names
+        assert load_profiles(prefix) is not None
+    finally:
+        shutil.rmtree(tmpdir)
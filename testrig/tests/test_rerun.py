@@ -0,0 +1,21 @@
+from __future__ import absolute_import, division, print_function
+
+from testrig.rerun import classify, format_rerun_cmd
+
+
+def test_classify():
+    assert classify({('new', 'fail'): 3, ('old', 'pass'): 3}) == 'regression'
+    assert classify({('new', 'fail'): 2, ('new', 'pass'): 1, ('old', 'pass'): 3}) == 'flaky'
+    assert classify({('new', 'fail'): 3, ('old', 'fail'): 1, ('old', 'pass'): 2}) == 'flaky'
+    assert classify({('new', 'fail'): 3, ('old', 'fail'): 3}) == 'environment'
+    assert classify({}) == 'unknown'
+
+
+def test_format_rerun_cmd():
+    ids = ['scipy.linalg.tests.test_basic.TestSolve.test_a',
+           "pkg/test_x.py::test_b[1-2]",
+           "test_c (mod.T)"]
+    cmd = format_rerun_cmd("pytest $TESTS -k $TESTS_K", ids)
+    assert cmd == ("pytest scipy.linalg.tests.test_basic.TestSolve.test_a "
+                   "'pkg/test_x.py::test_b[1-2]' 'test_c (mod.T)' "
+                   "-k 'test_a or test_b or test_c'")
@@ -0,0 +1,41 @@
+from __future__ import absolute_import, division, print_function
+
+from testrig.shard import parse_collected, make_shards, format_shard_cmd, merge_results
+
+
+def test_make_shards():
+    text = ("pkg/test_a.py::test_1\npkg/test_a.py::test_2\npkg/test_a.py::test_3\n"
+            "pkg/test_b.py::test_1\npkg/test_c.py::T::test_1[x y]\n\n"
+            "5 tests collected in 0.01s\n")
+    test_ids = parse_collected(text)
+    assert len(test_ids) == 5
+
+    shards = make_shards(test_ids, 2, 'module')
+    assert shards == [['pkg/test_a.py'], ['pkg/test_b.py', 'pkg/test_c.py']]
+
+    durations = {'pkg/test_a.py::test_1': 10.0, 'pkg/test_b.py::test_1': 6.0}
+    shards = make_shards(test_ids, 2, 'duration', durations)
+    assert shards[0] == ['pkg/test_a.py::test_1']
+    assert len(shards[1]) == 4
+
+    # No empty shards
+    assert len(make_shards(test_ids[:1], 4, 'id')) == 1
+
+    cmd = format_shard_cmd("pytest --junit-xml=junit-$SHARD.xml $SHARD_TESTS", 1, 2, shards[0])
+    assert cmd == "pytest --junit-xml=junit-1.xml pkg/test_a.py::test_1"
+
+
+def test_merge_results():
+    results = [({'a': 'fail'}, {}, 2, None, {'cases': {'a': ('failed', 0.1), 'b': ('passed', 0.2)}}),
+               ({}, {'w': 'warn'}, 1, None, {'cases': {'c': ('passed', 0.3)}})]
+    failures, warns, test_count, err_msg, details = merge_results(results)
+    assert failures == {'a': 'fail'}
+    assert warns == {'w': 'warn'}
+    assert test_count == 3
+    assert err_msg is None
+    assert sorted(details['cases']) == ['a', 'b', 'c']
+
+    results[1] = ({}, {}, -1, "ERROR: no output", {})
+    failures, warns, test_count, err_msg, details = merge_results(results)
+    assert test_count == -1
+    assert err_msg == "shard 1: ERROR: no output"
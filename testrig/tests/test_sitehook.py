@@ -0,0 +1,29 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+from testrig.sitehook import create_hook_dir
+
+
+def test_next_sitecustomize():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        hook_dir = create_hook_dir(os.path.join(tmpdir, 'hooks'))
+        other_dir = os.path.join(tmpdir, 'other')
+        os.makedirs(other_dir)
+        with open(os.path.join(other_dir, 'sitecustomize.py'), 'w') as f:
+            f.write("import sys\nsys.stdout.write('other sitecustomize\\n')\n")
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([hook_dir, hook_dir, other_dir])
+        out = subprocess.check_output(
+            [sys.executable, '-c', 'import sitecustomize; print(sitecustomize.__file__)'],
+            env=env, stderr=subprocess.STDOUT)
+        lines = out.decode('utf-8').splitlines()
+        assert lines == ['other sitecustomize', os.path.join(hook_dir, 'sitecustomize.py')]
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,45 @@
+"""
+Local wheelhouse shared by all fixtures.
+
+Distributions for the pinned package specifications are downloaded
+once into the wheelhouse, and the fixtures then install from it via
+``pip install --find-links``.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import subprocess
+
+
+def download(python, spec, binary_ok, wheelhouse_dir, run_cmd=subprocess.check_call):
+    """
+    Download a distribution (and its dependencies) into the wheelhouse.
+
+    The files are downloaded to a temporary directory first and then
+    moved into the wheelhouse, so that concurrently running pip installs
+    never see partially written files.
+
+    Raises
+    ------
+    subprocess.CalledProcessError, OSError
+        If the download fails.
+
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='.download-', dir=wheelhouse_dir)
+    try:
+        cmd = [python, '-mpip', 'download', '--dest', tmp_dir,
+               '--find-links', wheelhouse_dir]
+        if not binary_ok:
+            cmd += ['--no-binary', ':all:']
+        cmd += [spec]
+        run_cmd(cmd)
+
+        for fn in os.listdir(tmp_dir):
+            dst = os.path.join(wheelhouse_dir, fn)
+            if not os.path.exists(dst):
+                os.rename(os.path.join(tmp_dir, fn), dst)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)